@@ -1,34 +1,33 @@
 from functools import wraps
 
-from aiocache import cached
 from flask import Flask, request, redirect, url_for, flash
 
+from src.database.models.auth import SessionToken
 from src.database.models.users import User
-from src.database.sql import Session
-from src.database.sql.user import UserORM
+from src.main import user_controller
 
 app = Flask(__name__)
 
 
-# Your route handlers go here
-@cached(ttl=3600)
-async def get_user_details(user_id: str) -> User:
-    """Get the details for a user by their ID."""
-
-    # Assuming you have a database session and engine configured
-    with Session() as session:
-        # Perform the query to retrieve the user based on the user_id
-        user = session.query(UserORM).filter(UserORM.user_id == user_id).first()
-        return User(**user.to_dict()) if user else None
+async def get_user_details(session_token: SessionToken | None) -> User | None:
+    """
+        **get_user_details**
+            the user a verified session token was issued to - see UserController.get_authenticated_user
+    :param session_token:
+    :return:
+    """
+    if session_token is None:
+        return None
+    return await user_controller.get_authenticated_user(session_token=session_token)
 
 
 def login_required(route_function):
     @wraps(route_function)
     async def decorated_function(*args, **kwargs):
-        auth_cookie = request.cookies.get('auth')
-        if auth_cookie:
-            # Assuming you have a function to retrieve the user details based on the user_id
-            user = await get_user_details(auth_cookie)
+        # NOTE forged, expired and malformed cookies are rejected without touching the cache or database
+        session_token = user_controller.read_session_token(request.cookies.get('auth'))
+        if session_token:
+            user = await get_user_details(session_token)
             try:
                 if user:
                     return await route_function(user, *args, **kwargs)  # Inject user as a parameter
@@ -45,10 +44,9 @@ def login_required(route_function):
 def admin_login(route_function):
     @wraps(route_function)
     async def decorated_function(*args, **kwargs):
-        auth_cookie = request.cookies.get('auth')
-        if auth_cookie:
-            # Assuming you have a function to retrieve the user details based on the user_id
-            user = await get_user_details(auth_cookie)
+        session_token = user_controller.read_session_token(request.cookies.get('auth'))
+        if session_token:
+            user = await get_user_details(session_token) if session_token.is_system_admin else None
             try:
                 if user and user.is_system_admin:
                     return await route_function(user, *args, **kwargs)  # Inject user as a parameter
@@ -65,8 +63,8 @@ def admin_login(route_function):
 def user_details(route_function):
     @wraps(route_function)
     async def decorated_function(*args, **kwargs):
-        user_id = request.cookies.get('auth')
-        user: User | None = await get_user_details(user_id=user_id) if user_id else None
+        session_token = user_controller.read_session_token(request.cookies.get('auth'))
+        user: User | None = await get_user_details(session_token=session_token)
         return await route_function(user, *args, **kwargs)
 
     return decorated_function
@@ -5,25 +5,47 @@
 
     inform the client of this situation
 
-"""
+    agreements are processed as a batch - the tenants, buildings, units, companies and company admins of
+    every agreement due a notice are loaded with one query each, the notices are written in one transaction
+    and an agreement is notified once per notice for each end date it has had
 
+"""
+import uuid
 from datetime import date, timedelta, datetime
-from typing import List
+from typing import List, NamedTuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
 
 from src.database.models.companies import Company
 from src.database.models.properties import Property, Unit
 from src.database.sql import Session
-from src.database.sql.companies import UserCompanyORM
+from src.database.sql.companies import UserCompanyORM, CompanyORM
+from src.database.sql.jobs import read_watermark, advance_watermark
+from src.database.sql.lease import LeaseNoticeORM
 from src.database.sql.notifications import NotificationORM
-from src.database.sql.properties import PropertyORM
+from src.database.sql.properties import PropertyORM, UnitORM
+from src.database.sql.tenants import TenantORM
 from src.emailer import SendMail, EmailModel
 from src.database.models.tenants import Tenant
 from src.database.models.lease import LeaseAgreement
-from src.main import tenant_controller, company_controller
+from src.main import send_mail, lease_agreement_controller
 from src.config import config_instance
 
 settings = config_instance().EMAIL_SETTINGS
 
+EXPIRED = "expired"
+EXPIRING = "expiring"
+LEASE_EXPIRY_JOB = "lease_expiry"
+
+
+class ClientData(NamedTuple):
+    company: Company
+    property_: Property
+    tenant: Tenant
+    unit_: Unit | None
+    admin_ids: list[str]
+
 
 class LeaseAgreementNotifier:
     """
@@ -31,37 +53,107 @@ class LeaseAgreementNotifier:
 
     """
 
-    def __init__(self, _agreements: List[LeaseAgreement], notify_days_before: int = 30):
+    def __init__(self, _agreements: List[LeaseAgreement], notify_days_before: int = 30,
+                 session_maker: sessionmaker = Session, mailer: SendMail = send_mail, today: date | None = None):
         self.notify_days_before = notify_days_before
+        self.today = today
         self.agreements = _agreements
-        self._send_mail = SendMail()
+        self._session_maker = session_maker
+        self._send_mail = mailer
 
-    async def send_tenant_email(self, agreement: LeaseAgreement):
-        company, property_, tenant, unit_ = await self.get_client_data(agreement)
+    async def partition_agreements(self) -> tuple[list[LeaseAgreement], list[LeaseAgreement]]:
+        """
+        **partition_agreements**
+            expired agreements and agreements about to expire in a single pass
+        :return: expired, expiring
+        """
+        today = self.today or date.today()
+        expiration_threshold = today + timedelta(days=self.notify_days_before)
+        expired, expiring = [], []
+        for agreement in self.agreements if isinstance(self.agreements, list) else []:
+            if agreement.end_date < today:
+                expired.append(agreement)
+            elif agreement.end_date <= expiration_threshold:
+                expiring.append(agreement)
+        return expired, expiring
+
+    async def check_agreements_about_to_expire(self) -> list[LeaseAgreement]:
+        """
+        **check_agreements_about_to_expire**
+            this will only return agreements which are about to expire not those
+            already expired.
+        :return:
+        """
+        return (await self.partition_agreements())[1]
 
-        message, subject = await self.create_template(company, property_, tenant)
+    async def check_expired_agreements(self) -> list[LeaseAgreement]:
+        return (await self.partition_agreements())[0]
 
-        email_dict = {
-            'from_': settings.RESEND.from_,
-            'to_': tenant.email,
-            'subject_': subject,
-            'html': message
-        }
+    @staticmethod
+    def pending_notices(session, notices: list[tuple[LeaseAgreement, str]]) -> list[tuple[LeaseAgreement, str]]:
+        """
+        **pending_notices**
+            drops the notices already sent for the current end date of the agreement
+        :param session:
+        :param notices: (agreement, notice)
+        :return:
+        """
+        if not notices:
+            return []
+        sent = set(session.execute(
+            select(LeaseNoticeORM.agreement_id, LeaseNoticeORM.notice, LeaseNoticeORM.end_date).where(
+                LeaseNoticeORM.agreement_id.in_({agreement.agreement_id for agreement, _ in notices}))).all())
+        return [(agreement, notice) for agreement, notice in notices
+                if (agreement.agreement_id, notice, agreement.end_date) not in sent]
 
-        email_ = EmailModel(**email_dict)
-        await self._send_mail.send_mail_resend(email=email_)
+    @staticmethod
+    def prefetch_client_data(session, agreements: list[LeaseAgreement]) -> dict[str, ClientData]:
+        """
+        **prefetch_client_data**
+            loads everything the notices refer to with one query per table
+        :param session:
+        :param agreements:
+        :return: agreement_id -> client data, agreements whose building, company or tenant is missing are left out
+        """
+        tenants = {tenant.tenant_id: Tenant(**tenant.to_dict()) for tenant in session.scalars(
+            select(TenantORM).where(TenantORM.tenant_id.in_({agreement.tenant_id for agreement in agreements})))}
+        properties = {property_.property_id: Property(**property_.to_dict()) for property_ in session.scalars(
+            select(PropertyORM).where(PropertyORM.property_id.in_({agreement.property_id
+                                                                   for agreement in agreements})))}
+        units = {unit.unit_id: Unit(**unit.to_dict()) for unit in session.scalars(
+            select(UnitORM).where(UnitORM.unit_id.in_({agreement.unit_id for agreement in agreements})))}
+        company_ids = {property_.company_id for property_ in properties.values()}
+        companies = {company.company_id: Company(**company.to_dict()) for company in session.scalars(
+            select(CompanyORM).where(CompanyORM.company_id.in_(company_ids)))}
+        admin_ids: dict[str, list[str]] = {}
+        for user_company in session.scalars(select(UserCompanyORM).where(UserCompanyORM.company_id.in_(company_ids))):
+            if (user_company.user_level or "").casefold() == "admin":
+                admin_ids.setdefault(user_company.company_id, []).append(user_company.user_id)
+
+        client_data = {}
+        for agreement in agreements:
+            property_ = properties.get(agreement.property_id)
+            tenant = tenants.get(agreement.tenant_id)
+            company = companies.get(property_.company_id) if property_ else None
+            if property_ and tenant and company:
+                client_data[agreement.agreement_id] = ClientData(company=company, property_=property_, tenant=tenant,
+                                                                 unit_=units.get(agreement.unit_id),
+                                                                 admin_ids=admin_ids.get(company.company_id, []))
+        return client_data
 
     @staticmethod
-    async def create_template(company: Company, property_: Property, tenant: Tenant):
+    async def create_template(company: Company, property_: Property, tenant: Tenant, agreement: LeaseAgreement,
+                              notice: str = EXPIRED):
         subject = f"{property_.name} Lease Agreement Expiry Notification"
+        status = "has expired" if notice == EXPIRED else f"will expire on {agreement.end_date}"
         message = f"""
             Hi {tenant.name},
 
             Your Lease Agreement between you and {company.company_name}
             for a unit in Building / Property {property_.name}
-            has expired.
+            {status}.
 
-            If you wish to renew this lease agreement, 
+            If you wish to renew this lease agreement,
             please notify your landlord immediately: {property_.landlord}
             Contact Number: {property_.maintenance_contact}
 
@@ -73,144 +165,115 @@ class LeaseAgreementNotifier:
         return message, subject
 
     @staticmethod
-    async def get_client_data(agreement: LeaseAgreement) -> tuple[Company, Property, Tenant, Unit]:
-        property_ = await company_controller.get_company_internal(property_id=agreement.property_id)
-        company = await company_controller.get_company_internal(company_id=property_.company_id)
-        tenant = await tenant_controller.get_tenant_by_id(tenant_id=agreement.tenant_id)
-        unit_ = await company_controller.get_unit_by_unit_id_internal(unit_id=agreement.unit_id)
-        return company, property_, tenant, unit_
-
-    async def check_agreements_about_to_expire(self):
-        """
-        **check_agreements_about_to_expire**
-            this will only return agreements which are about to expire not those
-            already expired.
-        :return:
-        """
-        today = date.today()
-        expiration_threshold = today + timedelta(days=self.notify_days_before)
-        return [
-            agreement
-            for agreement in self.agreements
-            if ((agreement.end_date <= expiration_threshold) and agreement.days_left)
-        ]
-
-    async def check_expired_agreements(self):
-        today = date.today()
-        expired_agreements = [
-            agreement
-            for agreement in self.agreements
-            if agreement.end_date < today
-        ] if isinstance(self.agreements, list) else []
-        return expired_agreements
-
-    async def send_notice_to_company_admins(self, agreement: LeaseAgreement):
-        """
-        **send_notice_to_admin**
-        Admin notices will also be visible on
-        the web application as messages.
-
-        :param agreement: LeaseAgreement object
-        :return: None
-        """
-        # Retrieve the company_id ID from the property
-        company, property_, tenant, unit_ = await self.get_client_data(agreement)
-
-        # Retrieve the admin user ID for the company_id
-        user_company_list: list[UserCompanyORM] = await company_controller.user_company_id(
-            company_id=property_.company_id)
+    async def create_admin_notification_message(tenant: Tenant, company: Company, property_: Property,
+                                                unit_: Unit | None, agreement: LeaseAgreement,
+                                                notice: str = EXPIRED):
+        status = "has expired" if notice == EXPIRED else f"will expire on {agreement.end_date}"
+        unit_number = unit_.unit_number if unit_ else agreement.unit_id
+        return f"""
+            Hi Admin
 
-        if not user_company_list:
-            # Admin user not found, handle accordingly
-            return
+            A Lease Agreement for {tenant.name},
 
-        await self.create_notice_admin(company=company, property_=property_, tenant=tenant,
-                                       user_company_list=user_company_list)
 
-        # Return or perform any necessary operations
-        return
+            On Company {company.company_name}
+            for unit {unit_number} in Building / Property {property_.name}
+            {status}.
 
-    async def create_notice_admin(self, company, property_, tenant, user_company_list):
-        """
-            creates an in-app notifications which will be seen by property admins
-            when they Login
-        :param company:
-        :param property_:
-        :param tenant:
-        :param user_company_list:
-        :return:
-        """
-        with Session() as session:
-            # Create a new notification
-            for user in user_company_list:
-                if user.user_level.casefold() == "admin":
-                    message = await self.create_admin_notification_message(tenant=tenant, company=company,
-                                                                           property_=property_)
-                    subject = f'Lease Agreement Expiration : for Tenant {tenant.name}'
-                    notification = NotificationORM(
-                        user_id=user.user_id,
-                        title=subject,
-                        message=message,
-                        category='Expiration',
-                        time_read=None,
-                        is_read=False,
-                        time_created=datetime.now()
-                    )
-                    session.add(notification)
+            Consider Notifying the client if they intend to renew the agreement
 
-            session.commit()
+            Note: An Email has been sent to the client informing them of the status of their
+            lease agreement, should you wish to make a follow up here are the client details
 
-    @staticmethod
-    async def create_admin_notification_message(tenant: Tenant, company: Company, property_: Property):
-        return f"""
-            Hi Admin
-            
-            A Lease Agreement for {tenant.name},
-            
-    
-            On Company {company.company_name}
-            for a unit in Building / Property {property_.name}
-            has expired.
-    
-            Consider Notifying the client if they intend to renew the agreement 
-             
-            Note: An Email has been sent to the client informing them of the status of their 
-            lease agreement, should you wish to make a follow up here are the client details 
-            
             Name: {tenant.name}
-            Cell: {tenant.phone_number}
+            Cell: {tenant.cell}
             Email: {tenant.email}
-            Lease Start Date : {tenant.lease_start_date}
-            Lease Ended: {tenant.lease_end_date}
+            Lease Start Date : {agreement.start_date}
+            Lease Ended: {agreement.end_date}
 
             Thank you,
-                Property & Rental Manager 
+                Property & Rental Manager
                 https://rental-manager.ste
         """
 
-    async def send_notifications(self, agreement: LeaseAgreement):
-        await self.send_tenant_email(agreement=agreement)
-        await self.send_notice_to_company_admins(agreement=agreement)
-
-    async def process_expired_agreements(self):
-        """find expired lease agreements"""
-
-        expired_agreements = await self.check_expired_agreements()
-        for agreement in expired_agreements:
-            await self.send_notifications(agreement=agreement)
-
-        expiring_agreements = await self.check_agreements_about_to_expire()
-        for agreement in expiring_agreements:
-            await self.send_notifications(agreement=agreement)
+    async def process_expired_agreements(self) -> dict[str, int]:
+        """
+        **process_expired_agreements**
+            records the notices and the admin notifications in one transaction, the tenant emails are
+            queued once it has committed - the mail dispatcher workers bound how many are sent at once
+        :return: counts of the notices sent and skipped
+        """
+        expired, expiring = await self.partition_agreements()
+        notices = [(agreement, EXPIRED) for agreement in expired] + [(agreement, EXPIRING) for agreement in expiring]
+
+        emails: list[EmailModel] = []
+        with self._session_maker() as session:
+            pending = self.pending_notices(session=session, notices=notices)
+            client_data = self.prefetch_client_data(session=session,
+                                                    agreements=[agreement for agreement, _ in pending])
+            now = datetime.now()
+            notice_rows, notification_rows = [], []
+            for agreement, notice in pending:
+                data = client_data.get(agreement.agreement_id)
+                if data is None:
+                    continue
+                notice_rows.append(dict(agreement_id=agreement.agreement_id, notice=notice,
+                                        end_date=agreement.end_date, time_sent=now))
+
+                message = await self.create_admin_notification_message(
+                    tenant=data.tenant, company=data.company, property_=data.property_, unit_=data.unit_,
+                    agreement=agreement, notice=notice)
+                subject = f'Lease Agreement Expiration : for Tenant {data.tenant.name}'
+                notification_rows.extend(dict(id=str(uuid.uuid4()), user_id=user_id, title=subject, message=message,
+                                              category='Expiration', time_read=None, is_read=False,
+                                              time_created=now) for user_id in data.admin_ids)
+
+                if data.tenant.email:
+                    message, subject = await self.create_template(company=data.company, property_=data.property_,
+                                                                  tenant=data.tenant, agreement=agreement,
+                                                                  notice=notice)
+                    emails.append(EmailModel(from_=settings.RESEND.from_, to_=data.tenant.email, subject_=subject,
+                                             html_=message))
+
+            if notice_rows:
+                session.execute(insert(LeaseNoticeORM), notice_rows)
+            if notification_rows:
+                session.execute(insert(NotificationORM), notification_rows)
+            session.commit()
 
+        queued = sum(self._send_mail.enqueue(email=email) for email in emails)
+        return dict(notices=len(notice_rows), skipped=len(notices) - len(notice_rows),
+                    notifications=len(notification_rows), emails=queued)
 
-if __name__ == "__main__":
-    # Example usage
-    agreements = [
-        LeaseAgreement(agreement_id="A001", client_id="C001", expiration_date=date(2023, 6, 20)),
-        LeaseAgreement(agreement_id="A002", client_id="C002", expiration_date=date(2023, 6, 25)),
-        LeaseAgreement(agreement_id="A003", client_id="C003", expiration_date=date(2023, 6, 18)),
-    ]
 
-    notifier = LeaseAgreementNotifier(agreements)
-    notifier.process_expired_agreements()
+async def process_lease_expiry(notify_days_before: int = 30, session_maker: sessionmaker = Session,
+                               mailer: SendMail = send_mail, controller=lease_agreement_controller,
+                               today: date | None = None) -> dict[str, int]:
+    """
+    **process_lease_expiry**
+        notifies the agreements which crossed a threshold since the watermark, the watermark only
+        advances once the notices are committed so a failed run is covered again by the next one
+    :param notify_days_before:
+    :param session_maker:
+    :param mailer:
+    :param controller: lease controller the agreements are read through
+    :param today:
+    :return: counts of the agreements scanned and the notices sent
+    """
+    today = today or date.today()
+    with session_maker() as session:
+        since = read_watermark(session=session, job_name=LEASE_EXPIRY_JOB)
+
+    agreements = await controller.get_agreements_crossing_expiry(since=since, today=today,
+                                                                 notify_days_before=notify_days_before)
+    if agreements is None:
+        # NOTE the controller logged the database error, the watermark stays where it is
+        raise RuntimeError("lease expiry - unable to read lease agreements")
+    notifier = LeaseAgreementNotifier(_agreements=agreements, notify_days_before=notify_days_before,
+                                      session_maker=session_maker, mailer=mailer, today=today)
+    processed = await notifier.process_expired_agreements()
+
+    with session_maker() as session:
+        advance_watermark(session=session, job_name=LEASE_EXPIRY_JOB, watermark=today)
+        session.commit()
+    return dict(scanned=len(agreements), **processed)
@@ -3,22 +3,71 @@
     Business Logic to create invoices and statements for
     tenants
 
+    the monthly run invoices every active monthly lease agreement in a single pass - the tenants, buildings,
+    companies and unbilled charges of all the agreements are loaded up front with one query per table,
+    the invoices and their charge links are then written a chunk of agreements per transaction.
+    a lease agreement is invoiced once per billing month, running again in the same month only picks up
+    the agreements which were not invoiced yet
+
+    with more than one worker the run is partitioned by company, every company is invoiced in a process
+    of the pool with its own database connection and the results are merged in company order
+
 """
 import asyncio
-from datetime import datetime, date, timedelta
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, date
+from typing import Callable, NamedTuple
 
-from database.models.invoices import Invoice
-from src.database.sql.companies import UserCompanyORM
-from src.database.sql import Session
-from src.database.sql.invoices import InvoiceORM
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+
+from src.config import config_instance
+from src.database.models.invoices import Invoice
+from src.database.sql import Session, engine
+from src.database.sql.companies import CompanyORM, UserCompanyORM
+from src.database.sql.invoices import InvoiceORM, UserChargesORM, InvoiceChargeORM, LeaseInvoiceORM, \
+    hydrate_invoices, refresh_invoice_totals, IN_CLAUSE_CHUNK_SIZE
+from src.database.sql.lease import LeaseAgreementORM
+from src.database.sql.properties import PropertyORM
+from src.database.sql.tenants import TenantORM
+from src.database.sql.user import ProfileORM
 from src.database.models.profile import Profile
 from src.database.models.properties import Property
 from src.database.models.companies import Company
 from src.database.models.tenants import Tenant
 from src.database.models.lease import LeaseAgreement
-from src.main import lease_agreement_controller
-from src.main import tenant_controller
-from src.main import company_controller
+from src.emailer import SendMail, EmailModel
+from src.logger import init_logger
+from src.main import send_mail, lease_agreement_controller
+
+settings = config_instance().EMAIL_SETTINGS
+
+
+class LeaseBillingData(NamedTuple):
+    agreement: LeaseAgreement
+    tenant: Tenant
+    company: Company
+    property_: Property
+    profile: Profile
+    charge_ids: list[str]
+
+
+def _load_by_ids(session, column, ids: set, *criteria) -> list:
+    """
+        **_load_by_ids**
+            rows of the mapped class of column whose column value is in ids and which match criteria,
+            one IN query per chunk of ids
+    """
+    rows = []
+    ids = sorted(_id for _id in ids if _id)
+    for index in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+        rows.extend(session.scalars(select(column.class_).where(
+            column.in_(ids[index:index + IN_CLAUSE_CHUNK_SIZE]), *criteria)))
+    return rows
 
 
 class StatementsAndInvoicing:
@@ -27,39 +76,88 @@ class StatementsAndInvoicing:
         will create statements and invoices for each client
         who presently has a lease agreement
         Steps
-        1. Notices for this steps must be created
-        2.
+        1. invoice every monthly lease agreement not yet invoiced for the billing month
+        2. email the invoices of the billing month which were not sent yet
+
+        chunk_size: lease agreements invoiced per transaction
+        progress: called with (invoiced, total) after each chunk is committed
+        controller: lease controller whose invoice caches are invalidated after the invoices are written
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, session_maker: sessionmaker = Session, mailer: SendMail = send_mail, today: date | None = None,
+                 chunk_size: int = 500, progress: Callable[[int, int], None] | None = None,
+                 controller=lease_agreement_controller):
+        self._session_maker = session_maker
+        self._send_mail = mailer
+        self._controller = controller
+        self.today = today
+        self.chunk_size = chunk_size
+        self._progress = progress
+        self.logger = init_logger(self.__class__.__name__)
 
     @staticmethod
-    async def get_profile(uuid: str) -> Profile:
+    def company_profiles(session, company_ids: set[str]) -> dict[str, Profile]:
         """
-
-        :param uuid:
-        :return:
+            **company_profiles**
+                the invoice settings of a company are the profile of its admin, the defaults if it has none
+        :param session:
+        :param company_ids:
+        :return: company_id -> profile
         """
-        return Profile()
+        admins: dict[str, str] = {}
+        for user_company in _load_by_ids(session, UserCompanyORM.company_id, company_ids):
+            if (user_company.user_level or "").casefold() == "admin":
+                admins.setdefault(user_company.company_id, user_company.user_id)
+        profiles = {profile.user_id: Profile(**profile.to_dict()) for profile in _load_by_ids(
+            session, ProfileORM.user_id, set(admins.values()))}
+        return {company_id: profiles.get(admins.get(company_id)) or Profile(user_id=admins.get(company_id, ""))
+                for company_id in company_ids}
 
-    @staticmethod
-    async def monthly_lease_agreements() -> dict[str, dict[str, LeaseAgreement | Tenant | Company | Property]]:
+    async def monthly_lease_agreements(self, session, billing_month: date,
+                                       company_id: str | None = None) -> tuple[list[LeaseBillingData], int]:
         """
             **monthly_lease_agreements**
-        :return:
+                the active monthly agreements not yet invoiced for billing_month together with everything
+                their invoices refer to
+        :param session:
+        :param billing_month:
+        :param company_id: only the agreements on the buildings of this company
+        :return: billing data in agreement order, number of agreements already invoiced or missing their data
         """
-        monthly_lease_agreements: list[
-            LeaseAgreement] = await lease_agreement_controller.get_agreements_by_payment_terms()
-        _response_data = {}
-        for agreement in monthly_lease_agreements:
-            tenant: Tenant = await tenant_controller.get_tenant_by_id(tenant_id=agreement.tenant_id)
-            company: Company = await company_controller.get_company_internal(company_id=tenant.company_id)
-            property_: Property = await company_controller.get_property_by_id_internal(
-                property_id=agreement.property_id)
-            _data = dict(agreement=agreement, tenant=tenant, company=company, property=property_)
-            _response_data[agreement.agreement_id] = _data
-        return _response_data
+        statement = select(LeaseAgreementORM).where(LeaseAgreementORM.is_active == True,
+                                                    LeaseAgreementORM.payment_period == "monthly")
+        if company_id is not None:
+            statement = statement.join(PropertyORM, PropertyORM.property_id == LeaseAgreementORM.property_id).where(
+                PropertyORM.company_id == company_id)
+        agreements = [LeaseAgreement(**lease.to_dict()) for lease in session.scalars(
+            statement.order_by(LeaseAgreementORM.agreement_id))]
+        invoiced = set(session.scalars(select(LeaseInvoiceORM.agreement_id).where(
+            LeaseInvoiceORM.billing_month == billing_month)))
+        pending = [agreement for agreement in agreements if agreement.agreement_id not in invoiced]
+
+        tenants = {tenant.tenant_id: Tenant(**tenant.to_dict()) for tenant in _load_by_ids(
+            session, TenantORM.tenant_id, {agreement.tenant_id for agreement in pending})}
+        properties = {property_.property_id: Property(**property_.to_dict()) for property_ in _load_by_ids(
+            session, PropertyORM.property_id, {agreement.property_id for agreement in pending})}
+        companies = {company.company_id: Company(**company.to_dict()) for company in _load_by_ids(
+            session, CompanyORM.company_id, {property_.company_id for property_ in properties.values()})}
+        profiles = self.company_profiles(session=session, company_ids=set(companies))
+        charge_ids: dict[str, list[str]] = {}
+        # NOTE only the open charges are read, the charges invoiced in earlier months stay in the database
+        for charge in _load_by_ids(session, UserChargesORM.unit_id, {agreement.unit_id for agreement in pending},
+                                   UserChargesORM.is_invoiced == False):
+            charge_ids.setdefault(charge.unit_id, []).append(charge.charge_id)
+
+        billing_data = []
+        for agreement in pending:
+            property_ = properties.get(agreement.property_id)
+            tenant = tenants.get(agreement.tenant_id)
+            company = companies.get(property_.company_id) if property_ else None
+            if property_ and tenant and company:
+                billing_data.append(LeaseBillingData(agreement=agreement, tenant=tenant, company=company,
+                                                     property_=property_, profile=profiles[company.company_id],
+                                                     charge_ids=sorted(charge_ids.get(agreement.unit_id, []))))
+        return billing_data, len(agreements) - len(billing_data)
 
     @staticmethod
     async def calculate_due_date(date_issued: date) -> date:
@@ -73,69 +171,259 @@ class StatementsAndInvoicing:
 
         return due_date
 
-    @staticmethod
-    async def create_invoiced_items(items: list[dict[str, str | int]]):
+    async def billing_month(self) -> date:
+        """
+            **billing_month**
+                invoices are issued for the month they fall due in
+        :return: first day of that month
         """
+        due_date = await self.calculate_due_date(date_issued=self.today or date.today())
+        return due_date.replace(day=1)
 
-        :param items:
+    @staticmethod
+    def create_invoice(billing_data: LeaseBillingData, date_issued: date, due_date: date) -> InvoiceORM:
+        """
+            **create_invoice**
+        :param billing_data:
+        :param date_issued:
+        :param due_date:
         :return:
         """
-        _response = []
-        for item in items:
-            _response.append(item.get('item_number'))
-        return _response
+        property_, company = billing_data.property_, billing_data.company
+        return InvoiceORM(tenant_id=billing_data.tenant.tenant_id,
+                          service_name=f"{property_.name} Monthly Rental",
+                          description=f"{company.company_name} Monthly Rental Invoice for Property : {property_.name}",
+                          currency=billing_data.profile.currency, tax_rate=billing_data.profile.tax_rate, discount=0,
+                          date_issued=date_issued, due_date=due_date,
+                          month=due_date.month, rental_amount=billing_data.agreement.rent_amount,
+                          charge_ids=",".join(billing_data.charge_ids) or None, invoice_sent=False,
+                          invoice_printed=False)
 
-    async def create_invoice(self,
-                             lease_data: dict[str, LeaseAgreement | Tenant | Company | Property],
-                             invoiced_items: list[dict[str, str | int]]):
+    def write_invoices(self, chunk: list[LeaseBillingData], date_issued: date, due_date: date,
+                       billing_month: date) -> int:
         """
-
-        :param invoiced_items:
-        :param lease_data:
-        :return:
+            **write_invoices**
+                the invoices of a chunk of agreements, their charge links and the lease invoice records in one
+                transaction - the invoices are flushed together so their numbers come back in one round trip
+        :return: charges billed
         """
-        property_: Property = lease_data.get('property')
-        company: Company = lease_data.get('company')
-        tenant: Tenant = lease_data.get('tenant')
-        user_company: UserCompanyORM = await company_controller.internal_company_id_to_user_id(
-            company_id=company.company_id)
-        profile: Profile = await self.get_profile(uuid=user_company.user_id)
-        service_name: str = f"{property_.name} Monthly Rental"
-        description: str = f"{company.company_name} Monthly Rental Invoice for Property : {property_.name}"
-        _date_issued = datetime.now().date()
-        _due_date = await self.calculate_due_date(date_issued=_date_issued)
-        _invoiced_items: list[str] = await self.create_invoiced_items(items=invoiced_items)
-        _invoice_data = dict(service_name=service_name, description=description, currency=profile.currency,
-                             customer=dict(tenant_id=tenant.tenant_id, name=tenant.name, email=tenant.email,
-                                           cell=tenant.cell),
-                             date_issued=_date_issued, due_date=_due_date, invoiced_items=_invoiced_items)
-
-        with Session() as session:
-            _invoice_orm: InvoiceORM = InvoiceORM(**_invoice_data)
-            session.add(_invoice_orm)
+        with self._session_maker() as session:
+            invoices = [self.create_invoice(billing_data=billing_data, date_issued=date_issued, due_date=due_date)
+                        for billing_data in chunk]
+            session.add_all(invoices)
+            session.flush()
+
+            session.execute(insert(LeaseInvoiceORM), [
+                dict(agreement_id=billing_data.agreement.agreement_id, billing_month=billing_month,
+                     invoice_number=invoice.invoice_number) for billing_data, invoice in zip(chunk, invoices)])
+            charge_links = [dict(invoice_number=invoice.invoice_number, charge_id=charge_id)
+                            for billing_data, invoice in zip(chunk, invoices) for charge_id in billing_data.charge_ids]
+            if charge_links:
+                session.execute(insert(InvoiceChargeORM), charge_links)
+                session.execute(update(UserChargesORM).where(
+                    UserChargesORM.charge_id.in_([link['charge_id'] for link in charge_links])).values(
+                    is_invoiced=True).execution_options(synchronize_session=False))
+            refresh_invoice_totals(session=session, invoice_numbers=[invoice.invoice_number for invoice in invoices])
             session.commit()
 
-    async def load_invoices(self) -> list[Invoice]:
+        # NOTE the web workers reload the invoices of these tenants instead of serving the partitions they hold
+        self._controller.invalidate_invoices(tenant_ids=[billing_data.tenant.tenant_id for billing_data in chunk])
+        return len(charge_links)
+
+    async def create_monthly_invoices(self, company_id: str | None = None) -> dict[str, int]:
+        """
+            **create_monthly_invoices**
+                a chunk which fails is rolled back on its own, its agreements are invoiced by the next run
+        :param company_id: only invoice the agreements of this company
+        :return: counts of the agreements invoiced, skipped and failed and of the charges billed
         """
+        started = time.monotonic()
+        billing_month = await self.billing_month()
+        date_issued = self.today or datetime.now().date()
+        due_date = await self.calculate_due_date(date_issued=date_issued)
 
+        with self._session_maker() as session:
+            billing_data, skipped = await self.monthly_lease_agreements(session=session, billing_month=billing_month,
+                                                                        company_id=company_id)
+
+        counts = dict(invoiced=0, skipped=skipped, failed=0, charges=0)
+        for index in range(0, len(billing_data), self.chunk_size):
+            chunk = billing_data[index:index + self.chunk_size]
+            try:
+                counts['charges'] += self.write_invoices(chunk=chunk, date_issued=date_issued, due_date=due_date,
+                                                         billing_month=billing_month)
+                counts['invoiced'] += len(chunk)
+            except SQLAlchemyError as e:
+                self.logger.error(f"Unable to invoice {len(chunk)} lease agreements : {str(e)}")
+                counts['failed'] += len(chunk)
+
+            if self._progress is not None:
+                self._progress(counts['invoiced'], len(billing_data))
+            self.logger.info(f"Invoiced {counts['invoiced']} of {len(billing_data)} lease agreements "
+                             f"for {billing_month:%Y-%m} in {time.monotonic() - started:.1f}s")
+        return counts
+
+    async def company_partitions(self, billing_month: date) -> dict[str, int]:
+        """
+            **company_partitions**
+        :param billing_month:
+        :return: company_id -> number of its monthly agreements not yet invoiced for billing_month
+        """
+        with self._session_maker() as session:
+            rows = session.execute(select(PropertyORM.company_id, func.count(LeaseAgreementORM.agreement_id)).join(
+                PropertyORM, PropertyORM.property_id == LeaseAgreementORM.property_id).outerjoin(
+                LeaseInvoiceORM, (LeaseInvoiceORM.agreement_id == LeaseAgreementORM.agreement_id) & (
+                    LeaseInvoiceORM.billing_month == billing_month)).where(
+                LeaseAgreementORM.is_active == True, LeaseAgreementORM.payment_period == "monthly",
+                LeaseInvoiceORM.agreement_id.is_(None), PropertyORM.company_id.isnot(None)).group_by(
+                PropertyORM.company_id)).all()
+        return {company_id: count for company_id, count in rows}
+
+    async def create_monthly_invoices_in_parallel(self, workers: int,
+                                                  database_url: str | None = None) -> dict[str, int | list]:
+        """
+            **create_monthly_invoices_in_parallel**
+                the largest companies are handed out first so one big landlord does not finish last, a company
+                whose worker fails is counted as failed and reported without stopping the other companies
+        :param workers: processes in the pool
+        :param database_url: database the workers connect to, defaults to the application database
+        :return: the counts of create_monthly_invoices summed over the companies, the companies invoiced and
+            the failures, both merged in company order whatever order the workers finished in
+        """
+        partitions = await self.company_partitions(billing_month=await self.billing_month())
+        total = sum(partitions.values())
+        results: dict[str, dict[str, int]] = {}
+        failures: dict[str, str] = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_invoicing_worker,
+                                 initargs=(database_url,)) as executor:
+            futures = {executor.submit(invoice_company, company_id, self.today, self.chunk_size): company_id
+                       for company_id in sorted(partitions, key=lambda _id: (-partitions[_id], _id))}
+            invoiced = 0
+            for future in as_completed(futures):
+                company_id = futures[future]
+                try:
+                    results[company_id] = future.result()
+                    invoiced += results[company_id]['invoiced']
+                except Exception as e:
+                    self.logger.error(f"Unable to invoice company {company_id} : {str(e)}")
+                    failures[company_id] = str(e)
+                if self._progress is not None:
+                    self._progress(invoiced, total)
+
+        counts: dict[str, int | list] = dict(invoiced=0, skipped=0, failed=0, charges=0)
+        for company_id in sorted(results):
+            for name, count in results[company_id].items():
+                counts[name] += count
+        counts['failed'] += sum(partitions[company_id] for company_id in failures)
+        counts['companies'] = len(results)
+        counts['failures'] = [dict(company_id=company_id, error=failures[company_id]) for company_id in sorted(failures)]
+        return counts
+
+    async def load_invoices(self, billing_month: date) -> list[Invoice]:
+        """
+            **load_invoices**
+                invoices of billing_month which were not emailed yet, tenants without an email are left out
+        :param billing_month:
         :return:
         """
-        pass
+        with self._session_maker() as session:
+            invoices_orm = session.scalars(select(InvoiceORM).join(
+                LeaseInvoiceORM, LeaseInvoiceORM.invoice_number == InvoiceORM.invoice_number).join(
+                TenantORM, TenantORM.tenant_id == InvoiceORM.tenant_id).where(
+                LeaseInvoiceORM.billing_month == billing_month, InvoiceORM.invoice_sent == False,
+                TenantORM.email.isnot(None), TenantORM.cell.isnot(None)).order_by(InvoiceORM.invoice_number)).all()
+            invoices = []
+            for invoice_dict in hydrate_invoices(session=session, invoices=invoices_orm):
+                try:
+                    invoices.append(Invoice(**invoice_dict))
+                except ValidationError as e:
+                    self.logger.error(str(e))
+            return invoices
+
+    async def send_email(self, invoice: Invoice, on_sent: Callable[[], None] | None = None) -> bool:
+        subject = f"{invoice.service_name} : Invoice {invoice.invoice_number}"
+        message = f"""
+            Hi {invoice.customer.name},
+
+            {invoice.description}
 
-    async def send_email(self, invoice: Invoice):
-        pass
+            Invoice Number: {invoice.invoice_number}
+            Amount Due: {invoice.currency} {invoice.amount_payable}
+            Due Date: {invoice.due_date}
 
-    async def send_invoices(self):
+            Thank you,
+                Property & Rental Manager
+                https://rental-manager.ste
         """
+        return self._send_mail.enqueue(email=EmailModel(from_=settings.RESEND.from_, to_=invoice.customer.email,
+                                                        subject_=subject, html_=message), on_sent=on_sent)
 
-        :return:
+    async def send_invoices(self, billing_month: date) -> int:
+        """
+            **send_invoices**
+                queues the emails and waits for the mail dispatcher to send them, only the invoices whose email
+                the provider accepted are flagged as sent - the others are emailed again by the next run
+        :param billing_month:
+        :return: number of invoices sent
         """
-        invoices_list: list[Invoice] = await self.load_invoices()
+        invoices_list: list[Invoice] = await self.load_invoices(billing_month=billing_month)
+        delivered: list[int] = []
+        queued = 0
         for invoice in invoices_list:
-            await self.send_email(invoice=invoice)
-            await asyncio.sleep(360)
+            # NOTE list.append is atomic, the callbacks run on the dispatcher worker threads
+            if await self.send_email(invoice=invoice,
+                                     on_sent=functools.partial(delivered.append, invoice.invoice_number)):
+                queued += 1
+
+        # NOTE the dispatcher spaces the emails out to the provider rate limit and its threads do not outlive
+        # the cron process, so the run waits for them rather than exiting with the emails still queued
+        if queued and not self._send_mail.flush(count=queued):
+            self.logger.warning(f"{queued - len(delivered)} of {queued} invoice emails still unsent")
+
+        sent = sorted(delivered)
+        with self._session_maker() as session:
+            for index in range(0, len(sent), IN_CLAUSE_CHUNK_SIZE):
+                session.execute(update(InvoiceORM).where(
+                    InvoiceORM.invoice_number.in_(sent[index:index + IN_CLAUSE_CHUNK_SIZE])).values(
+                    invoice_sent=True, version=InvoiceORM.version + 1).execution_options(synchronize_session=False))
+            session.commit()
+        sent_numbers = set(sent)
+        self._controller.invalidate_invoices(tenant_ids=[invoice.customer.tenant_id for invoice in invoices_list
+                                                         if invoice.invoice_number in sent_numbers],
+                                             invoice_numbers=sent)
+        return len(sent)
+
+    async def run(self, workers: int = 1) -> dict[str, int | list]:
+        if workers > 1:
+            counts = await self.create_monthly_invoices_in_parallel(workers=workers)
+        else:
+            counts = await self.create_monthly_invoices()
+        counts['emails'] = await self.send_invoices(billing_month=await self.billing_month())
+        return counts
+
+
+# NOTE set in each process of the invoicing pool by _init_invoicing_worker
+_worker_session_maker: sessionmaker | None = None
 
-    async def run(self):
-        lease_agreements = await self.monthly_lease_agreements()
 
+def _init_invoicing_worker(database_url: str | None):
+    global _worker_session_maker
+    if database_url is None:
+        # NOTE connections inherited from the parent must not be used by the child, it opens its own
+        engine.dispose(close=False)
+        _worker_session_maker = Session
+    else:
+        _worker_session_maker = sessionmaker(bind=config_instance().MYSQL_SETTINGS.create_engine(database_url))
 
+
+def invoice_company(company_id: str, today: date | None, chunk_size: int) -> dict[str, int]:
+    """
+        **invoice_company**
+            runs in a process of the invoicing pool
+    :param company_id:
+    :param today:
+    :param chunk_size:
+    :return: counts of create_monthly_invoices for the company
+    """
+    invoicing = StatementsAndInvoicing(session_maker=_worker_session_maker, today=today, chunk_size=chunk_size)
+    return asyncio.run(invoicing.create_monthly_invoices(company_id=company_id))
@@ -0,0 +1,81 @@
+"""
+    reconciles the payments of a tenant or a unit against their invoices -
+
+    the payments are grouped by invoice_number in a single pass, every invoice then looks up what was paid
+    against it instead of scanning all the payments, so reconciling is linear in invoices plus payments
+
+"""
+from typing import NamedTuple
+
+from src.database.models.invoices import Invoice, PaymentStatus, payment_status
+from src.database.models.payments import Payment
+
+
+class InvoiceBalance(NamedTuple):
+    invoice_number: int
+    amount_payable: int
+    amount_paid: int
+    status: PaymentStatus
+
+    @property
+    def outstanding(self) -> int:
+        return max(self.amount_payable - self.amount_paid, 0)
+
+
+def amounts_paid_by_invoice(payments: list[Payment] | None) -> dict[int, int]:
+    """
+        **amounts_paid_by_invoice**
+    :param payments:
+    :return: invoice_number -> total amount paid against it
+    """
+    amounts_paid: dict[int, int] = {}
+    for payment in payments or []:
+        if payment:
+            amounts_paid[payment.invoice_number] = amounts_paid.get(payment.invoice_number, 0) + payment.amount_paid
+    return amounts_paid
+
+
+def reconcile_invoices(invoices: list[Invoice] | None, payments: list[Payment] | None) -> dict[int, InvoiceBalance]:
+    """
+        **reconcile_invoices**
+    :param invoices:
+    :param payments: payments of the same tenant or unit as the invoices
+    :return: invoice_number -> balance, in the order of invoices
+    """
+    amounts_paid = amounts_paid_by_invoice(payments=payments)
+    balances: dict[int, InvoiceBalance] = {}
+    for invoice in invoices or []:
+        if not invoice:
+            continue
+        amount_paid = amounts_paid.get(invoice.invoice_number, 0)
+        balances[invoice.invoice_number] = InvoiceBalance(
+            invoice_number=invoice.invoice_number, amount_payable=invoice.amount_payable, amount_paid=amount_paid,
+            status=payment_status(amount_paid=amount_paid, amount_payable=invoice.amount_payable))
+    return balances
+
+
+def split_invoices_by_status(invoices: list[Invoice] | None,
+                             payments: list[Payment] | None) -> tuple[list[dict], list[dict], list[dict]]:
+    """
+        **split_invoices_by_status**
+            converts every invoice to a dict once and adds its payment status, amount paid and outstanding
+            balance for the invoice tables of the unit and tenant pages
+    :param invoices:
+    :param payments:
+    :return: all invoices, fully paid invoices, invoices not fully paid
+    """
+    balances = reconcile_invoices(invoices=invoices, payments=payments)
+    invoice_dicts, paid_invoices, un_paid_invoices = [], [], []
+    for invoice in invoices or []:
+        if not invoice:
+            continue
+        balance = balances[invoice.invoice_number]
+        invoice_dict = invoice.dict()
+        invoice_dict.update(payment_status=balance.status.value, amount_paid=balance.amount_paid,
+                            outstanding=balance.outstanding)
+        invoice_dicts.append(invoice_dict)
+        if balance.status == PaymentStatus.FULLY_PAID:
+            paid_invoices.append(invoice_dict)
+        else:
+            un_paid_invoices.append(invoice_dict)
+    return invoice_dicts, paid_invoices, un_paid_invoices
@@ -0,0 +1,467 @@
+"""
+    **cache**
+        bounded in memory caches used by the controllers, entries are loaded on first access
+        and the least recently used entries are evicted once the size limits are reached
+"""
+import threading
+from collections import OrderedDict
+from operator import attrgetter
+from typing import Callable, Generic, Hashable, Iterable, Iterator, TypeVar
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Query
+
+from src.logger import init_logger
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+DEFAULT_PAGE_SIZE: int = 500
+
+
+def paginate(query: Query, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator:
+    """
+        **paginate**
+            reads the rows of a query in pages of page_size ordered by primary key instead of one large result
+    :param query:
+    :param page_size:
+    :return:
+    """
+    entity = query.column_descriptions[0].get('entity')
+    if entity is not None:
+        query = query.order_by(*inspect(entity).primary_key)
+
+    offset = 0
+    while True:
+        page = query.limit(page_size).offset(offset).all()
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
+def is_older(candidate: V, current: V | None, version: Callable[[V], int | None] | None) -> bool:
+    """
+        **is_older**
+            True when both entities carry a row version and the candidate is behind the cached entity,
+            entities without a version (not yet flushed) are never considered older
+    :param candidate:
+    :param current:
+    :param version: returns the row version of an entity
+    :return:
+    """
+    if version is None or current is None:
+        return False
+    candidate_version, current_version = version(candidate), version(current)
+    return candidate_version is not None and current_version is not None and candidate_version < current_version
+
+
+class LRUCache(Generic[K, V]):
+    """
+        **LRUCache**
+            max_size: number of entries kept before the least recently used entry is evicted
+            on_evict: called with the key and value of every entry evicted to make room
+            key: attribute holding the key of an entity - required by upsert
+            version: attribute holding the row version, put never replaces an entry with an older version
+    """
+
+    def __init__(self, name: str, max_size: int = 1000, on_evict: Callable[[K, V], None] | None = None,
+                 key: str | None = None, version: str | None = None):
+        self.name = name
+        self._max_size = max_size
+        self._on_evict = on_evict
+        self._key: Callable[[V], K] | None = attrgetter(key) if key else None
+        self._version: Callable[[V], int | None] | None = attrgetter(version) if version else None
+        self._entries: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.RLock()
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+
+    def configure(self, max_size: int | None = None):
+        with self._lock:
+            if max_size:
+                self._max_size = max_size
+            self._evict()
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            if key not in self._entries:
+                self._misses += 1
+                return default
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def peek(self, key: K, default: V | None = None) -> V | None:
+        """
+            **peek**
+                reads an entry without counting a hit or refreshing its position
+        """
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def put(self, key: K, value: V) -> V:
+        """
+            **put**
+        :return: the cached value - the existing entry when value is an older version of it
+        """
+        with self._lock:
+            current = self._entries.get(key)
+            if is_older(value, current, self._version):
+                self._entries.move_to_end(key)
+                return current
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+            return value
+
+    def upsert(self, entity: V) -> V:
+        return self.put(self._key(entity), entity)
+
+    def change_key(self, entity: V) -> K:
+        """
+            **change_key**
+                the key published to the other workers when entity changes
+        """
+        return self._key(entity)
+
+    def pop(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def invalidate(self, key: K):
+        self.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def values(self) -> list[V]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def _evict(self):
+        while len(self._entries) > self._max_size:
+            key, value = self._entries.popitem(last=False)
+            self._evictions += 1
+            if self._on_evict is not None:
+                self._on_evict(key, value)
+
+    def stats(self) -> dict[str, int | str]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'size': len(self._entries),
+                'max_size': self._max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions
+            }
+
+
+class IndexedCollection(Generic[V]):
+    """
+        **IndexedCollection**
+            entities keyed by primary key together with secondary indexes, so lookups by primary key
+            or by an indexed attribute do not scan and updates do not reshuffle lists
+
+            primary_key: attribute holding the primary key e.g. "tenant_id"
+            indexes: attributes to index e.g. ("company_id", "customer.tenant_id")
+            version: attribute holding the row version, upsert never replaces an entity with an older version
+
+        NOTE entities must be replaced with upsert - changing an indexed attribute in place is not tracked
+    """
+
+    def __init__(self, primary_key: str, indexes: Iterable[str] = (), version: str | None = None):
+        self._primary_key = attrgetter(primary_key)
+        self._version: Callable[[V], int | None] | None = attrgetter(version) if version else None
+        self._index_getters: dict[str, Callable[[V], Hashable]] = {index: attrgetter(index) for index in indexes}
+        self._entities: dict[Hashable, V] = {}
+        # NOTE index -> attribute value -> primary keys, a dict is used as an insertion ordered set
+        self._indexes: dict[str, dict[Hashable, dict[Hashable, None]]] = {index: {} for index in indexes}
+        self._lock = threading.RLock()
+
+    @property
+    def lock(self) -> threading.RLock:
+        """
+            **lock**
+                held by callers combining several operations into one atomic step
+        """
+        return self._lock
+
+    def primary_key_of(self, entity: V) -> Hashable:
+        return self._primary_key(entity)
+
+    def upsert(self, entity: V) -> V:
+        """
+            **upsert**
+        :return: the stored entity - the existing entity when entity is an older version of it
+        """
+        with self._lock:
+            primary_key = self._primary_key(entity)
+            current = self._entities.get(primary_key)
+            if is_older(entity, current, self._version):
+                return current
+            self._unindex(primary_key=primary_key)
+            self._entities[primary_key] = entity
+            for index, getter in self._index_getters.items():
+                self._indexes[index].setdefault(getter(entity), {})[primary_key] = None
+            return entity
+
+    def _unindex(self, primary_key: Hashable) -> V | None:
+        entity = self._entities.pop(primary_key, None)
+        if entity is None:
+            return None
+        for index, getter in self._index_getters.items():
+            value = getter(entity)
+            bucket = self._indexes[index].get(value)
+            if bucket is not None:
+                bucket.pop(primary_key, None)
+                if not bucket:
+                    del self._indexes[index][value]
+        return entity
+
+    def remove(self, primary_key: Hashable) -> V | None:
+        with self._lock:
+            return self._unindex(primary_key=primary_key)
+
+    def remove_where(self, index: str, value: Hashable) -> int:
+        """
+            **remove_where**
+                removes every entity whose indexed attribute equals value
+        :param index:
+        :param value:
+        :return: number of entities removed
+        """
+        with self._lock:
+            primary_keys = list(self._indexes[index].get(value, ()))
+            for primary_key in primary_keys:
+                self._unindex(primary_key=primary_key)
+            return len(primary_keys)
+
+    def get(self, primary_key: Hashable, default: V | None = None) -> V | None:
+        with self._lock:
+            return self._entities.get(primary_key, default)
+
+    def find(self, index: str, value: Hashable) -> list[V]:
+        with self._lock:
+            return [self._entities[primary_key] for primary_key in self._indexes[index].get(value, ())]
+
+    def values(self) -> list[V]:
+        with self._lock:
+            return list(self._entities.values())
+
+    def clear(self):
+        with self._lock:
+            self._entities.clear()
+            for index in self._indexes.values():
+                index.clear()
+
+    def __contains__(self, primary_key: Hashable) -> bool:
+        with self._lock:
+            return primary_key in self._entities
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entities)
+
+
+class PartitionedCache(Generic[K, V]):
+    """
+        **PartitionedCache**
+            an IndexedCollection filled one partition at a time - a partition is every entity sharing the
+            partition_by attribute (for example the tenants of a company) and is loaded with
+            loader(partition_key) the first time it is requested, whole partitions are evicted least
+            recently used first
+
+            partition_by: attribute the entities are partitioned by e.g. "company_id"
+            primary_key: attribute holding the primary key of the entities
+            indexes: additional secondary indexes
+            max_partitions: number of partitions kept in memory
+            version: attribute holding the row version of the entities
+    """
+
+    def __init__(self, name: str, loader: Callable[[K], Iterable[V]], partition_by: str, primary_key: str,
+                 indexes: Iterable[str] = (), max_partitions: int = 100, version: str | None = None):
+        self.name = name
+        self._loader = loader
+        self._partition_by = partition_by
+        self._partition_key = attrgetter(partition_by)
+        self._collection: IndexedCollection[V] = IndexedCollection(primary_key=primary_key,
+                                                                   indexes=(partition_by, *indexes),
+                                                                   version=version)
+        self._partitions: LRUCache[K, bool] = LRUCache(name=name, max_size=max_partitions,
+                                                       on_evict=lambda partition_key, _: self._drop(partition_key))
+        self._loads: int = 0
+        # NOTE loads in flight per partition and how often the partition was invalidated while they read it
+        self._loading: dict[K, int] = {}
+        self._generations: dict[K, int] = {}
+        self._warmup_thread: threading.Thread | None = None
+        self.logger = init_logger(self.__class__.__name__)
+
+    def configure(self, max_partitions: int | None = None):
+        self._partitions.configure(max_size=max_partitions)
+
+    @property
+    def max_partitions(self) -> int:
+        return self._partitions.max_size
+
+    def get(self, partition_key: K) -> list[V]:
+        """
+            **get**
+                the entities of the partition, loading them on a miss
+        :param partition_key:
+        :return:
+        """
+        if self._partitions.get(partition_key) is None:
+            entities = self.load(partition_key=partition_key)
+            if not self.is_loaded(partition_key):
+                # NOTE invalidated while it was read - served to this caller but not cached
+                return entities
+        return self._collection.find(self._partition_by, partition_key)
+
+    def get_entity(self, primary_key: Hashable) -> V | None:
+        """
+            **get_entity**
+                primary key lookup across the loaded partitions - does not load anything
+        :param primary_key:
+        :return:
+        """
+        return self._collection.get(primary_key)
+
+    def find(self, index: str, value: Hashable) -> list[V]:
+        """
+            **find**
+                secondary index lookup across the loaded partitions - does not load anything
+        :param index:
+        :param value:
+        :return:
+        """
+        return self._collection.find(index, value)
+
+    def load(self, partition_key: K) -> list[V]:
+        """
+            **load**
+                reads the partition with the loader, the partition is only cached when it was not
+                invalidated while the loader was reading it
+        :param partition_key:
+        :return: the entities read
+        """
+        with self._collection.lock:
+            self._loading[partition_key] = self._loading.get(partition_key, 0) + 1
+            generation = self._generations.get(partition_key, 0)
+        try:
+            entities = list(self._loader(partition_key))
+            with self._collection.lock:
+                if self._generations.get(partition_key, 0) != generation:
+                    return entities
+                # NOTE entities written while the partition was being read keep their newer version
+                removed = {self._collection.primary_key_of(entity)
+                           for entity in self._collection.find(self._partition_by, partition_key)}
+                for entity in entities:
+                    self._collection.upsert(entity)
+                    removed.discard(self._collection.primary_key_of(entity))
+                for primary_key in removed:
+                    self._collection.remove(primary_key)
+                self._loads += 1
+                self._partitions.put(partition_key, True)
+            return entities
+        finally:
+            with self._collection.lock:
+                self._loading[partition_key] -= 1
+                if not self._loading[partition_key]:
+                    del self._loading[partition_key]
+                    self._generations.pop(partition_key, None)
+
+    def is_loaded(self, partition_key: K) -> bool:
+        return partition_key in self._partitions
+
+    def upsert(self, entity: V) -> V:
+        """
+            **upsert**
+                replaces the entity in its partition when the partition is loaded - partitions which
+                are not loaded are left alone, they will read the entity from the database when loaded
+        :param entity:
+        :return: the entity, or the cached entity when entity is an older version of it
+        """
+        with self._collection.lock:
+            if self._partitions.peek(self._partition_key(entity)) is not None:
+                return self._collection.upsert(entity)
+            else:
+                # NOTE the entity may have moved out of a loaded partition
+                self._collection.remove(self._collection.primary_key_of(entity))
+        return entity
+
+    def remove(self, primary_key: Hashable) -> V | None:
+        return self._collection.remove(primary_key)
+
+    def change_key(self, entity: V) -> K:
+        """
+            **change_key**
+                the partition published to the other workers when entity changes
+        """
+        return self._partition_key(entity)
+
+    def _drop(self, partition_key: K):
+        self._collection.remove_where(self._partition_by, partition_key)
+
+    def _bump_generation(self, partition_key: K):
+        if partition_key in self._loading:
+            self._generations[partition_key] = self._generations.get(partition_key, 0) + 1
+
+    def invalidate(self, partition_key: K):
+        with self._collection.lock:
+            self._bump_generation(partition_key)
+            self._partitions.pop(partition_key)
+            self._drop(partition_key)
+
+    def clear(self):
+        with self._collection.lock:
+            for partition_key in self._loading:
+                self._bump_generation(partition_key)
+            self._partitions.clear()
+            self._collection.clear()
+
+    def warmup(self, partition_keys: Callable[[], Iterable[K]], background: bool = True):
+        """
+            **warmup**
+                loads partitions ahead of the first request, in a daemon thread when background is True
+                so the application can serve traffic while the cache fills
+        :param partition_keys: returns the keys to load, most important first
+        :param background:
+        :return:
+        """
+        if not background:
+            return self._warmup(partition_keys=partition_keys)
+
+        self._warmup_thread = threading.Thread(target=self._warmup, kwargs=dict(partition_keys=partition_keys),
+                                               name=f"{self.name}-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def _warmup(self, partition_keys: Callable[[], Iterable[K]]):
+        try:
+            for partition_key in partition_keys():
+                if len(self._partitions) >= self.max_partitions:
+                    break
+                if not self.is_loaded(partition_key):
+                    self.load(partition_key=partition_key)
+        except Exception as e:
+            self.logger.error(f"Error warming up {self.name} cache : {str(e)}")
+
+    def stats(self) -> dict[str, int | str]:
+        stats = self._partitions.stats()
+        stats.update(loads=self._loads, entities=len(self._collection))
+        return stats
@@ -0,0 +1,274 @@
+"""
+    **invalidation**
+        keeps the controller caches of several worker processes coherent - a worker writing an entity
+        publishes (cache name, key) to a change log and the other workers drop that key from their own
+        copy of the cache, the change log is pluggable:
+
+            NullChangeLog - single process deployments, publishing is a no-op
+            SQLiteChangeLog - workers on one host share a SQLite file which each worker polls
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Hashable, NamedTuple, Protocol
+
+from src.logger import init_logger
+
+
+class Invalidatable(Protocol):
+    name: str
+
+    def invalidate(self, key: Hashable): ...
+
+    def clear(self): ...
+
+
+class Change(NamedTuple):
+    change_id: int
+    channel: str
+    key: Hashable
+    origin: str
+
+
+class NullChangeLog:
+    """
+        **NullChangeLog**
+            used when the caches are process local - nothing is written and nothing is ever read back
+    """
+
+    def append(self, channel: str, key: Hashable, origin: str):
+        pass
+
+    def latest_id(self) -> int:
+        return 0
+
+    def oldest_id(self) -> int:
+        return 0
+
+    def read_since(self, change_id: int, limit: int = 1000) -> list[Change]:
+        return []
+
+    def prune(self, older_than: float) -> int:
+        return 0
+
+
+class SQLiteChangeLog:
+    """
+        **SQLiteChangeLog**
+            an append only table in a SQLite file shared by the workers of one host, ids increase
+            monotonically so every worker reads the changes it has not yet seen with a single range scan
+
+            path: SQLite file - must be on a local filesystem shared by all workers
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cache_changes ("
+                               "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "channel TEXT NOT NULL, "
+                               "key TEXT NOT NULL, "
+                               "origin TEXT NOT NULL, "
+                               "created_at REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection | None = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            # NOTE WAL lets the workers poll while another worker is appending
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def append(self, channel: str, key: Hashable, origin: str):
+        self._connection().execute("INSERT INTO cache_changes (channel, key, origin, created_at) VALUES (?, ?, ?, ?)",
+                                   (channel, json.dumps(key), origin, time.time()))
+
+    def latest_id(self) -> int:
+        return self._connection().execute("SELECT COALESCE(MAX(id), 0) FROM cache_changes").fetchone()[0]
+
+    def oldest_id(self) -> int:
+        return self._connection().execute("SELECT COALESCE(MIN(id), 0) FROM cache_changes").fetchone()[0]
+
+    def read_since(self, change_id: int, limit: int = 1000) -> list[Change]:
+        rows = self._connection().execute("SELECT id, channel, key, origin FROM cache_changes WHERE id > ? "
+                                          "ORDER BY id LIMIT ?", (change_id, limit)).fetchall()
+        return [Change(row[0], row[1], json.loads(row[2]), row[3]) for row in rows]
+
+    def prune(self, older_than: float) -> int:
+        return self._connection().execute("DELETE FROM cache_changes WHERE created_at < ?", (older_than,)).rowcount
+
+
+class InvalidationBus:
+    """
+        **InvalidationBus**
+            caches subscribe by name, publish appends a change to the change log and a daemon thread
+            applies the changes published by other processes every poll_interval seconds
+
+            poll_interval: upper bound in seconds on how long another worker may serve a stale entry
+            retention: seconds changes are kept in the change log
+    """
+
+    def __init__(self, change_log: NullChangeLog | SQLiteChangeLog | None = None, poll_interval: float = 1.0,
+                 retention: int = 3600):
+        self._change_log = change_log or NullChangeLog()
+        self._poll_interval = poll_interval
+        self._retention = retention
+        self._subscribers: dict[str, list[Invalidatable]] = {}
+        self._lock = threading.RLock()
+        self._last_id: int = 0
+        self._origin: str = self._new_origin()
+        self._poller: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._published: int = 0
+        self._applied: int = 0
+        self._resets: int = 0
+        self._errors: int = 0
+        self.logger = init_logger(self.__class__.__name__)
+        if hasattr(os, 'register_at_fork'):
+            # NOTE workers forked from a preloaded application do not inherit the polling thread
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @staticmethod
+    def _new_origin() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def enabled(self) -> bool:
+        return not isinstance(self._change_log, NullChangeLog)
+
+    def configure(self, change_log: NullChangeLog | SQLiteChangeLog | None = None, poll_interval: float | None = None,
+                  retention: int | None = None):
+        self.stop()
+        with self._lock:
+            if change_log is not None:
+                self._change_log = change_log
+            if poll_interval:
+                self._poll_interval = poll_interval
+            if retention:
+                self._retention = retention
+        self.start()
+
+    def subscribe(self, cache: Invalidatable):
+        with self._lock:
+            self._subscribers.setdefault(cache.name, []).append(cache)
+
+    def publish(self, channel: str, key: Hashable):
+        """
+            **publish**
+                the publishing process has already updated its own cache, other processes drop the key
+        :param channel: name of the cache
+        :param key: key of the changed entry, the partition key for partitioned caches
+        :return:
+        """
+        if not self.enabled:
+            return
+        try:
+            self._change_log.append(channel=channel, key=key, origin=self._origin)
+            self._published += 1
+        except sqlite3.Error as e:
+            self._errors += 1
+            self.logger.error(f"Unable to publish change to {channel} : {str(e)}")
+
+    def start(self):
+        with self._lock:
+            if not self.enabled or (self._poller is not None and self._poller.is_alive()):
+                return
+            # NOTE changes made before this process started are already reflected in the database
+            self._last_id = self._change_log.latest_id()
+            self._stopped.clear()
+            self._poller = threading.Thread(target=self._poll_forever, name="cache-invalidation", daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stopped.set()
+        poller, self._poller = self._poller, None
+        if poller is not None and poller is not threading.current_thread():
+            poller.join(timeout=self._poll_interval * 2)
+
+    def _after_fork(self):
+        self._lock = threading.RLock()
+        self._origin = self._new_origin()
+        self._poller = None
+        self._stopped = threading.Event()
+        self.start()
+
+    def _poll_forever(self):
+        last_pruned = time.monotonic()
+        while not self._stopped.wait(timeout=self._poll_interval):
+            try:
+                self.poll()
+                if time.monotonic() - last_pruned > self._retention / 10:
+                    self._change_log.prune(older_than=time.time() - self._retention)
+                    last_pruned = time.monotonic()
+            except sqlite3.Error as e:
+                self._errors += 1
+                self.logger.error(f"Unable to read cache changes : {str(e)}")
+
+    def poll(self) -> int:
+        """
+            **poll**
+                applies the changes other processes published since the last poll
+        :return: number of changes applied
+        """
+        applied = 0
+        with self._lock:
+            if self._last_id and self._change_log.oldest_id() > self._last_id + 1:
+                # NOTE changes this process never saw were pruned, the caches can no longer be trusted
+                self._reset()
+
+            while True:
+                changes = self._change_log.read_since(change_id=self._last_id)
+                if not changes:
+                    break
+                for change in changes:
+                    self._last_id = change.change_id
+                    if change.origin == self._origin:
+                        continue
+                    for cache in self._subscribers.get(change.channel, []):
+                        cache.invalidate(change.key)
+                    applied += 1
+            self._applied += applied
+        return applied
+
+    def _reset(self):
+        self._resets += 1
+        self.logger.warning("cache change log fell behind - clearing every subscribed cache")
+        for caches in self._subscribers.values():
+            for cache in caches:
+                cache.clear()
+        self._last_id = self._change_log.latest_id()
+
+    def init_app(self, app):
+        """
+            **init_app**
+                app.config['cache_change_log'] path of the SQLite change log, None keeps caches process local
+                app.config['cache_poll_interval'] seconds between polls
+        :param app:
+        :return:
+        """
+        path = app.config.get('cache_change_log')
+        self.configure(change_log=SQLiteChangeLog(path=path) if path else NullChangeLog(),
+                       poll_interval=app.config.get('cache_poll_interval'))
+
+    def stats(self) -> dict[str, int | str | bool]:
+        return {
+            'enabled': self.enabled,
+            'origin': self._origin,
+            'last_change_id': self._last_id,
+            'published': self._published,
+            'applied': self._applied,
+            'resets': self._resets,
+            'errors': self._errors
+        }
+
+
+invalidation_bus = InvalidationBus()
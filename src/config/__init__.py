@@ -1,6 +1,8 @@
 import socket
 
 from pydantic import BaseSettings, Field
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
 
 
 class CloudFlareSettings(BaseSettings):
@@ -17,6 +19,63 @@ class CloudFlareSettings(BaseSettings):
 class MySQLSettings(BaseSettings):
     PRODUCTION_DB: str = Field(..., env="production_sql_db")
     DEVELOPMENT_DB: str = Field(..., env="dev_sql_db")
+    # None selects the database from the host name - see is_development
+    USE_PRODUCTION_DB: bool | None = Field(default=None, env="use_production_db")
+    POOL_SIZE: int = Field(default=10, env="sql_pool_size")
+    MAX_OVERFLOW: int = Field(default=10, env="sql_max_overflow")
+    # seconds a checkout waits for a free pooled connection
+    POOL_TIMEOUT: int = Field(default=30, env="sql_pool_timeout")
+    # seconds the driver waits to open a connection to MySQL
+    CONNECT_TIMEOUT: int = Field(default=10, env="sql_connect_timeout")
+    # MySQL closes idle connections after wait_timeout, recycle well before that
+    POOL_RECYCLE: int = Field(default=1800, env="sql_pool_recycle")
+    POOL_PRE_PING: bool = Field(default=True, env="sql_pool_pre_ping")
+    # statement timeout in seconds
+    STATEMENT_TIMEOUT: int = Field(default=30, env="sql_statement_timeout")
+    # statements slower than this many milliseconds are logged for the index advisor, None disables recording
+    SLOW_QUERY_MS: int | None = Field(default=None, env="sql_slow_query_ms")
+    SLOW_QUERY_LOG: str = Field(default="slow_queries.jsonl", env="sql_slow_query_log")
+
+    def database_url(self) -> str:
+        """
+            **database_url**
+                PRODUCTION_DB on production servers and DEVELOPMENT_DB on the development server
+        :return:
+        """
+        use_production = self.USE_PRODUCTION_DB if self.USE_PRODUCTION_DB is not None else not is_development()
+        return self.PRODUCTION_DB if use_production else self.DEVELOPMENT_DB
+
+    def engine_options(self, database_url: str) -> dict[str, int | bool | dict[str, int | str]]:
+        """
+            **engine_options**
+                keyword arguments for create_engine, SQLite is supported so the factory can be tested locally
+        :param database_url:
+        :return:
+        """
+        url = make_url(database_url)
+        options = dict(pool_recycle=self.POOL_RECYCLE, pool_pre_ping=self.POOL_PRE_PING)
+
+        if url.get_backend_name() == "sqlite":
+            options['connect_args'] = {'timeout': self.STATEMENT_TIMEOUT}
+            if url.database in (None, "", ":memory:"):
+                # in memory databases use a SingletonThreadPool which has no overflow or timeout
+                return options
+        elif url.get_backend_name() == "mysql":
+            options['connect_args'] = {'connect_timeout': self.CONNECT_TIMEOUT,
+                                       'init_command': f"SET SESSION max_execution_time={self.STATEMENT_TIMEOUT * 1000}"}
+
+        options.update(pool_size=self.POOL_SIZE, max_overflow=self.MAX_OVERFLOW, pool_timeout=self.POOL_TIMEOUT)
+        return options
+
+    def create_engine(self, database_url: str | None = None) -> Engine:
+        """
+            **create_engine**
+                creates the application engine with pooling and connection recycling configured
+        :param database_url: defaults to database_url()
+        :return:
+        """
+        database_url = database_url or self.database_url()
+        return create_engine(database_url, **self.engine_options(database_url=database_url))
 
     class Config:
         env_file = '.env.development'
@@ -73,6 +132,25 @@ class Settings(BaseSettings):
     FLUTTERWAVE_FLW_SECRET_KEY: str = Field(..., env="FLUTTERWAVE_SECRET_KEY")
     FLUTTERWAVE_HASH: str = Field(..., env="FLUTTERWAVE_HASH")
     PAYPAL_SETTINGS: PayPalSettings = PayPalSettings()
+    # SQLite change log shared by the workers of a host so a write in one worker invalidates the caches of
+    # the others, None keeps the caches process local which is only safe with a single worker
+    CACHE_CHANGE_LOG: str | None = Field(default=None, env="CACHE_CHANGE_LOG")
+    CACHE_POLL_INTERVAL: float = Field(default=1.0, env="CACHE_POLL_INTERVAL")
+    # seconds between refreshes of the cloudflare edge ranges
+    FIREWALL_REFRESH_INTERVAL: float = Field(default=6 * 60 * 60, env="FIREWALL_REFRESH_INTERVAL")
+    FIREWALL_FETCH_TIMEOUT: float = Field(default=5.0, env="FIREWALL_FETCH_TIMEOUT")
+    # last known cloudflare edge ranges, loaded on startup so booting never waits on the cloudflare api
+    FIREWALL_SNAPSHOT: str | None = Field(default=None, env="FIREWALL_SNAPSHOT")
+    # SQLite file the workers of a host share their rate limit buckets through, None limits each worker on its own
+    RATE_LIMIT_STORE: str | None = Field(default=None, env="RATE_LIMIT_STORE")
+    # file the emails are written to instead of being sent through resend, for tests and development
+    MAIL_SINK: str | None = Field(default=None, env="MAIL_SINK")
+    MAIL_WORKERS: int = Field(default=2, env="MAIL_WORKERS")
+    MAIL_RATE: float = Field(default=2.0, env="MAIL_RATE")
+    # SQLite job store of the cron scheduler - python -m src.cron.cli
+    CRON_JOB_STORE: str = Field(default="cron_jobs.db", env="CRON_JOB_STORE")
+    # processes the monthly invoicing run spreads the companies over, 1 invoices them in the scheduler process
+    INVOICING_WORKERS: int = Field(default=1, env="INVOICING_WORKERS")
 
     class Config:
         env_file = '.env.development'
@@ -3,11 +3,16 @@ import functools
 from flask import redirect, url_for, flash, Flask
 from pydantic import ValidationError
 from sqlalchemy.exc import OperationalError, ProgrammingError, IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
+from src.cache import LRUCache, PartitionedCache
+from src.cache.invalidation import invalidation_bus
+from src.database.session_pool import SessionPool, PoolExhaustedError
 from src.database.sql import Session
 from src.logger import init_logger
 
 error_logger = init_logger("error_logger")
+session_pool = SessionPool(session_maker=Session, size=20)
 
 
 class Controllers:
@@ -17,14 +22,61 @@ class Controllers:
     """
 
     def __init__(self, session_maker=Session):
-        self.sessions = [session_maker() for _ in range(20)]
+        # NOTE controllers share one bounded pool unless a custom session_maker is supplied
+        self._session_pool = session_pool if session_maker is Session else SessionPool(session_maker=session_maker)
+        self._caches: list[LRUCache | PartitionedCache] = []
         self.logger = init_logger(self.__class__.__name__)
 
-    def get_session(self) -> Session:
-        if self.sessions:
-            return self.sessions.pop()
-        self.sessions = [Session() for _ in range(20)]
-        return self.get_session()
+    def register_cache(self, cache: LRUCache | PartitionedCache) -> LRUCache | PartitionedCache:
+        """
+            **register_cache**
+                caches registered here are sized from the app config in init_app, reported by cache_stats
+                and invalidated when another worker publishes a change to them
+        :param cache:
+        :return: the cache
+        """
+        self._caches.append(cache)
+        invalidation_bus.subscribe(cache)
+        return cache
+
+    def write_through(self, entity, *caches: LRUCache | PartitionedCache):
+        """
+            **write_through**
+                call once a write has been committed - stores the committed entity in every cache holding
+                it, entities carry their row version so a concurrent read of an older row never replaces it,
+                and publishes the change to the other workers
+        :param entity:
+        :param caches:
+        :return: the entity
+        """
+        for cache in caches:
+            cache.upsert(entity)
+            self.publish_change(cache=cache, key=cache.change_key(entity))
+        return entity
+
+    @staticmethod
+    def publish_change(cache: LRUCache | PartitionedCache, key):
+        """
+            **publish_change**
+                call after a write has been committed and applied to the local cache so the other workers
+                drop their copy - key is the partition key for partitioned caches
+        :param cache:
+        :param key:
+        :return:
+        """
+        invalidation_bus.publish(channel=cache.name, key=key)
+
+    def cache_stats(self) -> list[dict[str, int | str]]:
+        return [cache.stats() for cache in self._caches]
+
+    def get_session(self):
+        """
+            **get_session**
+                checks out a session from the pool, use as `with self.get_session() as session:`
+                the session is returned to the pool when the block exits
+        :return:
+        """
+        return self._session_pool.checkout()
 
     def setup_error_handler(self, app: Flask):
         # app.add_url_rule("")
@@ -41,8 +93,26 @@ class Controllers:
         session_maker = app.config.get('session_maker')
         session_limit = app.config.get('session_limit')
 
-        if session_maker and session_limit:
-            self.sessions = [session_maker() for _ in range(session_limit)]
+        if session_maker or session_limit:
+            self._session_pool.configure(session_maker=session_maker,
+                                         size=session_limit,
+                                         idle_timeout=app.config.get('session_idle_timeout'),
+                                         checkout_timeout=app.config.get('session_checkout_timeout'))
+
+        for cache in self._caches:
+            if isinstance(cache, PartitionedCache):
+                cache.configure(max_partitions=app.config.get('cache_max_partitions'))
+            else:
+                cache.configure(max_size=app.config.get('cache_max_entries'))
+
+    def warmup_enabled(self, app: Flask) -> bool:
+        """
+            **warmup_enabled**
+                background cache warmup is opt in with app.config['cache_warmup']
+        :param app:
+        :return:
+        """
+        return bool(app.config.get('cache_warmup'))
 
 
 class UnauthorizedError(Exception):
@@ -67,12 +137,19 @@ def error_handler(view_func):
             error_logger.error(message)
             flash(message="You are not authorized to access this resource", category='danger')
             return redirect(url_for('home.get_home'), code=302)
-        except ConnectionResetError as e:
+        except (ConnectionResetError, PoolExhaustedError) as e:
             message: str = f"{view_func.__name__} : {str(e)}"
             error_logger.error(message)
             flash(message="Unable to connect to database please retry", category='danger')
             return None
 
+        except StaleDataError as e:
+            # NOTE the row version changed between reading and writing the record
+            message: str = f"{view_func.__name__} : {str(e)}"
+            error_logger.error(message)
+            flash(message="The record was changed by someone else - please reload and try again", category='danger')
+            return None
+
         except ValidationError as e:
             message: str = f"{view_func.__name__} : {str(e)}"
             error_logger.error(message)
@@ -1,11 +1,15 @@
 import time
 import uuid
+from datetime import timedelta
 
 from flask import Flask, render_template
+from itsdangerous import BadSignature, URLSafeSerializer
 from pydantic import ValidationError
 from sqlalchemy import or_
 
+from src.cache import LRUCache, paginate
 from src.controller import error_handler, UnauthorizedError, Controllers
+from src.database.models.auth import SessionToken
 from src.database.models.profile import Profile, ProfileUpdate
 from src.database.models.users import User, CreateUser, UserUpdate
 from src.database.sql.user import UserORM, ProfileORM
@@ -15,32 +19,56 @@ from src.main import send_mail
 
 class UserController(Controllers):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self._time_limit = 360
+        # NOTE signs the auth cookie, created from the SECRET_KEY in init_app
+        self._token_serializer: URLSafeSerializer | None = None
         self._verification_tokens: dict[str, int | dict[str, str | int]] = {}
-        self.profiles: dict[str, Profile] = {}
-        self.users: dict[str, User] = {}
+        # NOTE users and profiles are cached on first access instead of loading both tables on start up
+        self.profiles: LRUCache[str, Profile] = self.register_cache(LRUCache(name="profiles", key="user_id"))
+        # NOTE versioned by token_version so a miss which read the user before its sessions were revoked
+        # cannot put the user back with the revoked token version
+        self.users: LRUCache[str, User] = self.register_cache(
+            LRUCache(name="users", key="user_id", version="token_version"))
 
     def init_app(self, app: Flask):
-        self._load_users()
+        super().init_app(app=app)
+        self._token_serializer = URLSafeSerializer(secret_key=app.config['SECRET_KEY'], salt="session-token")
 
-    def _load_users(self):
-        with self.get_session() as session:
-            # Use session.query().options(lazyload) to fetch only the required columns
-            users_orm_list: list[UserORM] = session.query(UserORM).all()
-            # Convert the users_orm_list directly into a dictionary
-            self.users = {user.user_id: User(**user.to_dict()) for user in users_orm_list}
-            profile_orm_list: list[ProfileORM] = session.query(ProfileORM).all()
-            self.profiles = {profile_orm.user_id: Profile(**profile_orm.to_dict())
-                             for profile_orm in profile_orm_list}
-
-    async def manage_users_dict(self, new_user: User):
-        # Check if the user instance already exists in the dictionary
-        self.users[new_user.user_id] = new_user
+    def create_session_token(self, user: User, lifetime: timedelta) -> str:
+        """
+            **create_session_token**
+                signs the claims needed to authorize a request into the value of the auth cookie
+        :param user:
+        :param lifetime:
+        :return:
+        """
+        session_token = SessionToken(user_id=user.user_id, is_system_admin=user.is_system_admin,
+                                     token_version=user.token_version,
+                                     expires_at=int(time.time() + lifetime.total_seconds()))
+        return self._token_serializer.dumps(session_token.dict())
+
+    def read_session_token(self, token: str | None) -> SessionToken | None:
+        """
+            **read_session_token**
+                verifies the signature and expiry of a session token - no cache or database access
+        :param token:
+        :return: None when the token is missing, forged, malformed or expired
+        """
+        if not token:
+            return None
+        try:
+            session_token = SessionToken(**self._token_serializer.loads(token))
+        except (BadSignature, ValidationError, TypeError):
+            return None
+        return session_token if session_token.expires_at > time.time() else None
+
+    async def manage_users_dict(self, new_user: User) -> User:
+        return self.write_through(new_user, self.users)
 
     async def manage_profiles(self, new_profile: Profile):
-        self.profiles[new_profile.user_id] = new_profile
+        self.write_through(new_profile, self.profiles)
 
     @error_handler
     async def get_profile_by_user_id(self, user_id: str) -> Profile | None:
@@ -51,13 +79,13 @@ class UserController(Controllers):
         :return: The Profile instance corresponding to the user ID if found, else None.
         """
         # Check if the profile is available in the cache (profiles dictionary)
-        if user_id in self.profiles:
-            self.logger.info("Fetching profile from dict {} ")
-            return self.profiles.get(user_id)
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            return profile
 
         # Fetch the profile data from the database
         with self.get_session() as session:
-            profile_orm = await session.query(ProfileORM).filter(ProfileORM.user_id == user_id).first()
+            profile_orm = session.query(ProfileORM).filter(ProfileORM.user_id == user_id).first()
 
             # If the profile_orm is not found, return None
             if not profile_orm:
@@ -69,8 +97,8 @@ class UserController(Controllers):
                               currency=profile_orm.currency,
                               tax_rate=profile_orm.tax_rate)
 
-            # Cache the profile in the dictionary for future use
-            self.profiles[user_id] = profile
+            # Cache the profile for future use
+            self.profiles.put(user_id, profile)
         return profile
 
     @error_handler
@@ -91,7 +119,9 @@ class UserController(Controllers):
                 o_user_orm.email = user.email
                 o_user_orm.contact_number = user.contact_number
                 session.merge(o_user_orm)
-                self.users[user.user_id] = User(**o_user_orm.to_dict())
+                updated_user = User(**o_user_orm.to_dict())
+            else:
+                updated_user = None
             # Update profile attributes
 
             if o_profile_orm:
@@ -99,12 +129,16 @@ class UserController(Controllers):
                 o_profile_orm.currency = profile.currency
                 o_profile_orm.tax_rate = profile.tax_rate
                 session.merge(o_profile_orm)
-                self.profiles[profile.user_id] = Profile(**o_profile_orm.to_dict())
+                updated_profile = Profile(**o_profile_orm.to_dict())
             else:
                 session.add(ProfileORM(**profile.dict()))
-                self.profiles[profile.user_id] = Profile(**profile.dict())
+                updated_profile = Profile(**profile.dict())
 
             session.commit()
+            # NOTE caches are only updated once the write is committed
+            if updated_user:
+                await self.manage_users_dict(new_user=updated_user)
+            await self.manage_profiles(new_profile=updated_profile)
 
     async def is_token_valid(self, token: str) -> bool:
         """
@@ -127,14 +161,58 @@ class UserController(Controllers):
         :param user_id:
         :return:
         """
+        user = await self.get_user_by_id(user_id=user_id)
+        return user.dict() if user else None
+
+    @error_handler
+    async def get_user_by_id(self, user_id: str) -> User | None:
+        """
+            **get_user_by_id**
+                served from the users cache - the cache is bounded, written through by every user write
+                and invalidated across workers, a miss reads the user once
+        :param user_id:
+        :return:
+        """
         if not user_id:
             return None
-        if user_id in self.users:
-            return self.users[user_id].dict()
+        user = self.users.get(user_id)
+        if user is not None:
+            return user
 
         with self.get_session() as session:
             user_data: UserORM = session.query(UserORM).filter(UserORM.user_id == user_id).first()
-            return user_data.to_dict()
+            if not user_data:
+                return None
+            return self.users.put(user_data.user_id, User(**user_data.to_dict()))
+
+    @error_handler
+    async def get_authenticated_user(self, session_token: SessionToken) -> User | None:
+        """
+            **get_authenticated_user**
+                the user a verified session token was issued to
+        :param session_token:
+        :return: None when the token was revoked by bumping the token version of the user
+        """
+        user = await self.get_user_by_id(user_id=session_token.user_id)
+        if user is None or user.token_version != session_token.token_version:
+            return None
+        return user
+
+    @error_handler
+    async def revoke_sessions(self, user_id: str) -> User | None:
+        """
+            **revoke_sessions**
+                invalidates every session token issued to the user
+        :param user_id:
+        :return:
+        """
+        with self.get_session() as session:
+            user_data: UserORM = session.query(UserORM).filter(UserORM.user_id == user_id).first()
+            if not user_data:
+                return None
+            user_data.token_version = (user_data.token_version or 0) + 1
+            session.commit()
+            return await self.manage_users_dict(new_user=User(**user_data.to_dict()))
 
     @error_handler
     async def get_by_email(self, email: str) -> User | None:
@@ -145,14 +223,20 @@ class UserController(Controllers):
         """
         if not email:
             return None
-        for user in self.users.values():
-            if user.email.casefold() == email.casefold():
-                return user
-
         with self.get_session() as session:
             user_data: UserORM = session.query(UserORM).filter(UserORM.email == email.casefold()).first()
 
-            return User(**user_data.to_dict()) if user_data else None
+            return self.users.put(user_data.user_id, User(**user_data.to_dict())) if user_data else None
+
+    @error_handler
+    async def get_all_users(self) -> list[User]:
+        """
+            **get_all_users**
+                admin listing - reads the database page by page and does not fill the caches
+        :return:
+        """
+        with self.get_session() as session:
+            return [User(**user_orm.to_dict()) for user_orm in paginate(session.query(UserORM))]
 
     @error_handler
     async def send_password_reset(self, email: str) -> dict[str, str] | None:
@@ -218,7 +302,7 @@ class UserController(Controllers):
             new_user_dict = new_user.to_dict()
             session.commit()
             _user_data = User(**new_user_dict) if isinstance(new_user, UserORM) else None
-            self.users[_user_data.user_id] = _user_data
+            await self.manage_users_dict(new_user=_user_data)
             return _user_data
 
     @error_handler
@@ -228,15 +312,21 @@ class UserController(Controllers):
             if not user_data:
                 return None
 
+            # NOTE sessions issued before a change of rights or password are revoked
+            revoke_sessions = (user.is_system_admin != user_data.is_system_admin or
+                               user.password_hash != user_data.password_hash)
+
             # Update user_data with the values from the user Pydantic BaseModel
             for field in user_data.__table__.columns.keys():
-                if hasattr(user, field):
+                if hasattr(user, field) and field != "token_version":
                     setattr(user_data, field, getattr(user, field))
+            if revoke_sessions:
+                user_data.token_version = (user_data.token_version or 0) + 1
 
             # Save the updated user_data back to the session
             session.add(user_data)
             session.commit()
-            self.users[user_data.user_id] = user_data
+            await self.manage_users_dict(new_user=User(**user_data.to_dict()))
             return user_data.to_dict()
 
     @error_handler
@@ -2,127 +2,151 @@ import uuid
 
 from flask import Flask
 from pydantic import ValidationError
+from sqlalchemy import select
 
+from src.cache import LRUCache, PartitionedCache, paginate
 from src.controller import error_handler, UnauthorizedError, Controllers
+from src.controller.lease_controller import LeaseController
 from src.database.models.bank_accounts import BusinessBankAccount
 from src.database.models.companies import (Company, UpdateCompany, TenantRelationCompany, CreateTenantCompany,
-                                           UpdateTenantCompany, UserRelationCompany)
-from src.database.models.invoices import CreateInvoicedItem, BillableItem, CreateUnitCharge
+                                           UpdateTenantCompany)
+from src.database.models.invoices import CreateInvoicedItem, BillableItem, CreateUnitCharge, Invoice
 from src.database.models.properties import Property, Unit, AddUnit, UpdateProperty, CreateProperty
 from src.database.models.users import User
 from src.database.sql.bank_account import BankAccountORM
 from src.database.sql.companies import CompanyORM, UserCompanyORM, TenantCompanyORM
-from src.database.sql.invoices import ItemsORM, UserChargesORM
+from src.database.sql.invoices import ItemsORM, UserChargesORM, InvoiceChargeORM, InvoiceORM, hydrate_invoices, \
+    refresh_invoice_totals
 from src.database.sql.properties import PropertyORM, UnitORM
 
 
 class CompaniesController(Controllers):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, lease_controller: LeaseController | None = None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.company_user: dict[str, str] = {}
+        # NOTE charges and items are billed on invoices cached by the lease controller
+        self._lease_controller = lease_controller
         self.company_tenant: dict[str, str] = {}
-        self.companies: list[Company] = []
-        self.units: list[Unit] = []
-        self.buildings: list[Property] = []
+        # NOTE entities are loaded on first access - partitions group them by the key they are listed by
+        self.company_members: LRUCache[str, frozenset[str]] = self.register_cache(LRUCache(name="company_members"))
+        self.companies_by_id: LRUCache[str, Company] = self.register_cache(
+            LRUCache(name="companies_by_id", key="company_id", version="version"))
+        # NOTE a company may belong to several users so users map to company ids rather than owning a partition
+        self.user_company_ids: LRUCache[str, tuple[str, ...]] = self.register_cache(
+            LRUCache(name="user_company_ids"))
+        self.buildings_by_id: LRUCache[str, Property] = self.register_cache(
+            LRUCache(name="buildings_by_id", key="property_id", version="version"))
+        self.company_buildings: PartitionedCache[str, Property] = self.register_cache(
+            PartitionedCache(name="company_buildings", loader=self._load_company_buildings, partition_by="company_id",
+                             primary_key="property_id", version="version"))
+        self.property_units: PartitionedCache[str, Unit] = self.register_cache(
+            PartitionedCache(name="property_units", loader=self._load_property_units, partition_by="property_id",
+                             primary_key="unit_id", version="version"))
 
     def manage_company_list(self, company_instance: Company):
-        # Check if the tenant instance already exists in the list
-
-        for index, company in enumerate(self.companies):
-            if company.company_id == company_instance.company_id:
-                # Tenant already exists, remove the existing instance
-                self.companies.pop(index)
-                self.companies.append(company_instance)
-                break
-        else:
-            # Tenant instance not found, add the new instance to the list
-            self.companies.append(company_instance)
+        """
+            **manage_company_list**
+                keeps the cached copies of a company up-to-date after a write
+        :param company_instance:
+        :return:
+        """
+        self.write_through(company_instance, self.companies_by_id)
 
     def manage_building_list(self, building_instance: Property):
-        # Check if the tenant instance already exists in the list
-
-        for index, building in enumerate(self.buildings):
-            if building == building_instance:
-                # Tenant already exists, remove the existing instance
-                self.buildings.pop(index)
-                self.buildings.append(building_instance)
-                break
-        else:
-            # Tenant instance not found, add the new instance to the list
-            self.buildings.append(building_instance)
+        self.write_through(building_instance, self.buildings_by_id, self.company_buildings)
 
     def manage_unit_list(self, unit_instance: Unit):
-        # Check if the tenant instance already exists in the list
+        self.write_through(unit_instance, self.property_units)
 
-        for index, unit in enumerate(self.units):
-            if unit == unit_instance:
-                # Tenant already exists, remove the existing instance
-                self.units.pop(index)
-                self.units.append(unit_instance)
-                break
-        else:
-            # Tenant instance not found, add the new instance to the list
-            self.units.append(unit_instance)
-
-    def load_company_details(self):
+    def manage_invoiced_charges(self, session, invoice_numbers: list[int]):
+        """
+            **manage_invoiced_charges**
+                call after a charge or item billed on invoice_numbers was changed in session - recomputes the
+                totals of the invoices, commits and writes the refreshed invoices through the invoice caches
+        :param session:
+        :param invoice_numbers:
+        :return:
         """
+        if invoice_numbers:
+            refresh_invoice_totals(session=session, invoice_numbers=invoice_numbers)
+        session.commit()
+        if not invoice_numbers or self._lease_controller is None:
+            return
+        invoice_list = session.query(InvoiceORM).filter(InvoiceORM.invoice_number.in_(invoice_numbers)).all()
+        for invoice_dict in hydrate_invoices(session=session, invoices=invoice_list):
+            self._lease_controller.manage_invoice_list(invoice_instance=Invoice(**invoice_dict))
 
+    def manage_membership(self, company_id: str, user_id: str):
+        """
+            **manage_membership**
+                membership is re-read on the next access after a user joins a company
+        :param company_id:
+        :param user_id:
         :return:
         """
+        self.company_members.pop(company_id)
+        self.user_company_ids.pop(user_id)
+        self.publish_change(cache=self.company_members, key=company_id)
+        self.publish_change(cache=self.user_company_ids, key=user_id)
+
+    def _load_user_companies(self, user_id: str) -> list[Company]:
         with self.get_session() as session:
-            user_company_data = session.query(UserCompanyORM).filter().all()
-            self.company_user = {user_company.company_id: user_company.user_id for user_company in user_company_data}
-            try:
-                self.companies = [Company(**company.to_dict()) for company in session.query(CompanyORM).filter().all()]
-            except ValidationError as e:
-                self.logger.error(f"Error on loading Company Data on start_up: {str(e)}")
-            try:
-                self.units = [Unit(**unit.to_dict()) for unit in session.query(UnitORM).filter().all()]
-            except ValidationError as e:
-                self.logger.error(f"Error on loading property units on start_up: {str(e)}")
-            try:
-                self.buildings = [Property(**building.to_dict()) for building in
-                                  session.query(PropertyORM).filter().all()]
-            except ValidationError as e:
-                self.logger.error(f"Error on loading Building Data on Start_up: {str(e)}")
+            company_list = paginate(session.query(CompanyORM).join(
+                UserCompanyORM, UserCompanyORM.company_id == CompanyORM.company_id).filter(
+                UserCompanyORM.user_id == user_id))
+            companies = [Company(**company_orm.to_dict()) for company_orm in company_list]
+
+        for company in companies:
+            self.companies_by_id.put(company.company_id, company)
+        self.user_company_ids.put(user_id, tuple(company.company_id for company in companies))
+        return companies
+
+    def _load_company_buildings(self, company_id: str) -> list[Property]:
+        with self.get_session() as session:
+            properties = paginate(session.query(PropertyORM).filter(PropertyORM.company_id == company_id))
+            return [Property(**_prop.to_dict()) for _prop in properties if isinstance(_prop, PropertyORM)]
+
+    def _load_property_units(self, property_id: str) -> list[Unit]:
+        with self.get_session() as session:
+            property_units = paginate(session.query(UnitORM).filter(UnitORM.property_id == property_id))
+            return [Unit(**unit_.to_dict()) for unit_ in property_units if isinstance(unit_, UnitORM)]
+
+    def _company_ids(self) -> list[str]:
+        with self.get_session() as session:
+            return [company_id for company_id, in session.query(CompanyORM.company_id).limit(
+                self.company_buildings.max_partitions).all()]
+
+    def _property_ids(self) -> list[str]:
+        with self.get_session() as session:
+            return [property_id for property_id, in session.query(PropertyORM.property_id).limit(
+                self.property_units.max_partitions).all()]
 
     def init_app(self, app: Flask):
         super().init_app(app=app)
-        self.load_company_details()
+        if self.warmup_enabled(app=app):
+            self.company_buildings.warmup(partition_keys=self._company_ids)
+            self.property_units.warmup(partition_keys=self._property_ids)
 
     @error_handler
     async def is_company_member(self, user_id: str, company_id: str, session) -> bool:
+        members = self.company_members.get(company_id)
+        if members is None:
+            members = frozenset(_user_id for _user_id, in session.query(UserCompanyORM.user_id).filter(
+                UserCompanyORM.company_id == company_id).all())
+            self.company_members.put(company_id, members)
 
-        if self.company_user and user_id:
-            return self.company_user.get(company_id) == user_id
-
-        result: UserCompanyORM = session.query(UserCompanyORM).filter(
-            UserCompanyORM.user_id == user_id, UserCompanyORM.company_id == company_id).first()
-
-        return result and result.user_id == user_id
+        return bool(user_id) and user_id in members
 
     @error_handler
     async def get_user_companies(self, user_id: str) -> list[Company]:
-        if self.company_user and self.company_user:
-            # Get the list of company IDs associated with the given user_id
-            company_ids = [company_id for company_id, user in self.company_user.items() if user == user_id]
-            # Filter the companies list based on the company IDs then return
-            return [company for company in self.companies if company.company_id in company_ids]
-
-        with self.get_session() as session:
-            company_list: list[UserCompanyORM] = session.query(UserCompanyORM).filter(
-                UserCompanyORM.user_id == user_id).all()
+        company_ids = self.user_company_ids.get(user_id)
+        if company_ids is None:
+            return self._load_user_companies(user_id=user_id)
 
-            response = []
-            for user_company in company_list:
-                if isinstance(user_company, UserCompanyORM):
-                    company_orm: CompanyORM = session.query(CompanyORM).filter(
-                        CompanyORM.company_id == user_company.company_id).first()
-
-                    if isinstance(company_orm, CompanyORM):
-                        response.append(Company(**company_orm.to_dict()))
-
-            return response
+        companies = [self.companies_by_id.get(company_id) for company_id in company_ids]
+        if None in companies:
+            # NOTE some of the companies were evicted
+            return self._load_user_companies(user_id=user_id)
+        return companies
 
     @error_handler
     async def get_company(self, company_id: str, user_id: str) -> Company | None:
@@ -139,14 +163,25 @@ class CompaniesController(Controllers):
 
     @error_handler
     async def get_company_internal(self, company_id: str) -> Company | None:
-
-        for company in self.companies:
-            if company.company_id == company_id:
-                return company
+        company = self.companies_by_id.get(company_id)
+        if company is not None:
+            return company
 
         with self.get_session() as session:
             company_orm: CompanyORM = session.query(CompanyORM).filter(CompanyORM.company_id == company_id).first()
-            return Company(**company_orm.to_dict()) if isinstance(company_orm, CompanyORM) else None
+            if not isinstance(company_orm, CompanyORM):
+                return None
+            return self.companies_by_id.put(company_id, Company(**company_orm.to_dict()))
+
+    @error_handler
+    async def get_all_companies(self) -> list[Company]:
+        """
+            **get_all_companies**
+                admin listing - reads the database page by page and does not fill the caches
+        :return:
+        """
+        with self.get_session() as session:
+            return [Company(**company_orm.to_dict()) for company_orm in paginate(session.query(CompanyORM))]
 
     @error_handler
     async def create_company(self, company: Company, user: User) -> Company | None:
@@ -160,7 +195,6 @@ class CompaniesController(Controllers):
 
             try:
                 company: Company = Company(**company_orm.to_dict()) if isinstance(company_orm, CompanyORM) else None
-                self.companies.append(company)
             except ValidationError as e:
                 self.logger.error(str(e))
                 return None
@@ -168,10 +202,11 @@ class CompaniesController(Controllers):
             user_company_dict = dict(id=str(uuid.uuid4()), company_id=company_orm.company_id, user_id=user.user_id)
             session.add(company_orm)
             user_company_orm: UserCompanyORM = UserCompanyORM(**user_company_dict)
-            # Note see cache_dict to understand what is happening here
-            self.company_user.update(UserRelationCompany(**user_company_dict).cache_dict())
             session.add(user_company_orm)
             session.commit()
+
+            self.manage_membership(company_id=company.company_id, user_id=user.user_id)
+            self.manage_company_list(company_instance=company)
             return company
 
     @error_handler
@@ -187,7 +222,7 @@ class CompaniesController(Controllers):
             result = Company(**company_orm.to_dict()) if isinstance(company_orm, CompanyORM) else None
             session.add(company_orm)
             session.commit()
-            self.companies.append(result)
+            self.manage_company_list(company_instance=result)
             return result
 
     @error_handler
@@ -304,10 +339,9 @@ class CompaniesController(Controllers):
 
             building = Property(**property_orm.to_dict()) if isinstance(property_orm, PropertyORM) else None
 
-            self.buildings.append(building)
-
             session.add(property_orm)
             session.commit()
+            self.manage_building_list(building_instance=building)
 
             return building
 
@@ -338,7 +372,7 @@ class CompaniesController(Controllers):
             building = Property(**original_property_orm.to_dict()) if isinstance(original_property_orm,
                                                                                  PropertyORM) else None
             if building:
-                self.buildings.append(building)
+                self.manage_building_list(building_instance=building)
             return building
 
     @error_handler
@@ -349,11 +383,7 @@ class CompaniesController(Controllers):
         :param company_id:
         :return:
         """
-        if self.buildings:
-            return [building for building in self.buildings if building.company_id == company_id]
-
         with self.get_session() as session:
-            # Move this up
             user_id = user.user_id
             is_company_member: bool = await self.is_company_member(user_id=user_id,
                                                                    company_id=company_id,
@@ -361,11 +391,7 @@ class CompaniesController(Controllers):
             if not is_company_member:
                 raise UnauthorizedError(description="Not Authorized to access Properties in this Company")
 
-            properties: list[PropertyORM] = session.query(PropertyORM).filter(
-                PropertyORM.company_id == company_id).all()
-
-            return [Property(**_prop.to_dict()) for _prop in properties
-                    if isinstance(_prop, PropertyORM)] if properties else []
+        return self.company_buildings.get(company_id)
 
     @error_handler
     async def get_properties_internal(self, company_id: str) -> list[Property] | None:
@@ -374,15 +400,25 @@ class CompaniesController(Controllers):
         :param company_id:
         :return:
         """
-        if self.buildings:
-            return [building for building in self.buildings if building.company_id == company_id]
+        return self.company_buildings.get(company_id)
 
-        with self.get_session() as session:
-            properties: list[PropertyORM] = session.query(PropertyORM).filter(
-                PropertyORM.company_id == company_id).all()
+    @error_handler
+    async def get_unit_by_unit_id_internal(self, unit_id: str) -> Unit | None:
+        """
+            **get_unit_by_unit_id_internal**
+                unit lookup for background jobs, no membership check
+        :param unit_id:
+        :return:
+        """
+        unit = self.property_units.get_entity(unit_id)
+        if unit is not None:
+            return unit
 
-            return [Property(**_prop.to_dict()) for _prop in properties
-                    if isinstance(_prop, PropertyORM)] if properties else []
+        with self.get_session() as session:
+            unit_orm: UnitORM = session.query(UnitORM).filter(UnitORM.unit_id == unit_id).first()
+            if not isinstance(unit_orm, UnitORM):
+                return None
+            return Unit(**unit_orm.to_dict())
 
     @error_handler
     async def get_property_by_id_internal(self, property_id: str) -> Property | None:
@@ -391,13 +427,25 @@ class CompaniesController(Controllers):
         :param property_id:
         :return:
         """
-        for building in self.buildings:
-            if building.property_id == property_id:
-                return building
+        building = self.company_buildings.get_entity(property_id) or self.buildings_by_id.get(property_id)
+        if building is not None:
+            return building
 
         with self.get_session() as session:
             property_: PropertyORM = session.query(PropertyORM).filter(PropertyORM.property_id == property_id).first()
-            return Property(**property_.to_dict()) if isinstance(property_, PropertyORM) else None
+            if not isinstance(property_, PropertyORM):
+                return None
+            return self.buildings_by_id.put(property_id, Property(**property_.to_dict()))
+
+    @error_handler
+    async def get_all_buildings(self) -> list[Property]:
+        """
+            **get_all_buildings**
+                admin listing - reads the database page by page and does not fill the caches
+        :return:
+        """
+        with self.get_session() as session:
+            return [Property(**_prop.to_dict()) for _prop in paginate(session.query(PropertyORM))]
 
     @error_handler
     async def user_company_id(self, company_id: str) -> list[UserCompanyORM]:
@@ -406,7 +454,7 @@ class CompaniesController(Controllers):
         :param company_id:
         :return:
         """
-        with self.get_session as session:
+        with self.get_session() as session:
             users_for_company: list[UserCompanyORM] = session.query(UserCompanyORM).filter(
                 UserCompanyORM.company_id == company_id).all()
             return users_for_company
@@ -451,9 +499,9 @@ class CompaniesController(Controllers):
         :param property_id:
         :return:
         """
-        for building in self.buildings:
-            if building.property_id == property_id:
-                return building
+        building = self.company_buildings.get_entity(property_id) or self.buildings_by_id.get(property_id)
+        if building is not None:
+            return building
 
         with self.get_session() as session:
             _property: PropertyORM = session.query(PropertyORM).filter(
@@ -466,7 +514,9 @@ class CompaniesController(Controllers):
             if not is_company_member:
                 raise UnauthorizedError(description="Not Authorized to access the Property")
 
-            return Property(**_property.to_dict()) if isinstance(_property, PropertyORM) else None
+            if not isinstance(_property, PropertyORM):
+                return None
+            return self.buildings_by_id.put(property_id, Property(**_property.to_dict()))
 
     @error_handler
     async def get_property_units(self, user: User, property_id: str) -> list[Unit]:
@@ -474,15 +524,11 @@ class CompaniesController(Controllers):
 
         :return: False
         """
-        if self.units:
-            return [unit for unit in self.units if unit.property_id == property_id]
+        if not self.property_units.is_loaded(property_id):
+            with self.get_session() as session:
+                await self.check_ownership(property_id, session, user)
 
-        with self.get_session() as session:
-            await self.check_ownership(property_id, session, user)
-
-            property_units: list[UnitORM] = session.query(UnitORM).filter(UnitORM.property_id == property_id).all()
-            return [Unit(**unit_.to_dict()) for unit_ in property_units
-                    if isinstance(unit_, UnitORM)] if property_units else []
+        return self.property_units.get(property_id)
 
     async def check_ownership(self, property_id, session, user):
         user_id = user.user_id
@@ -504,16 +550,11 @@ class CompaniesController(Controllers):
         :param property_id:
         :return:
         """
-        if self.units:
-            return [unit for unit in self.units if (unit.property_id == property_id and not unit.is_occupied)]
+        if not self.property_units.is_loaded(property_id):
+            with self.get_session() as session:
+                _ = await self.check_ownership(property_id=property_id, session=session, user=user)
 
-        with self.get_session() as session:
-            _ = await self.check_ownership(property_id=property_id, session=session, user=user)
-
-            property_units: list[UnitORM] = session.query(UnitORM).filter(UnitORM.property_id == property_id,
-                                                                          UnitORM.is_occupied == False).all()
-            return [Unit(**building.to_dict()) for building
-                    in property_units if building] if isinstance(property_units, list) else []
+        return [unit for unit in self.property_units.get(property_id) if not unit.is_occupied]
 
     @error_handler
     async def add_unit(self, user: User, unit_data: AddUnit, property_id: str) -> AddUnit:
@@ -534,7 +575,8 @@ class CompaniesController(Controllers):
             unit_orm: UnitORM = UnitORM(**unit_data.dict())
             session.add(unit_orm)
             session.commit()
-            self.units.append(Unit(**unit_data.dict()))
+            self.manage_unit_list(unit_instance=Unit(**unit_orm.to_dict()))
+            self.manage_building_list(building_instance=Property(**_property.to_dict()))
             return unit_data
 
     @error_handler
@@ -546,18 +588,11 @@ class CompaniesController(Controllers):
         :param unit_id:
         :return:
         """
-        # Useless statement
-        for unit in self.units:
-            if unit.property_id == building_id and unit.unit_id == unit_id:
-                return unit
-
         _ = user.dict()
-        with self.get_session() as session:
-            unit_data: UnitORM = session.query(UnitORM).filter(
-                UnitORM.property_id == building_id, UnitORM.unit_id == unit_id).first()
-            if unit_data is None:
-                return None
-            return Unit(**unit_data.to_dict()) if isinstance(unit_data, UnitORM) else None
+        # NOTE writes go through the cache so a loaded partition is complete and the database is not consulted
+        self.property_units.get(building_id)
+        unit = self.property_units.get_entity(unit_id)
+        return unit if unit is not None and unit.property_id == building_id else None
 
     @error_handler
     async def update_unit(self, user_id: str, unit_data: Unit) -> Unit | None:
@@ -572,7 +607,9 @@ class CompaniesController(Controllers):
                                                               UnitORM.property_id == unit_data.property_id).first()
 
             if unit_orm:
-                fields_to_update = [field for field in unit_orm.__dict__.keys() if not field.startswith("_")]
+                # NOTE the row version is maintained by SQLAlchemy
+                fields_to_update = [field for field in unit_orm.__dict__.keys()
+                                    if not field.startswith("_") and field != "version"]
 
                 for field in fields_to_update:
                     if getattr(unit_data, field, None) is not None:
@@ -624,6 +661,28 @@ class CompaniesController(Controllers):
             session.commit()
             return CreateInvoicedItem(**billable_orm.to_dict()) if isinstance(billable_orm, ItemsORM) else None
 
+    @error_handler
+    async def update_billable_item(self, property_id: str, item_number: str, multiplier: int) -> BillableItem | None:
+        """
+            **update_billable_item**
+        :param property_id:
+        :param item_number:
+        :param multiplier:
+        :return:
+        """
+        with self.get_session() as session:
+            billable_orm: ItemsORM = session.query(ItemsORM).filter(ItemsORM.property_id == property_id,
+                                                                    ItemsORM.item_number == item_number).first()
+            if not isinstance(billable_orm, ItemsORM):
+                return None
+            billable_orm.multiplier = multiplier
+            # NOTE every invoice which billed a charge for this item is refreshed with it
+            self.manage_invoiced_charges(session=session, invoice_numbers=session.scalars(
+                select(InvoiceChargeORM.invoice_number).join(
+                    UserChargesORM, UserChargesORM.charge_id == InvoiceChargeORM.charge_id).where(
+                    UserChargesORM.item_number == item_number).distinct()).all())
+            return BillableItem(**billable_orm.to_dict())
+
     @error_handler
     async def get_billable_items(self, building_id: str) -> list[BillableItem]:
         """
@@ -650,6 +709,25 @@ class CompaniesController(Controllers):
             session.commit()
             return charge_item
 
+    @error_handler
+    async def update_unit_charge(self, charge_id: str, amount: int) -> CreateUnitCharge | None:
+        """
+            **update_unit_charge**
+        :param charge_id:
+        :param amount:
+        :return:
+        """
+        with self.get_session() as session:
+            charge_item_orm: UserChargesORM = session.query(UserChargesORM).filter(
+                UserChargesORM.charge_id == charge_id).first()
+            if not isinstance(charge_item_orm, UserChargesORM):
+                return None
+            charge_item_orm.amount = amount
+            # NOTE the invoices which billed this charge are refreshed with it
+            self.manage_invoiced_charges(session=session, invoice_numbers=session.scalars(
+                select(InvoiceChargeORM.invoice_number).where(InvoiceChargeORM.charge_id == charge_id)).all())
+            return CreateUnitCharge(**charge_item_orm.to_dict())
+
     @error_handler
     async def delete_unit_charge(self, charge_id: str) -> CreateUnitCharge:
         """
@@ -661,8 +739,11 @@ class CompaniesController(Controllers):
                 UserChargesORM.charge_id == charge_id).first()
             _unit_charge = CreateUnitCharge(**charge_item_orm.to_dict())
             if charge_item_orm:
+                # NOTE the invoices which billed this charge lose the item and their totals change
+                invoice_numbers = session.scalars(select(InvoiceChargeORM.invoice_number).where(
+                    InvoiceChargeORM.charge_id == charge_id)).all() if charge_item_orm.is_invoiced else []
                 session.delete(charge_item_orm)
-                session.commit()
+                self.manage_invoiced_charges(session=session, invoice_numbers=invoice_numbers)
             return _unit_charge
 
     @error_handler
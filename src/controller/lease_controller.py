@@ -1,10 +1,13 @@
 import os
 import pickle
 from datetime import datetime, date, timedelta
+from typing import Iterable
 
 from flask import Flask, url_for
 from pydantic import ValidationError
+from sqlalchemy import update, select, and_
 
+from src.cache import LRUCache, PartitionedCache, paginate
 from src.controller import error_handler, Controllers
 from src.database.models.companies import Company
 from src.database.models.invoices import Invoice, UnitCharge
@@ -14,7 +17,8 @@ from src.database.models.properties import Unit, Property
 from src.database.models.tenants import Tenant
 from src.database.sql import Session
 from src.database.sql.companies import CompanyORM
-from src.database.sql.invoices import InvoiceORM, UserChargesORM
+from src.database.sql.invoices import InvoiceORM, UserChargesORM, InvoiceChargeORM, hydrate_invoices, \
+    link_invoice_charges, refresh_invoice_totals
 from src.database.sql.lease import LeaseAgreementORM
 from src.database.sql.payments import PaymentORM
 from src.database.sql.properties import PropertyORM, UnitORM
@@ -23,24 +27,39 @@ from src.logger import init_logger
 
 
 class LeaseController(Controllers):
-    def __init__(self):
-        super().__init__()
-        self.lease_agreements: list[LeaseAgreement] = []
-        # NOTE: invoices could be buggy
-        self.invoices: list[Invoice] = []
-        self.payments: list[Payment] = []
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # NOTE lease agreements, invoices and payments are loaded per tenant on first access
+        self.tenant_leases: PartitionedCache[str, LeaseAgreement] = self.register_cache(
+            PartitionedCache(name="tenant_leases", loader=self._load_tenant_leases, partition_by="tenant_id",
+                             primary_key="agreement_id", version="version"))
+        self.tenant_invoices: PartitionedCache[str, Invoice] = self.register_cache(
+            PartitionedCache(name="tenant_invoices", loader=self._load_tenant_invoices,
+                             partition_by="customer.tenant_id", primary_key="invoice_number", version="version"))
+        self.invoices_by_number: LRUCache[int, Invoice] = self.register_cache(
+            LRUCache(name="invoices_by_number", key="invoice_number", version="version"))
+        self.tenant_payments: PartitionedCache[str, Payment] = self.register_cache(
+            PartitionedCache(name="tenant_payments", loader=self._load_tenant_payments, partition_by="tenant_id",
+                             primary_key="transaction_id", indexes=("invoice_number",), version="version"))
 
     def manage_invoice_list(self, invoice_instance: Invoice):
+        self.write_through(invoice_instance, self.invoices_by_number, self.tenant_invoices)
 
-        for index, invoice in enumerate(self.invoices):
-            if invoice == invoice_instance:
-                # Tenant already exists, remove the existing instance
-                self.invoices.pop(index)
-                self.invoices.append(invoice_instance)
-                break
-        else:
-            # Tenant instance not found, add the new instance to the list
-            self.invoices.append(invoice_instance)
+    def invalidate_invoices(self, tenant_ids: Iterable[str] = (), invoice_numbers: Iterable[int] = ()):
+        """
+            **invalidate_invoices**
+                for invoices written in bulk outside the controller - drops the tenant partitions and invoices
+                from the local caches and publishes the change so the other workers reload them
+        :param tenant_ids:
+        :param invoice_numbers:
+        :return:
+        """
+        for tenant_id in sorted(set(tenant_ids)):
+            self.tenant_invoices.invalidate(tenant_id)
+            self.publish_change(cache=self.tenant_invoices, key=tenant_id)
+        for invoice_number in sorted(set(invoice_numbers)):
+            self.invoices_by_number.invalidate(invoice_number)
+            self.publish_change(cache=self.invoices_by_number, key=invoice_number)
 
     def manage_payment_list(self, payment_instance: Payment):
         """
@@ -48,61 +67,71 @@ class LeaseController(Controllers):
         :param payment_instance:
         :return:
         """
-        for index, payment in enumerate(self.payments):
-            if payment == payment_instance:
-                # Tenant already exists, remove the existing instance
-                self.payments.pop(index)
-                self.payments.append(payment_instance)
-                break
-        else:
-            # Tenant instance not found, add the new instance to the list
-            self.payments.append(payment_instance)
+        self.write_through(payment_instance, self.tenant_payments)
 
     def manage_lease_list(self, lease_instance: LeaseAgreement):
+        self.write_through(lease_instance, self.tenant_leases)
 
-        for index, lease in enumerate(self.lease_agreements):
-            if lease == lease_instance:
-                # Tenant already exists, remove the existing instance
-                self.lease_agreements.pop(index)
-                self.lease_agreements.append(lease_instance)
-                break
-        else:
-            # Tenant instance not found, add the new instance to the list
-            self.lease_agreements.append(lease_instance)
+    def _load_tenant_leases(self, tenant_id: str) -> list[LeaseAgreement]:
+        with self.get_session() as session:
+            lease_orm_list = paginate(session.query(LeaseAgreementORM).filter(LeaseAgreementORM.tenant_id == tenant_id))
+            return [LeaseAgreement(**lease.to_dict()) for lease in lease_orm_list]
 
-    def load_data(self):
+    def _load_tenant_invoices(self, tenant_id: str) -> list[Invoice]:
         with self.get_session() as session:
-            try:
-                self.lease_agreements = [LeaseAgreement(**lease.to_dict())
-                                         for lease in session.query(LeaseAgreementORM).filter().all()]
-            except ValidationError as e:
-                self.logger.error(f"Error loading lease agreements on start_up: {str(e)}")
+            # NOTE invoiced items and customers are resolved in bulk for all the invoices of the tenant
+            invoice_list = list(paginate(session.query(InvoiceORM).filter(InvoiceORM.tenant_id == tenant_id)))
+            return [Invoice(**invoice_dict) for invoice_dict in
+                    hydrate_invoices(session=session, invoices=invoice_list)]
 
-            try:
-                self.invoices = [Invoice(**invoice_orm.to_dict()) for invoice_orm in
-                                 session.query(InvoiceORM).filter().all()]
-            except ValidationError as e:
-                self.logger.error(f"Error loading invoices on start_up: {str(e)}")
-            try:
-                self.payments = [Payment(**payment_orm.to_dict()) for payment_orm in
-                                 session.query(PaymentORM).filter().all()]
-            except ValidationError as e:
-                self.logger.error(f"Error loading payments on start_up event: {str(e)}")
+    def _load_tenant_payments(self, tenant_id: str) -> list[Payment]:
+        with self.get_session() as session:
+            payment_list = paginate(session.query(PaymentORM).filter(PaymentORM.tenant_id == tenant_id))
+            return [Payment(**payment_obj.to_dict()) for payment_obj in payment_list if payment_obj]
+
+    def _tenant_ids(self) -> list[str]:
+        with self.get_session() as session:
+            return [tenant_id for tenant_id, in session.query(LeaseAgreementORM.tenant_id).filter(
+                LeaseAgreementORM.is_active == True).distinct().limit(self.tenant_invoices.max_partitions).all()]
 
     def init_app(self, app: Flask):
         super().init_app(app=app)
-        self.load_data()
+        if self.warmup_enabled(app=app):
+            self.tenant_invoices.warmup(partition_keys=self._tenant_ids)
 
     @error_handler
     async def get_all_active_lease_agreements(self) -> list[LeaseAgreement]:
-        if self.lease_agreements:
-            return [lease for lease in self.lease_agreements if lease.is_active]
-
         with self.get_session() as session:
             lease_agreements = session.query(LeaseAgreementORM).filter(LeaseAgreementORM.is_active == True).all()
-            return [LeaseAgreement(**lease.dict())
+            return [LeaseAgreement(**lease.to_dict())
                     for lease in lease_agreements] if lease_agreements else []
 
+    @error_handler
+    async def get_agreements_crossing_expiry(self, since: date | None, today: date,
+                                             notify_days_before: int) -> list[LeaseAgreement]:
+        """
+            **get_agreements_crossing_expiry**
+                active agreements which expired after the run on since, or which have not expired yet and are
+                within notify_days_before of expiring - agreements created or renewed after the previous run are
+                picked up too, the lease_notices already sent stop them being notified twice, ranges on the
+                end_date index so the cost follows the number of agreements near expiry rather than the size
+                of the portfolio
+        :param since: day of the previous run, None on the first run
+        :param today:
+        :param notify_days_before:
+        :return:
+        """
+        notice_period = timedelta(days=notify_days_before)
+        end_date = LeaseAgreementORM.end_date
+        crossing = end_date <= today + notice_period
+        if since is not None:
+            crossing = and_(end_date >= since, crossing)
+
+        with self.get_session() as session:
+            lease_agreements = session.scalars(select(LeaseAgreementORM).where(
+                LeaseAgreementORM.is_active == True, crossing).order_by(end_date))
+            return [LeaseAgreement(**lease.to_dict()) for lease in lease_agreements]
+
     @error_handler
     async def create_lease_agreement(self, lease: CreateLeaseAgreement) -> LeaseAgreement | None:
         """
@@ -114,10 +143,11 @@ class LeaseController(Controllers):
         with self.get_session() as session:
             lease_orm: LeaseAgreementORM = LeaseAgreementORM(**lease.dict())
             session.add(lease_orm)
+            session.flush()
+            lease_data = LeaseAgreement(**lease_orm.to_dict())
             session.commit()
 
-            lease_data = LeaseAgreement(**lease.dict())
-            self.lease_agreements.append(lease_data)
+            self.manage_lease_list(lease_instance=lease_data)
             return lease_data
 
     @staticmethod
@@ -140,16 +170,13 @@ class LeaseController(Controllers):
         :param payment_terms:
         :return:
         """
-        if self.lease_agreements:
-            return [lease for lease in self.lease_agreements
-                    if lease.is_active and lease.payment_period == payment_terms]
-
         with self.get_session() as session:
             try:
                 lease_orm_list: list[LeaseAgreementORM] = session.query(LeaseAgreementORM).filter(
                     LeaseAgreementORM.is_active == True, LeaseAgreementORM.payment_period == payment_terms).all()
 
-                return [LeaseAgreement(**lease.dict()) for lease in lease_orm_list if lease] if lease_orm_list else []
+                return [LeaseAgreement(**lease.to_dict()) for lease in lease_orm_list
+                        if lease] if lease_orm_list else []
 
             except Exception as e:
                 self.logger.error(f"Error creating Lease Agreement:  {str(e)}")
@@ -163,13 +190,19 @@ class LeaseController(Controllers):
 
         :return:
         """
-        for invoice in self.invoices:
-            if invoice.invoice_number == invoice_number:
-                return invoice
+        # NOTE routes pass the invoice number as a string, invoices are keyed by the integer primary key
+        if isinstance(invoice_number, str) and invoice_number.isdigit():
+            invoice_number = int(invoice_number)
+        invoice = self.tenant_invoices.get_entity(invoice_number) or self.invoices_by_number.get(invoice_number)
+        if invoice is not None:
+            return invoice
 
         with self.get_session() as session:
             invoice_orm = session.query(InvoiceORM).filter(InvoiceORM.invoice_number == invoice_number).first()
-            return Invoice(**invoice_orm.to_dict()) if isinstance(invoice_orm, InvoiceORM) else None
+            if not isinstance(invoice_orm, InvoiceORM):
+                return None
+            invoice = Invoice(**hydrate_invoices(session=session, invoices=[invoice_orm])[0])
+            return self.invoices_by_number.put(invoice.invoice_number, invoice)
 
     @error_handler
     async def update_invoice(self, invoice: Invoice):
@@ -188,12 +221,14 @@ class LeaseController(Controllers):
                 invoice_orm.description = invoice.description
                 invoice_orm.currency = invoice.currency
                 invoice_orm.tax_rate = invoice.tax_rate
+                # NOTE the tax rate changes the persisted totals
+                refresh_invoice_totals(session=session, invoice_numbers=[invoice_orm.invoice_number])
 
                 # Commit the changes to the database
                 session.commit()
 
                 # Return the updated invoice
-                invoice_data = Invoice(**invoice_orm.to_dict())
+                invoice_data = Invoice(**hydrate_invoices(session=session, invoices=[invoice_orm])[0])
                 self.manage_invoice_list(invoice_instance=invoice_data)
                 return invoice_data
 
@@ -281,19 +316,27 @@ class LeaseController(Controllers):
                     return None
 
                 session.add(invoice_orm)
+                # NOTE: flush assigns the invoice_number so the charges can be marked in the same transaction
+                session.flush()
+
+                # NOTE: marking user charges as invoiced - this also links the charges to the invoice
+                charges_marked: int | None = await self.mark_charges_as_invoiced(
+                    session=session, invoice_number=invoice_orm.invoice_number, charge_ids=list_charge_ids)
+                if charges_marked is None:
+                    # NOTE error_handler already logged the failure - the invoice must not be saved without its charges
+                    session.rollback()
+                    return None
+                refresh_invoice_totals(session=session, invoice_numbers=[invoice_orm.invoice_number])
                 session.commit()
+                self.logger.info(f"Marked {charges_marked} charges as invoiced on : {invoice_orm.invoice_number}")
 
                 try:
-                    _invoice_data: Invoice = Invoice(**invoice_orm.to_dict())
-                    # TODO - this could be buggy please revise
-                    self.invoices.append(_invoice_data)
+                    _invoice_data: Invoice = Invoice(**hydrate_invoices(session=session, invoices=[invoice_orm])[0])
+                    self.manage_invoice_list(invoice_instance=_invoice_data)
                 except ValidationError as e:
                     self.logger.error(str(e))
                 self.logger.info(f"Invoice Created Successfully : {_invoice_data}")
 
-                # NOTE: marking user charges as invoiced
-                await self.mark_charges_as_invoiced(session=session, charge_ids=list_charge_ids)
-
                 return _invoice_data
 
             except Exception as e:
@@ -337,20 +380,39 @@ class LeaseController(Controllers):
 
     @staticmethod
     @error_handler
-    async def mark_charges_as_invoiced(session: Session, charge_ids: list[str]):
+    async def mark_charges_as_invoiced(session: Session, invoice_number: int, charge_ids: list[str]) -> int:
         """
-
+            **mark_charges_as_invoiced**
+                links the charges to the invoice in invoice_charge and flags them as invoiced with
+                one bulk insert and one UPDATE, the caller commits so this happens in the invoice transaction
         :param session:
+        :param invoice_number:
         :param charge_ids:
+        :return: number of user charges marked as invoiced
+        """
+        if not charge_ids:
+            return 0
+
+        link_invoice_charges(session=session, invoice_number=invoice_number, charge_ids=charge_ids)
+        result = session.execute(update(UserChargesORM).where(UserChargesORM.charge_id.in_(set(charge_ids))).values(
+            is_invoiced=True).execution_options(synchronize_session=False))
+        return result.rowcount
+
+    @error_handler
+    async def get_invoice_by_charge_id(self, charge_id: str) -> Invoice | None:
+        """
+            **get_invoice_by_charge_id**
+                finds the invoice which billed a user charge through the invoice_charge index
+        :param charge_id:
         :return:
         """
-        for _id in charge_ids:
-            user_charge: UserChargesORM = session.query(UserChargesORM).filter(UserChargesORM.charge_id == _id).first()
-            if user_charge:
-                user_charge.is_invoiced = True
-                session.merge(user_charge)
-                session.commit()
-        return None
+        with self.get_session() as session:
+            invoice_orm = session.query(InvoiceORM).join(
+                InvoiceChargeORM, InvoiceChargeORM.invoice_number == InvoiceORM.invoice_number).filter(
+                InvoiceChargeORM.charge_id == charge_id).first()
+            if not isinstance(invoice_orm, InvoiceORM):
+                return None
+            return Invoice(**hydrate_invoices(session=session, invoices=[invoice_orm])[0])
 
     @error_handler
     async def get_invoices(self, tenant_id: str) -> list[Invoice]:
@@ -358,12 +420,7 @@ class LeaseController(Controllers):
             **get_invoices**
         :return:
         """
-        if self.invoices:
-            return [invoice for invoice in self.invoices if invoice.customer.tenant_id == tenant_id]
-
-        with self.get_session() as session:
-            invoice_list: list[InvoiceORM] = session.query(InvoiceORM).filter(InvoiceORM.tenant_id == tenant_id).all()
-            return [Invoice(**_invoice.to_dict()) for _invoice in invoice_list if _invoice] if invoice_list else []
+        return self.tenant_invoices.get(tenant_id)
 
     @error_handler
     async def add_payment(self, payment: Payment):
@@ -375,8 +432,10 @@ class LeaseController(Controllers):
         with self.get_session() as session:
             payment_instance = PaymentORM(**payment.dict())
             session.add(payment_instance)
+            session.flush()
             payment_data = Payment(**payment_instance.to_dict())
             session.commit()
+            self.manage_payment_list(payment_instance=payment_data)
             return payment_data
 
     @error_handler
@@ -430,10 +489,7 @@ class LeaseController(Controllers):
         :param tenant_id: The ID of the tenant.
         :return: A list of payments made by the tenant.
         """
-        with self.get_session() as session:
-            payment_list = session.query(PaymentORM).filter(PaymentORM.tenant_id == tenant_id).all()
-            return [Payment(**payment_obj.to_dict()) for payment_obj in payment_list
-                    if payment_obj] if payment_list else []
+        return self.tenant_payments.get(tenant_id)
 
     @error_handler
     async def load_payment(self, transaction_id: str) -> Payment | None:
@@ -441,6 +497,10 @@ class LeaseController(Controllers):
         :param transaction_id:
         :return:
         """
+        payment = self.tenant_payments.get_entity(transaction_id)
+        if payment is not None:
+            return payment
+
         with self.get_session() as session:
             transaction = session.query(PaymentORM).filter(PaymentORM.transaction_id == transaction_id).first()
             return Payment(**transaction.to_dict()) if transaction else None
@@ -462,8 +522,11 @@ class LeaseController(Controllers):
             transaction.payment_method = payment_instance.payment_method
             transaction.is_successful = payment_instance.is_successful
             transaction.comments = payment_instance.comments
-            session.merge(transaction)
-            return Payment(**transaction.to_dict())
+            session.flush()
+            payment_data = Payment(**transaction.to_dict())
+            session.commit()
+            self.manage_payment_list(payment_instance=payment_data)
+            return payment_data
 
     @error_handler
     async def load_tenant_statements(self, tenant_id: str):
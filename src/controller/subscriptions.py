@@ -3,6 +3,7 @@ import uuid
 
 from flask import Flask
 
+from src.cache import LRUCache, paginate
 from src.controller import Controllers, error_handler
 from src.database.models.subscriptions import Subscriptions, Plan, SubscriptionFormInput, PaymentReceipts
 from src.database.sql.subscriptions import SubscriptionsORM, PlansORM, PaymentReceiptORM
@@ -20,9 +21,19 @@ class SubscriptionController(Controllers):
 
     def __init__(self):
         super().__init__()
-        self.subscriptions: dict[str, Subscriptions] = {}
+        # NOTE subscriptions are cached per user on first access, plans are a small reference table
+        self.subscriptions: LRUCache[str, Subscriptions] = self.register_cache(LRUCache(name="subscriptions"))
         self.plans: list[Plan] = []
-        self.payment_receipts: list[PaymentReceipts] = []
+
+    def manage_subscription(self, user_id: str):
+        """
+            **manage_subscription**
+                the subscription of the user is re-read on the next access after a write
+        :param user_id:
+        :return:
+        """
+        self.subscriptions.pop(user_id)
+        self.publish_change(cache=self.subscriptions, key=user_id)
 
     def create_sub_model(self, sub_orm: SubscriptionsORM):
         _plan = None
@@ -35,27 +46,18 @@ class SubscriptionController(Controllers):
                                        date_subscribed=sub_orm.date_subscribed,
                                        subscription_period_in_month=sub_orm.subscription_period_in_month))
 
-    def _load_subscriptions(self):
+    def _load_plans(self):
         """
 
         :return:
         """
-        self.subscriptions = {}
-        self.plans = []
-        self.payment_receipts = []
         with self.get_session() as session:
             plans_orm_list: list[PlansORM] = session.query(PlansORM).all()
             self.plans = [Plan(**plan_orm.to_dict()) for plan_orm in plans_orm_list]
 
-            subscriptions_orm_list: list[SubscriptionsORM] = session.query(SubscriptionsORM).all()
-            self.subscriptions = {sub_orm.user_id: self.create_sub_model(sub_orm=sub_orm)
-                                  for sub_orm in subscriptions_orm_list}
-            payments_orm_list: list[PaymentReceiptORM] = session.query(PaymentReceiptORM).all()
-            self.payment_receipts = [PaymentReceipts(**receipt.to_dict()) for receipt in payments_orm_list if
-                                     receipt] if payments_orm_list else []
-
     def init_app(self, app: Flask):
-        self._load_subscriptions()
+        super().init_app(app=app)
+        self._load_plans()
 
     @error_handler
     async def get_subscription_by_uid(self, user_id: str) -> Subscriptions | None:
@@ -64,17 +66,38 @@ class SubscriptionController(Controllers):
         :param user_id:
         :return:
         """
-        if user_id in self.subscriptions:
-            return self.subscriptions.get(user_id)
+        subscription = self.subscriptions.get(user_id)
+        if subscription is not None:
+            return subscription
 
         with self.get_session() as session:
             subscription_orm = session.query(SubscriptionsORM).filter(SubscriptionsORM.user_id == user_id).first()
             if not subscription_orm:
                 return None
 
-            subscription = Subscriptions(**subscription_orm.to_dict())
-            self.subscriptions[subscription.user_id] = subscription
-            return subscription
+        return self.subscriptions.put(user_id, self.create_sub_model(sub_orm=subscription_orm))
+
+    @error_handler
+    async def get_all_subscriptions(self) -> list[Subscriptions]:
+        """
+            **get_all_subscriptions**
+                admin listing - reads the database page by page and does not fill the caches
+        :return:
+        """
+        with self.get_session() as session:
+            subscriptions_orm_list = list(paginate(session.query(SubscriptionsORM)))
+        return [self.create_sub_model(sub_orm=sub_orm) for sub_orm in subscriptions_orm_list]
+
+    @error_handler
+    async def get_payment_receipts(self) -> list[PaymentReceipts]:
+        """
+            **get_payment_receipts**
+                admin listing
+        :return:
+        """
+        with self.get_session() as session:
+            return [PaymentReceipts(**receipt.to_dict()) for receipt in paginate(session.query(PaymentReceiptORM))
+                    if receipt]
 
     @error_handler
     async def get_plan_by_id(self, plan_id: str) -> Plan | None:
@@ -106,7 +129,6 @@ class SubscriptionController(Controllers):
 
             return Plan(**plan_orm.to_dict())
 
-
     @error_handler
     async def get_subscriptions_by_plan_name(self, plan_name: str) -> list[Subscriptions]:
         """
@@ -114,9 +136,14 @@ class SubscriptionController(Controllers):
         :param plan_name:
         :return:
         """
+        plan_ids = [plan.plan_id for plan in self.plans if plan.name.casefold() == plan_name.casefold()]
+        if not plan_ids:
+            return []
 
-        return [subscription for subscription in self.subscriptions.values()
-                if subscription.plan.name.casefold() == plan_name.casefold()]
+        with self.get_session() as session:
+            subscriptions_orm_list = list(paginate(session.query(SubscriptionsORM).filter(
+                SubscriptionsORM.plan_id.in_(plan_ids))))
+        return [self.create_sub_model(sub_orm=sub_orm) for sub_orm in subscriptions_orm_list]
 
     @error_handler
     async def add_subscription_plan(self, plan: Plan) -> Plan:
@@ -163,7 +190,7 @@ class SubscriptionController(Controllers):
                 session.add(PaymentReceiptORM(**payment_receipt.dict()))
                 session.commit()
 
-            self._load_subscriptions()
+            self.manage_subscription(user_id=subscription_form.user_id)
 
             return dict(subscription=new_subscription.disp_dict(), payment=payment_receipt.dict())
 
@@ -171,7 +198,7 @@ class SubscriptionController(Controllers):
             with self.get_session() as session:
                 session.add(SubscriptionsORM(**new_subscription.orm_dict()))
                 session.commit()
-            self._load_subscriptions()
+            self.manage_subscription(user_id=subscription_form.user_id)
             return dict(subscription=new_subscription.disp_dict(), plan=plan.dict())
 
     @error_handler
@@ -214,8 +241,7 @@ class SubscriptionController(Controllers):
             session.merge(payment_receipt_orm)
             session.commit()
             self.logger.info(f"Receipt Marked as Paid : {payment_receipt_orm.to_dict()}")
-
-        self._load_subscriptions()
+            self.manage_subscription(user_id=payment_receipt_orm.user_id)
 
         return True
 
@@ -234,17 +260,65 @@ class SubscriptionController(Controllers):
             payment_receipt_orm.status = status
             session.merge(payment_receipt_orm)
             session.commit()
-
-        self._load_subscriptions()
+            self.manage_subscription(user_id=payment_receipt_orm.user_id)
         return True
 
     def is_subscription_paid(self, subscription_id: str) -> bool:
         """
         """
-        for receipt in self.payment_receipts:
-            if receipt.subscription_id == subscription_id:
-                return receipt.paid_in_full and receipt.is_verified or (receipt.status == "completed")
-        return False
+        with self.get_session() as session:
+            receipt_orm = session.query(PaymentReceiptORM).filter(
+                PaymentReceiptORM.subscription_id == subscription_id).first()
+            return self._is_receipt_paid(receipt_orm=receipt_orm)
+
+    @staticmethod
+    def _is_receipt_paid(receipt_orm: PaymentReceiptORM | None) -> bool:
+        if not receipt_orm:
+            return False
+        receipt = PaymentReceipts(**receipt_orm.to_dict())
+        return receipt.paid_in_full and receipt.is_verified or (receipt.status == "completed")
+
+    @error_handler
+    async def check_subscriptions(self, after: str | None = None, limit: int = 500) -> tuple[str | None, dict[str, int]]:
+        """
+            **check_subscriptions**
+                one page of subscriptions ordered by subscription_id, subscriptions which have expired or are
+                no longer paid are dropped and published to every worker - the worker holding one in its cache
+                need not be this one - so the next access reads their current state
+        :param after: last subscription_id of the previous page
+        :param limit:
+        :return: last subscription_id of this page - None once every subscription was checked, counts
+        """
+        with self.get_session() as session:
+            query = session.query(SubscriptionsORM).order_by(SubscriptionsORM.subscription_id)
+            if after is not None:
+                query = query.filter(SubscriptionsORM.subscription_id > after)
+            subscriptions_orm_list: list[SubscriptionsORM] = query.limit(limit).all()
+            subscription_ids = [sub_orm.subscription_id for sub_orm in subscriptions_orm_list]
+            receipts = {receipt.subscription_id: receipt for receipt in session.query(PaymentReceiptORM).filter(
+                PaymentReceiptORM.subscription_id.in_(subscription_ids))} if subscription_ids else {}
+
+        counts = dict(checked=0, active=0, expired=0, unpaid=0, refreshed=0)
+        for sub_orm in subscriptions_orm_list:
+            plan = next((plan for plan in self.plans if plan.plan_id == sub_orm.plan_id), None)
+            if plan is None:
+                continue
+            subscription = Subscriptions(user_id=sub_orm.user_id, subscription_id=sub_orm.subscription_id, plan=plan,
+                                         date_subscribed=sub_orm.date_subscribed,
+                                         subscription_period_in_month=sub_orm.subscription_period_in_month,
+                                         is_paid=self._is_receipt_paid(receipts.get(sub_orm.subscription_id)))
+            counts['checked'] += 1
+            counts['active'] += subscription.is_active
+            counts['expired'] += subscription.is_expired
+            counts['unpaid'] += not subscription.is_paid
+
+            cached = self.subscriptions.peek(sub_orm.user_id)
+            if not subscription.is_active or (cached is not None and cached.is_active != subscription.is_active):
+                self.manage_subscription(user_id=sub_orm.user_id)
+                counts['refreshed'] += 1
+
+        last_id = subscription_ids[-1] if len(subscription_ids) == limit else None
+        return last_id, counts
 
     def set_active(self, subscription: Subscriptions) -> Subscriptions:
         subscription.is_paid = self.is_subscription_paid(subscription_id=subscription.subscription_id)
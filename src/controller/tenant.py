@@ -1,6 +1,6 @@
 from flask import Flask
-from pydantic import ValidationError
 
+from src.cache import LRUCache, PartitionedCache, paginate
 from src.controller import error_handler, Controllers
 from src.database.models.properties import Unit, Property
 from src.database.models.tenants import Tenant, QuotationForm, CreateTenant, TenantAddress, CreateTenantAddress
@@ -11,35 +11,37 @@ from src.database.sql.tenants import TenantORM, TenantAddressORM
 class TenantController(Controllers):
     def __init__(self):
         super().__init__()
-        self.tenants: list[Tenant] = []
+        # NOTE tenants are loaded per company on first access instead of loading the whole table on start up
+        self.company_tenants: PartitionedCache[str, Tenant] = self.register_cache(
+            PartitionedCache(name="company_tenants", loader=self._load_company_tenants, partition_by="company_id",
+                             primary_key="tenant_id", indexes=("cell",), version="version"))
+        self.tenants_by_id: LRUCache[str, Tenant] = self.register_cache(
+            LRUCache(name="tenants_by_id", key="tenant_id", version="version"))
 
     def manage_tenant_list(self, tenant_instance: Tenant):
-        # Check if the tenant instance already exists in the list
-        for index, tenant in enumerate(self.tenants):
-            if tenant.tenant_id == tenant_instance.tenant_id:
-                # Tenant already exists, remove the existing instance
-                self.tenants.pop(index)
-                self.tenants.append(tenant_instance)
-                break
-        else:
-            # Tenant instance not found, add the new instance to the list
-            self.tenants.append(tenant_instance)
-
-    def load_tenants(self) -> None:
         """
+            **manage_tenant_list**
+                keeps the cached copies of a tenant up-to-date after a write
+        :param tenant_instance:
+        :return:
+        """
+        self.write_through(tenant_instance, self.tenants_by_id, self.company_tenants)
 
-        **load_tenants*8
-
+    def _load_company_tenants(self, company_id: str) -> list[Tenant]:
+        """
+            **_load_company_tenants**
+                loads the tenants of a single company page by page
+        :param company_id:
         :return:
         """
         with self.get_session() as session:
-            tenant_orm_list = session.query(TenantORM).filter().all()
-            try:
-                self.tenants = [Tenant(**tenant.to_dict()) for tenant in tenant_orm_list if
-                                tenant] if tenant_orm_list else []
-            except ValidationError as e:
-                self.logger.error(f"Error loading tenants on start_up : {str(e)}")
-                pass
+            tenant_orm_list = paginate(session.query(TenantORM).filter(TenantORM.company_id == company_id))
+            return [Tenant(**tenant.to_dict()) for tenant in tenant_orm_list if tenant]
+
+    def _company_ids(self) -> list[str]:
+        with self.get_session() as session:
+            return [company_id for company_id, in session.query(TenantORM.company_id).filter(
+                TenantORM.company_id.isnot(None)).distinct().limit(self.company_tenants.max_partitions).all()]
 
     def init_app(self, app: Flask):
         """
@@ -48,7 +50,8 @@ class TenantController(Controllers):
         :return:
         """
         super().init_app(app=app)
-        self.load_tenants()
+        if self.warmup_enabled(app=app):
+            self.company_tenants.warmup(partition_keys=self._company_ids)
 
     @error_handler
     async def get_tenants_by_company_id(self, company_id: str) -> list[Tenant]:
@@ -59,13 +62,7 @@ class TenantController(Controllers):
         :param company_id:
         :return:
         """
-        if self.tenants:
-            return [tenant for tenant in self.tenants if tenant.company_id == company_id]
-
-        with self.get_session() as session:
-            tenants_list: list[TenantORM] = session.query(TenantORM).filter(TenantORM.company_id == company_id).all()
-            return [Tenant(**tenant_orm.to_dict()) for tenant_orm in tenants_list
-                    if isinstance(tenant_orm, TenantORM)] if tenants_list else []
+        return self.company_tenants.get(company_id)
 
     # noinspection DuplicatedCode
     @error_handler
@@ -76,12 +73,15 @@ class TenantController(Controllers):
         :param cell:
         :return:
         """
-        if self.tenants:
-            return next((tenant for tenant in self.tenants if tenant.cell == cell), None)
+        cached_tenants = self.company_tenants.find("cell", cell)
+        if cached_tenants:
+            return cached_tenants[0]
 
         with self.get_session() as session:
             tenant = session.query(TenantORM).filter(TenantORM.cell == cell).first()
-            return Tenant(**tenant.to_dict()) if isinstance(tenant, TenantORM) else None
+            if not isinstance(tenant, TenantORM):
+                return None
+            return self.tenants_by_id.put(tenant.tenant_id, Tenant(**tenant.to_dict()))
 
     # noinspection DuplicatedCode
     @error_handler
@@ -90,22 +90,32 @@ class TenantController(Controllers):
         :param tenant_id:
         :return:
         """
-        if self.tenants:
-            return next((tenant for tenant in self.tenants if tenant.tenant_id == tenant_id), None)
+        tenant = self.company_tenants.get_entity(tenant_id) or self.tenants_by_id.get(tenant_id)
+        if tenant is not None:
+            return tenant
 
         with self.get_session() as session:
             tenant = session.query(TenantORM).filter(TenantORM.tenant_id == tenant_id).first()
-            return Tenant(**tenant.to_dict()) if isinstance(tenant, TenantORM) else None
+            if not isinstance(tenant, TenantORM):
+                return None
+            return self.tenants_by_id.put(tenant_id, Tenant(**tenant.to_dict()))
 
     @error_handler
     async def get_un_booked_tenants(self) -> list[Tenant]:
-        if self.tenants:
-            return [tenant for tenant in self.tenants if not tenant.is_renting]
-
         with self.get_session() as session:
             tenants_list: list[TenantORM] = session.query(TenantORM).filter(TenantORM.is_renting == False).all()
             return [Tenant(**tenant.to_dict()) for tenant in tenants_list if tenant] if tenants_list else []
 
+    @error_handler
+    async def get_all_tenants(self) -> list[Tenant]:
+        """
+            **get_all_tenants**
+                admin listing - reads the database page by page and does not fill the caches
+        :return:
+        """
+        with self.get_session() as session:
+            return [Tenant(**tenant.to_dict()) for tenant in paginate(session.query(TenantORM)) if tenant]
+
     @error_handler
     async def create_quotation(self, user: User, quotation: QuotationForm) -> dict[str, Unit | Property]:
         """
@@ -139,10 +149,11 @@ class TenantController(Controllers):
         """
         with self.get_session() as session:
             tenant_orm: TenantORM = TenantORM(**tenant.dict())
-            tenant_data = Tenant(**tenant_orm.to_dict()) if isinstance(tenant_orm, TenantORM) else None
-            self.tenants.append(tenant_data)
             session.add(tenant_orm)
+            session.flush()
+            tenant_data = Tenant(**tenant_orm.to_dict()) if isinstance(tenant_orm, TenantORM) else None
             session.commit()
+            self.manage_tenant_list(tenant_instance=tenant_data)
             return tenant_data
 
     @error_handler
@@ -151,7 +162,9 @@ class TenantController(Controllers):
             tenant_orm: TenantORM = session.query(TenantORM).filter(TenantORM.tenant_id == tenant.tenant_id).first()
 
             if tenant_orm:
-                fields_to_update = [field for field in tenant_orm.__dict__.keys() if not field.startswith("_")]
+                # NOTE the row version is maintained by SQLAlchemy
+                fields_to_update = [field for field in tenant_orm.__dict__.keys()
+                                    if not field.startswith("_") and field != "version"]
 
                 for field in fields_to_update:
                     if hasattr(tenant, field) and getattr(tenant, field) is not None:
@@ -160,7 +173,7 @@ class TenantController(Controllers):
                 session.merge(tenant_orm)
                 session.commit()
                 tenant = Tenant(**tenant_orm.to_dict())
-                # NOTE Update the tenant record in self.tenants
+                # NOTE Update the cached tenant records
                 self.manage_tenant_list(tenant_instance=tenant)
                 return tenant
 
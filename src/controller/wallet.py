@@ -1,5 +1,6 @@
 from flask import Flask
 
+from src.cache import LRUCache, paginate
 from src.controller import Controllers
 from src.database.models.wallet import Wallet, WalletTransaction
 from src.database.sql.wallet import WalletTransactionORM
@@ -8,31 +9,44 @@ from src.database.sql.wallet import WalletTransactionORM
 class WalletController(Controllers):
     def __init__(self):
         super().__init__()
-        self.wallets: dict[str, Wallet] = {}
+        # NOTE wallets are built per user on first access instead of replaying every transaction on start up
+        self.wallets: LRUCache[str, Wallet] = self.register_cache(LRUCache(name="wallets"))
 
-    def load_and_build_wallets(self):
-        wallets_by_user_id = {}
+    def build_wallet(self, user_id: str) -> Wallet:
+        """
+            **build_wallet**
+                replays the transactions of a single user to calculate the wallet balance
+        :param user_id:
+        :return:
+        """
+        wallet = Wallet(user_id=user_id, transactions=[])
         with self.get_session() as session:
-            transactions_orm_list = session.query(WalletTransactionORM).filter().all()
-            transactions_list = [WalletTransaction(**transaction_orm.to_dict())
-                                 for transaction_orm in transactions_orm_list]
-
-            for transaction in transactions_list:
-                # Check if the wallet already exists in the dictionary, otherwise create a new one
-                if transaction.user_id not in self.wallets:
-                    self.wallets[transaction.user_id] = Wallet(
-                        user_id=transaction.user_id,
-                        transactions=[],
-                    )
-                # Add the transaction to the user's wallet
+            transactions_orm_list = paginate(session.query(WalletTransactionORM).filter(
+                WalletTransactionORM.user_id == user_id))
 
-                self.wallets[transaction.user_id].transactions.append(transaction)
+            for transaction_orm in transactions_orm_list:
+                transaction = WalletTransaction(**transaction_orm.to_dict())
+                # Add the transaction to the user's wallet
+                wallet.transactions.append(transaction)
 
                 # Calculate the balance based on the transaction type
                 if transaction.transaction_type == "deposit":
-                    self.wallets[transaction.user_id].balance += transaction.amount
+                    wallet.balance += transaction.amount
                 elif transaction.transaction_type == "payment" or transaction.transaction_type == "withdrawal":
-                    self.wallets[transaction.user_id].balance -= transaction.amount
+                    wallet.balance -= transaction.amount
+
+        return wallet
+
+    def get_wallet(self, user_id: str) -> Wallet:
+        """
+            **get_wallet**
+        :param user_id:
+        :return:
+        """
+        wallet = self.wallets.get(user_id)
+        if wallet is None:
+            wallet = self.wallets.put(user_id, self.build_wallet(user_id=user_id))
+        return wallet
 
     def init_app(self, app: Flask):
         """
@@ -40,4 +54,4 @@ class WalletController(Controllers):
         :param app:
         :return:
         """
-        self.load_and_build_wallets()
+        super().init_app(app=app)
@@ -0,0 +1,52 @@
+"""
+    **cron cli**
+        runs the scheduled jobs in a process of their own instead of inside a web request
+
+        python -m src.cron.cli run            - runs every job when it is due, until interrupted
+        python -m src.cron.cli once JOB       - runs one job now
+        python -m src.cron.cli status         - last run, outcome and durations of every job
+"""
+import argparse
+import json
+
+
+def main(argv: list[str] | None = None) -> int:
+    from src.cron.cli.jobs import JOBS
+
+    parser = argparse.ArgumentParser(description="scheduled jobs of the rental manager")
+    parser.add_argument("--store", default=None, help="SQLite job store - defaults to CRON_JOB_STORE")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the jobs as they fall due")
+    run_parser.add_argument("--poll", type=float, default=60.0, help="seconds between checks for due jobs")
+    once_parser = commands.add_parser("once", help="run a single job now")
+    once_parser.add_argument("job", choices=[job.name for job in JOBS])
+    commands.add_parser("status", help="show the job store")
+    args = parser.parse_args(argv)
+
+    from src.config import config_instance
+    from src.cron.cli.store import SQLiteJobStore
+    config = config_instance()
+    store = SQLiteJobStore(path=args.store or config.CRON_JOB_STORE)
+
+    if args.command == "status":
+        for job in store.status():
+            print(json.dumps(job, default=str))
+        return 0
+
+    from src.main import create_app
+    from src.cron.cli.scheduler import Scheduler
+    app = create_app(config=config)
+    # NOTE the controllers report database errors through flash, which needs a request context
+    scheduler = Scheduler(jobs=JOBS, store=store, run_context=app.test_request_context)
+
+    if args.command == "once":
+        status = scheduler.run_job(job=scheduler.jobs[args.job])
+        print(f"{args.job}: {status or 'running elsewhere'}")
+        return 0 if status == "completed" else 1
+
+    scheduler.run_forever(poll_interval=args.poll)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
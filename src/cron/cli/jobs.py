@@ -0,0 +1,65 @@
+"""
+    **jobs**
+        the scheduled jobs, each takes the JobContext of its run and returns a summary of what it did
+"""
+from src.cron.cli.scheduler import Job, JobContext
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+async def lease_expiry(context: JobContext) -> dict[str, int]:
+    """
+        **lease_expiry**
+            resumes from the watermark kept in the database rather than from the job checkpoint
+    :param context:
+    :return:
+    """
+    from src.business_logic.lease.check_expired import process_lease_expiry
+    return await process_lease_expiry()
+
+
+async def monthly_invoicing(context: JobContext) -> dict[str, int]:
+    """
+        **monthly_invoicing**
+            lease agreements already invoiced this month are skipped, progress only keeps the job lock renewed,
+            INVOICING_WORKERS spreads the companies over a process pool
+    :param context:
+    :return:
+    """
+    from src.business_logic.lease.create_invoices import StatementsAndInvoicing
+    from src.config import config_instance
+
+    def progress(invoiced: int, total: int):
+        context.save_progress(dict(invoiced=invoiced, total=total))
+
+    return await StatementsAndInvoicing(progress=progress).run(workers=config_instance().INVOICING_WORKERS)
+
+
+async def subscription_check(context: JobContext) -> dict[str, int]:
+    """
+        **subscription_check**
+            pages through the subscriptions, a run which fails resumes after the last page it checked
+    :param context:
+    :return:
+    """
+    from src.main import subscriptions_controller
+    totals: dict[str, int] = {}
+    after = context.checkpoint
+    while True:
+        page = await subscriptions_controller.check_subscriptions(after=after)
+        if page is None:
+            raise RuntimeError("subscription check - unable to read subscriptions")
+        after, counts = page
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+        if after is None:
+            return totals
+        context.save_progress(after)
+
+
+JOBS: list[Job] = [
+    Job(name="lease_expiry", run=lease_expiry, interval=DAY),
+    Job(name="monthly_invoicing", run=monthly_invoicing, interval=DAY, timeout=4 * HOUR),
+    Job(name="subscription_check", run=subscription_check, interval=6 * HOUR),
+]
@@ -0,0 +1,111 @@
+"""
+    **scheduler**
+        runs the scheduled jobs outside the web workers, each job runs when its interval has passed since it
+        last started, holds the job lock of the store while it runs and records its duration and outcome
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from src.cron.cli.store import SQLiteJobStore
+from src.logger import init_logger
+
+
+class JobContext:
+    """
+        **JobContext**
+            handed to a job - checkpoint is where a previous run which did not complete stopped,
+            save_progress records how far this run got and renews the job lock
+    """
+
+    def __init__(self, name: str, store: SQLiteJobStore, renew: Callable[[], bool]):
+        self.name = name
+        self._store = store
+        self._renew = renew
+        self.checkpoint: Any = store.load_checkpoint(name=name)
+
+    def save_progress(self, checkpoint: Any):
+        if not self._renew():
+            raise RuntimeError(f"{self.name} - lost the job lock to another runner")
+        self.checkpoint = checkpoint
+        self._store.save_checkpoint(name=self.name, checkpoint=checkpoint)
+
+
+class Job(NamedTuple):
+    name: str
+    run: Callable[[JobContext], Awaitable[Any]]
+    # NOTE seconds between the starts of two runs and seconds a run may hold the lock without saving progress
+    interval: float
+    timeout: float = 3600.0
+
+
+class Scheduler:
+    """
+        **Scheduler**
+            jobs: the jobs to schedule
+            store: job store shared by every scheduler on the host so only one of them runs a job at a time
+            run_context: context manager each job runs in, e.g. a flask request context for the controllers
+    """
+
+    def __init__(self, jobs: list[Job], store: SQLiteJobStore, run_context: Callable | None = None):
+        self.jobs = {job.name: job for job in jobs}
+        self._store = store
+        self._run_context = run_context
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.logger = init_logger(self.__class__.__name__)
+
+    def is_due(self, job: Job, now: float) -> bool:
+        last_started = self._store.last_started(name=job.name)
+        return last_started is None or now - last_started >= job.interval
+
+    def run_pending(self) -> list[str]:
+        """
+            **run_pending**
+        :return: names of the jobs which ran
+        """
+        ran = []
+        for job in self.jobs.values():
+            if self.is_due(job=job, now=time.time()) and self.run_job(job=job) is not None:
+                ran.append(job.name)
+        return ran
+
+    def run_job(self, job: Job) -> str | None:
+        """
+            **run_job**
+        :param job:
+        :return: completed or failed, None if another runner holds the job
+        """
+        if not self._store.acquire(name=job.name, owner=self.owner, ttl=job.timeout):
+            self.logger.info(f"{job.name} is running elsewhere")
+            return None
+
+        self._store.record_start(name=job.name)
+        context = JobContext(name=job.name, store=self._store,
+                             renew=lambda: self._store.acquire(name=job.name, owner=self.owner, ttl=job.timeout))
+        started = time.monotonic()
+        try:
+            if self._run_context is not None:
+                with self._run_context():
+                    result = asyncio.run(job.run(context))
+            else:
+                result = asyncio.run(job.run(context))
+        except Exception as e:
+            duration = time.monotonic() - started
+            self.logger.error(f"{job.name} failed after {duration:.1f}s : {str(e)}")
+            self._store.record_finish(name=job.name, status="failed", duration=duration, error=str(e))
+            return "failed"
+        finally:
+            self._store.release(name=job.name, owner=self.owner)
+
+        duration = time.monotonic() - started
+        self.logger.info(f"{job.name} completed in {duration:.1f}s : {result}")
+        self._store.record_finish(name=job.name, status="completed", duration=duration, result=result)
+        return "completed"
+
+    def run_forever(self, poll_interval: float = 60.0):
+        while True:
+            self.run_pending()
+            time.sleep(poll_interval)
@@ -0,0 +1,126 @@
+"""
+    **store**
+        a SQLite job store local to the scheduler host - when each job last ran, how long it took, where a
+        run that did not finish stopped, and the lock which keeps a job to a single runner at a time
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+
+class SQLiteJobStore:
+    """
+        **SQLiteJobStore**
+            path: SQLite file shared by every scheduler process on the host
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self._busy_timeout = busy_timeout
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                           "name TEXT PRIMARY KEY, "
+                           "last_started REAL, "
+                           "last_finished REAL, "
+                           "last_status TEXT, "
+                           "last_error TEXT, "
+                           "last_result TEXT, "
+                           "last_duration REAL, "
+                           "total_duration REAL NOT NULL DEFAULT 0, "
+                           "runs INTEGER NOT NULL DEFAULT 0, "
+                           "failures INTEGER NOT NULL DEFAULT 0, "
+                           "checkpoint TEXT)")
+        connection.execute("CREATE TABLE IF NOT EXISTS job_locks ("
+                           "name TEXT PRIMARY KEY, "
+                           "owner TEXT NOT NULL, "
+                           "expires_at REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection | None = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """
+            **acquire**
+                takes the lock of the job unless another runner holds it, an expired lock is taken over
+                so a runner which died does not block the job forever
+        :param name:
+        :param owner:
+        :param ttl: seconds the lock is held without being renewed
+        :return: True if owner now holds the lock
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT owner, expires_at FROM job_locks WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute("INSERT OR REPLACE INTO job_locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                               (name, owner, now + ttl))
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+        return True
+
+    def release(self, name: str, owner: str):
+        self._connection().execute("DELETE FROM job_locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def record_start(self, name: str):
+        self._connection().execute("INSERT INTO jobs (name, last_started) VALUES (?, ?) "
+                                   "ON CONFLICT(name) DO UPDATE SET last_started = excluded.last_started",
+                                   (name, time.time()))
+
+    def record_finish(self, name: str, status: str, duration: float, result: Any = None, error: str | None = None):
+        """
+            **record_finish**
+                a completed run clears the checkpoint, a failed run keeps it so the next run resumes
+        :param name:
+        :param status: completed or failed
+        :param duration: seconds
+        :param result: json serializable summary returned by the job
+        :param error:
+        :return:
+        """
+        completed = status == "completed"
+        self._connection().execute(
+            "UPDATE jobs SET last_finished = ?, last_status = ?, last_error = ?, last_result = ?, last_duration = ?, "
+            "total_duration = total_duration + ?, runs = runs + 1, failures = failures + ?, "
+            "checkpoint = CASE WHEN ? THEN NULL ELSE checkpoint END WHERE name = ?",
+            (time.time(), status, error, json.dumps(result, default=str), duration, duration, int(not completed),
+             int(completed), name))
+
+    def load_checkpoint(self, name: str) -> Any:
+        row = self._connection().execute("SELECT checkpoint FROM jobs WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def save_checkpoint(self, name: str, checkpoint: Any):
+        self._connection().execute("UPDATE jobs SET checkpoint = ? WHERE name = ?",
+                                   (json.dumps(checkpoint, default=str), name))
+
+    def last_started(self, name: str) -> float | None:
+        row = self._connection().execute("SELECT last_started FROM jobs WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def status(self) -> list[dict[str, Any]]:
+        cursor = self._connection().execute("SELECT name, last_started, last_finished, last_status, last_error, "
+                                            "last_result, last_duration, total_duration, runs, failures, checkpoint "
+                                            "FROM jobs ORDER BY name")
+        columns = [column[0] for column in cursor.description]
+        jobs = []
+        for row in cursor.fetchall():
+            job = dict(zip(columns, row))
+            job['average_duration'] = round(job['total_duration'] / job['runs'], 3) if job['runs'] else None
+            jobs.append(job)
+        return jobs
@@ -3,6 +3,17 @@
 from pydantic import BaseModel, Field
 
 
+class SessionToken(BaseModel):
+    """
+        **SessionToken**
+            the claims signed into the auth cookie - a token is revoked by bumping the token_version of the user
+    """
+    user_id: str
+    is_system_admin: bool = Field(default=False)
+    token_version: int = Field(default=0)
+    expires_at: int
+
+
 class Auth(BaseModel):
     username: str
     password: str
@@ -30,6 +30,7 @@ class Company(BaseModel):
     country: str | None
     contact_number: str | None
     website: str | None
+    version: int | None = Field(default=None)
 
     class Config:
         from_orm = True
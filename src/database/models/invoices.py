@@ -2,7 +2,7 @@ import uuid
 from datetime import date, datetime
 from enum import Enum
 
-from pydantic import BaseModel, Field, Extra, validator, PositiveInt
+from pydantic import BaseModel, Field, Extra, validator, root_validator, PositiveInt
 
 from src.database.models.payments import Payment
 
@@ -13,6 +13,15 @@ class PaymentStatus(Enum):
     FULLY_PAID = "Fully Paid"
 
 
+def payment_status(amount_paid: int, amount_payable: int) -> PaymentStatus:
+    if amount_paid >= amount_payable:
+        return PaymentStatus.FULLY_PAID
+    elif amount_paid > 0:
+        return PaymentStatus.PARTIALLY_PAID
+    else:
+        return PaymentStatus.UNPAID
+
+
 class Customer(BaseModel):
     """
     The Customer class represents a customer and has the following properties:
@@ -81,6 +90,23 @@ class BillableItem(BaseModel):
     deleted: bool
 
 
+def calculate_invoice_totals(items_total: int, rental_amount: int | None, tax_rate: int,
+                             discount: int) -> dict[str, int]:
+    """
+        **calculate_invoice_totals**
+            the totals of an invoice from the sum of its item sub totals, shared by the invoice model and
+            the totals persisted on the invoices table so both are computed the same way
+    :param items_total:
+    :param rental_amount:
+    :param tax_rate:
+    :param discount:
+    :return: total_amount, total_taxes and amount_payable
+    """
+    total_amount = items_total + rental_amount if isinstance(rental_amount, int) else items_total
+    total_taxes = int(total_amount * (tax_rate / 100))
+    return dict(total_amount=total_amount, total_taxes=total_taxes, amount_payable=total_amount + total_taxes - discount)
+
+
 # noinspection PyMethodParameters
 class Invoice(BaseModel):
     """
@@ -110,6 +136,11 @@ class Invoice(BaseModel):
     invoice_items: list[InvoicedItems]
     invoice_sent: bool
     invoice_printed: bool
+    version: int | None = Field(default=None)
+    # NOTE persisted on the invoices table, computed from the items when an invoice is built without them
+    total_amount: int | None = Field(default=None)
+    total_taxes: int | None = Field(default=None)
+    amount_payable: int | None = Field(default=None)
 
     def __eq__(self, other):
         """
@@ -130,20 +161,26 @@ class Invoice(BaseModel):
             return value.split(",")
         return value
 
-    @property
-    def total_amount(self) -> int:
-        _total_amount = sum(item.sub_total for item in self.invoice_items)
-        if isinstance(self.rental_amount, int):
-            _total_amount += self.rental_amount
-        return _total_amount
-
-    @property
-    def total_taxes(self) -> int:
-        return int(self.total_amount * (self.tax_rate / 100))
+    @root_validator(skip_on_failure=True)
+    def validate_totals(cls, values):
+        if None in (values.get('total_amount'), values.get('total_taxes'), values.get('amount_payable')):
+            values.update(calculate_invoice_totals(
+                items_total=sum(item.sub_total for item in values.get('invoice_items') or []),
+                rental_amount=values.get('rental_amount'), tax_rate=values.get('tax_rate'),
+                discount=values.get('discount')))
+        return values
 
-    @property
-    def amount_payable(self) -> int:
-        return (self.total_amount + self.total_taxes) - self.discount
+    def refresh_totals(self):
+        """
+            **refresh_totals**
+                recomputes the totals after the items, rental amount, tax rate or discount were changed
+        :return:
+        """
+        totals = calculate_invoice_totals(items_total=sum(item.sub_total for item in self.invoice_items),
+                                          rental_amount=self.rental_amount, tax_rate=self.tax_rate,
+                                          discount=self.discount)
+        for name, value in totals.items():
+            setattr(self, name, value)
 
     @property
     def days_remaining(self) -> int:
@@ -163,13 +200,11 @@ class Invoice(BaseModel):
         return sum(payment.amount_paid for payment in payments if payment.invoice_number == self.invoice_number)
 
     def get_payment_status(self, payments: list[Payment]) -> PaymentStatus:
-        total_amount_paid = self.calculate_total_amount_paid(payments)
-        if total_amount_paid >= self.amount_payable:
-            return PaymentStatus.FULLY_PAID
-        elif total_amount_paid > 0:
-            return PaymentStatus.PARTIALLY_PAID
-        else:
-            return PaymentStatus.UNPAID
+        """
+            scans every payment, use business_logic.payments.reconciliation for more than one invoice
+        """
+        return payment_status(amount_paid=self.calculate_total_amount_paid(payments),
+                              amount_payable=self.amount_payable)
 
     def dict(self):
         return {
@@ -29,6 +29,7 @@ class LeaseAgreement(BaseModel):
     deposit_amount: int | None
     is_active: bool
     payment_period: str | None
+    version: int | None = Field(default=None)
 
     @property
     def days_left(self):
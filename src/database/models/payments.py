@@ -24,6 +24,7 @@ class Payment(BaseModel):
     is_successful: bool
     month: PositiveInt
     comments: str
+    version: int | None = Field(default=None)
 
     def __eq__(self, other):
         """
@@ -71,7 +72,7 @@ class UpdatePayment(BaseModel):
     property_id: str
     unit_id: str
     amount_paid: int
-    date_paid: str
+    date_paid: date
     payment_method: str
     is_successful: bool
     comments: str
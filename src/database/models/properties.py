@@ -37,6 +37,7 @@ class Property(BaseModel):
     lease_terms: str  # Monthly, Daily, Hourly
     built_year: PositiveInt
     parking_spots: int
+    version: int | None = Field(default=None)
 
     def __eq__(self, other):
         """
@@ -79,6 +80,7 @@ class Unit(BaseModel):
     lease_end_date: date | None = Field(default=None)
     unit_area: PositiveInt
     has_reception: bool
+    version: int | None = Field(default=None)
 
     def __eq__(self, other):
         """
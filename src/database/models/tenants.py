@@ -27,6 +27,7 @@ class Tenant(BaseModel):
     is_renting: bool
     lease_start_date: date | None
     lease_end_date: date | None
+    version: int | None = Field(default=None)
 
     @classmethod
     @validator("lease_start_date", pre=True)
@@ -38,6 +38,7 @@ class User(BaseModel):
     contact_number: str | None
     account_verified: bool = Field(default=False)
     is_system_admin: bool = Field(default=False)
+    token_version: int = Field(default=0)
 
     class Config:
         orm_mode = True
@@ -0,0 +1,209 @@
+"""
+    **SessionPool**
+        a bounded checkout / checkin pool of SQLAlchemy Sessions shared by the controllers,
+        sessions are returned to the pool when the `with` block exits instead of being discarded
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session as SQLSession
+
+
+class PoolExhaustedError(Exception):
+    def __init__(self, description: str = "Timed out waiting for a database session", code: int = 503):
+        self.description = description
+        self.code = code
+        super().__init__(self.description)
+
+
+class SessionPool:
+    """
+        **SessionPool**
+            size: maximum number of sessions that may be checked out at the same time
+            idle_timeout: seconds a session may sit idle in the pool before it is discarded
+            checkout_timeout: seconds to wait for a free session before raising PoolExhaustedError
+            ping_after: sessions idle for longer than this are health checked on checkout
+    """
+
+    def __init__(self, session_maker: Callable[[], SQLSession], size: int = 20, idle_timeout: int = 300,
+                 checkout_timeout: int = 30, ping_after: int = 30):
+        self._session_maker = session_maker
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._checkout_timeout = checkout_timeout
+        self._ping_after = ping_after
+
+        self._lock = threading.Condition()
+        # idle sessions together with the time they were returned to the pool
+        self._idle: list[tuple[SQLSession, float]] = []
+        self._checked_out: int = 0
+
+        self._checkouts: int = 0
+        self._created: int = 0
+        self._exhausted: int = 0
+        self._timeouts: int = 0
+        self._discarded: int = 0
+        self._failed_health_checks: int = 0
+        self._total_wait_time: float = 0.0
+        self._max_wait_time: float = 0.0
+
+    def configure(self, session_maker: Callable[[], SQLSession] | None = None, size: int | None = None,
+                  idle_timeout: int | None = None, checkout_timeout: int | None = None,
+                  ping_after: int | None = None):
+        """
+            **configure**
+                called from init_app - idle sessions belonging to a previous session_maker are dropped
+        :return:
+        """
+        with self._lock:
+            if session_maker is not None and session_maker is not self._session_maker:
+                self._session_maker = session_maker
+                self._close_idle()
+            if size:
+                self._size = size
+            if idle_timeout is not None:
+                self._idle_timeout = idle_timeout
+            if checkout_timeout is not None:
+                self._checkout_timeout = checkout_timeout
+            if ping_after is not None:
+                self._ping_after = ping_after
+            self._lock.notify_all()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @contextmanager
+    def checkout(self) -> Iterator[SQLSession]:
+        """
+            **checkout**
+                use as `with pool.checkout() as session:` the session is checked back in on exit
+        :return:
+        """
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    def _acquire(self) -> SQLSession:
+        started = time.monotonic()
+        waited = False
+        with self._lock:
+            while self._checked_out >= self._size:
+                if not waited:
+                    self._exhausted += 1
+                    waited = True
+                remaining = self._checkout_timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolExhaustedError()
+                self._lock.wait(timeout=remaining)
+
+            self._checked_out += 1
+            self._checkouts += 1
+            wait_time = time.monotonic() - started
+            self._total_wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            idle_entry = self._idle.pop() if self._idle else None
+
+        try:
+            return self._prepare(idle_entry)
+        except Exception:
+            with self._lock:
+                self._checked_out -= 1
+                self._lock.notify()
+            raise
+
+    def _prepare(self, idle_entry: tuple[SQLSession, float] | None) -> SQLSession:
+        """
+            discards stale sessions and health checks sessions which have been idle for a while
+        """
+        if idle_entry is None:
+            return self._new_session()
+
+        session, returned_at = idle_entry
+        idle_for = time.monotonic() - returned_at
+        if idle_for > self._idle_timeout:
+            self._discard(session)
+            return self._new_session()
+
+        if idle_for > self._ping_after and not self._is_healthy(session):
+            self._discard(session)
+            return self._new_session()
+
+        return session
+
+    def _new_session(self) -> SQLSession:
+        with self._lock:
+            self._created += 1
+        return self._session_maker()
+
+    def _is_healthy(self, session: SQLSession) -> bool:
+        try:
+            session.execute(text("SELECT 1"))
+            session.rollback()
+            return True
+        except SQLAlchemyError:
+            with self._lock:
+                self._failed_health_checks += 1
+            return False
+
+    def _discard(self, session: SQLSession):
+        try:
+            session.close()
+        except SQLAlchemyError:
+            pass
+        with self._lock:
+            self._discarded += 1
+
+    def _release(self, session: SQLSession):
+        try:
+            # NOTE close releases the connection back to the engine and expunges all instances
+            session.close()
+            reusable = True
+        except SQLAlchemyError:
+            reusable = False
+
+        with self._lock:
+            self._checked_out -= 1
+            if reusable and len(self._idle) < self._size:
+                self._idle.append((session, time.monotonic()))
+            else:
+                self._discarded += 1
+            self._lock.notify()
+
+    def _close_idle(self):
+        while self._idle:
+            session, _ = self._idle.pop()
+            try:
+                session.close()
+            except SQLAlchemyError:
+                pass
+            self._discarded += 1
+
+    def stats(self) -> dict[str, int | float]:
+        """
+            **stats**
+                pool metrics - wait times are in seconds
+        :return:
+        """
+        with self._lock:
+            return {
+                'size': self._size,
+                'checked_out': self._checked_out,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'created': self._created,
+                'discarded': self._discarded,
+                'exhausted': self._exhausted,
+                'timeouts': self._timeouts,
+                'failed_health_checks': self._failed_health_checks,
+                'total_wait_time': round(self._total_wait_time, 6),
+                'max_wait_time': round(self._max_wait_time, 6),
+                'average_wait_time': round(self._total_wait_time / self._checkouts, 6) if self._checkouts else 0.0
+            }
@@ -1,14 +1,32 @@
-from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from src.config import config_instance
+from src.database.tools.index_advisor import SlowQueryRecorder
 
 settings = config_instance().MYSQL_SETTINGS
-# Replace 'your_username', 'your_password', 'your_host', and 'your_database' with your MySQL database credentials
-engine = create_engine(settings.DEVELOPMENT_DB)
+# NOTE pool size, overflow, recycling and statement timeouts are configured on MySQLSettings
+engine = settings.create_engine()
+if settings.SLOW_QUERY_MS is not None:
+    SlowQueryRecorder(log_path=settings.SLOW_QUERY_LOG, threshold_ms=settings.SLOW_QUERY_MS).install(engine)
 Session = sessionmaker(bind=engine)
-session = Session()
 
 
 Base = declarative_base()
+
+
+def engine_pool_stats(_engine: Engine = engine) -> dict[str, int | str]:
+    """
+        **engine_pool_stats**
+            connection pool statistics for the engine
+    :param _engine:
+    :return:
+    """
+    pool = _engine.pool
+    stats: dict[str, int | str] = {'pool_class': pool.__class__.__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow())
+    return stats
@@ -18,6 +18,9 @@ class CompanyORM(Base):
     country: str = Column(String(NAME_LEN))
     contact_number: str = Column(String(13))
     website: str = Column(String(255))
+    version: int = Column(Integer, nullable=False, server_default="0")
+
+    __mapper_args__ = {"version_id_col": version}
 
     def to_dict(self):
         """
@@ -35,7 +38,8 @@ class CompanyORM(Base):
             "province": self.province,
             "country": self.country,
             "contact_number": self.contact_number,
-            "website": self.website
+            "website": self.website,
+            "version": self.version
         }
 
     @classmethod
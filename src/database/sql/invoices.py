@@ -1,10 +1,12 @@
 from datetime import date
 
 from pydantic import ValidationError
-from sqlalchemy import Column, Integer, String, Text, Boolean, Date, ForeignKey, inspect
+from sqlalchemy import Column, Integer, String, Text, Boolean, Date, ForeignKey, Index, inspect, insert, select, \
+    update, func, bindparam
+from sqlalchemy.orm import Session as SQLSession
 
 from src.database.constants import ID_LEN, NAME_LEN
-from src.database.models.invoices import InvoicedItems, Customer
+from src.database.models.invoices import InvoicedItems, Customer, calculate_invoice_totals
 from src.database.sql import Base, engine, Session
 from src.database.sql.tenants import TenantORM
 
@@ -16,7 +18,7 @@ class InvoiceORM(Base):
     """
     __tablename__ = 'invoices'
     invoice_number = Column(Integer, primary_key=True, autoincrement=True)
-    tenant_id: str = Column(String(ID_LEN), ForeignKey('tenants.tenant_id'))
+    tenant_id: str = Column(String(ID_LEN), ForeignKey('tenants.tenant_id'), index=True)
     service_name: str = Column(String(NAME_LEN))
     description: str = Column(String(255))
     currency: str = Column(String(12))
@@ -27,10 +29,19 @@ class InvoiceORM(Base):
 
     month: int = Column(Integer)
     rental_amount: int = Column(Integer)
+    # NOTE legacy comma separated charge ids - invoice_charge is the source of truth
     charge_ids: str = Column(Text)
 
     invoice_sent: bool = Column(Boolean, default=False)
     invoice_printed: bool = Column(Boolean, default=False)
+    version: int = Column(Integer, nullable=False, server_default="0")
+
+    # NOTE maintained by refresh_invoice_totals whenever the charges, rental amount, tax rate or discount change
+    total_amount: int = Column(Integer, nullable=True)
+    total_taxes: int = Column(Integer, nullable=True)
+    amount_payable: int = Column(Integer, nullable=True)
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __init__(
             self,
@@ -80,6 +91,15 @@ class InvoiceORM(Base):
 
         :return: A dictionary representation of the object.
         """
+        with Session() as session:
+            return hydrate_invoices(session=session, invoices=[self])[0]
+
+    def columns_dict(self) -> dict[str, str | date | int]:
+        """
+            **columns_dict**
+                the invoice columns without invoiced items and customer
+        :return:
+        """
         return {
             "invoice_number": self.invoice_number,
             "tenant_id": self.tenant_id,
@@ -93,55 +113,26 @@ class InvoiceORM(Base):
             "month": self.month,
             "rental_amount": self.rental_amount,
             "charge_ids": self.charge_ids,
-            "invoice_items": self.invoiced_items,
-            "customer": self.customer,
             "invoice_sent": self.invoice_sent,
-            "invoice_printed": self.invoice_printed
+            "invoice_printed": self.invoice_printed,
+            "version": self.version,
+            "total_amount": self.total_amount,
+            "total_taxes": self.total_taxes,
+            "amount_payable": self.amount_payable
         }
 
     @property
-    def invoiced_items(self) -> list[dict]:
+    def charge_id_list(self) -> list[str]:
         """
-            **invoiced_items**
+            **charge_id_list**
         :return:
         """
-        _invoiced_items = []
         charge_ids = self.charge_ids
         if not charge_ids:
-            return _invoiced_items
-        if isinstance(charge_ids, list):
-            charge_ids = ",".join(charge_ids)
-
-        with Session() as session:
-            for _charge_id in charge_ids.split(","):
-                if _charge_id:
-                    charge_item_orm: UserChargesORM = session.query(UserChargesORM).filter(
-                        UserChargesORM.charge_id == _charge_id).first()
-                    if charge_item_orm:
-                        item_orm: ItemsORM = session.query(ItemsORM).filter(
-                            ItemsORM.item_number == charge_item_orm.item_number).first()
-                        if item_orm:
-                            invoice_item_dict = dict(property_id=charge_item_orm.property_id,
-                                                     item_number=charge_item_orm.item_number,
-                                                     description=item_orm.description,
-                                                     multiplier=item_orm.multiplier,
-                                                     amount=charge_item_orm.amount)
-                            try:
-                                _invoiced_items.append(InvoicedItems(**invoice_item_dict).dict())
-                            except ValidationError as e:
-                                pass
-
-            return _invoiced_items
-
-    @property
-    def customer(self) -> dict:
-        """
-
-        :return:
-        """
-        with Session() as session:
-            _tenant: TenantORM = session.query(TenantORM).filter(TenantORM.tenant_id == self.tenant_id).first()
-            return Customer(**_tenant.to_dict()).dict()
+            return []
+        if isinstance(charge_ids, str):
+            charge_ids = charge_ids.split(",")
+        return [_charge_id for _charge_id in charge_ids if _charge_id]
 
 
 class ItemsORM(Base):
@@ -184,9 +175,9 @@ class UserChargesORM(Base):
     """
     __tablename__ = "user_invoice_charge"
     charge_id: str = Column(String(ID_LEN), primary_key=True)
-    property_id: str = Column(String(ID_LEN))
+    property_id: str = Column(String(ID_LEN), index=True)
     tenant_id: str = Column(String(ID_LEN))
-    unit_id: str = Column(String(ID_LEN))
+    unit_id: str = Column(String(ID_LEN), index=True)
     item_number: str = Column(String(ID_LEN))
     month: int = Column(Integer)
     amount: int = Column(Integer)
@@ -216,3 +207,225 @@ class UserChargesORM(Base):
             "date_of_entry": self.date_of_entry,
             "is_invoiced": self.is_invoiced
         }
+
+
+class InvoiceChargeORM(Base):
+    """
+        **InvoiceChargeORM**
+            links invoices to the user charges they billed
+    """
+    __tablename__ = "invoice_charge"
+    invoice_number: int = Column(Integer, ForeignKey('invoices.invoice_number'), primary_key=True)
+    charge_id: str = Column(String(ID_LEN), primary_key=True)
+
+    # NOTE the primary key covers invoice -> charges and this index covers charge -> invoice lookups
+    __table_args__ = (Index('ix_invoice_charge_charge_id_invoice_number', 'charge_id', 'invoice_number'),)
+
+    @classmethod
+    def create_if_not_table(cls):
+        if not inspect(engine).has_table(cls.__tablename__):
+            Base.metadata.create_all(bind=engine)
+
+    def to_dict(self) -> dict[str, str | int]:
+        return {
+            "invoice_number": self.invoice_number,
+            "charge_id": self.charge_id
+        }
+
+
+class LeaseInvoiceORM(Base):
+    """
+        **LeaseInvoiceORM**
+            the invoice issued to a lease agreement for a billing month, a lease is invoiced once per month
+    """
+    __tablename__ = "lease_invoices"
+    agreement_id: str = Column(String(ID_LEN), primary_key=True)
+    # NOTE first day of the month the invoice falls due in
+    billing_month: date = Column(Date, primary_key=True)
+    invoice_number: int = Column(Integer, ForeignKey('invoices.invoice_number'), index=True)
+
+    @classmethod
+    def create_if_not_table(cls):
+        if not inspect(engine).has_table(cls.__tablename__):
+            Base.metadata.create_all(bind=engine)
+
+    def to_dict(self) -> dict[str, str | date | int]:
+        return {
+            "agreement_id": self.agreement_id,
+            "billing_month": self.billing_month,
+            "invoice_number": self.invoice_number
+        }
+
+
+def link_invoice_charges(session: SQLSession, invoice_number: int, charge_ids: list[str]) -> int:
+    """
+        **link_invoice_charges**
+            records the charges billed on an invoice with a single bulk insert,
+            the caller is responsible for committing
+    :param session:
+    :param invoice_number:
+    :param charge_ids:
+    :return: number of links written
+    """
+    rows = [dict(invoice_number=invoice_number, charge_id=_charge_id) for _charge_id in dict.fromkeys(charge_ids)
+            if _charge_id]
+    if rows:
+        session.execute(insert(InvoiceChargeORM), rows)
+    return len(rows)
+
+
+def backfill_invoice_charges(session: SQLSession) -> int:
+    """
+        **backfill_invoice_charges**
+            migrates the legacy comma separated charge_ids of invoices which have no invoice_charge rows yet
+    :param session:
+    :return: number of links written
+    """
+    unlinked_invoices = session.query(InvoiceORM.invoice_number, InvoiceORM.charge_ids).outerjoin(
+        InvoiceChargeORM, InvoiceChargeORM.invoice_number == InvoiceORM.invoice_number).filter(
+        InvoiceORM.charge_ids.isnot(None), InvoiceChargeORM.invoice_number.is_(None)).all()
+
+    rows = [dict(invoice_number=invoice_number, charge_id=_charge_id)
+            for invoice_number, charge_ids in unlinked_invoices
+            for _charge_id in dict.fromkeys(charge_ids.split(",")) if _charge_id]
+    if rows:
+        session.execute(insert(InvoiceChargeORM), rows)
+        session.commit()
+    return len(rows)
+
+
+# NOTE keeps the IN lists well below the database parameter limits
+IN_CLAUSE_CHUNK_SIZE: int = 500
+
+
+def _chunks(values: list, size: int = IN_CLAUSE_CHUNK_SIZE):
+    for index in range(0, len(values), size):
+        yield values[index:index + size]
+
+
+def load_invoiced_items(session: SQLSession, invoice_numbers: set[int]) -> dict[int, dict[str, dict[str, str | int]]]:
+    """
+        **load_invoiced_items**
+            resolves the invoiced items of a set of invoices with one indexed JOIN per chunk of invoice numbers
+    :param session:
+    :param invoice_numbers:
+    :return: invoice_number -> charge_id -> invoiced item dict
+    """
+    invoiced_items: dict[int, dict[str, dict[str, str | int]]] = {}
+    for chunk in _chunks(sorted(invoice_numbers)):
+        charge_rows = session.query(InvoiceChargeORM.invoice_number, UserChargesORM, ItemsORM).join(
+            UserChargesORM, UserChargesORM.charge_id == InvoiceChargeORM.charge_id).join(
+            ItemsORM, ItemsORM.item_number == UserChargesORM.item_number).filter(
+            InvoiceChargeORM.invoice_number.in_(chunk)).order_by(
+            InvoiceChargeORM.invoice_number, InvoiceChargeORM.charge_id).all()
+
+        for invoice_number, charge_item_orm, item_orm in charge_rows:
+            invoice_item_dict = dict(property_id=charge_item_orm.property_id,
+                                     item_number=charge_item_orm.item_number,
+                                     description=item_orm.description,
+                                     multiplier=item_orm.multiplier,
+                                     amount=charge_item_orm.amount)
+            try:
+                _item = InvoicedItems(**invoice_item_dict).dict()
+            except ValidationError:
+                continue
+            invoiced_items.setdefault(invoice_number, {})[charge_item_orm.charge_id] = _item
+    return invoiced_items
+
+
+def refresh_invoice_totals(session: SQLSession, invoice_numbers: list[int] | set[int]) -> int:
+    """
+        **refresh_invoice_totals**
+            recomputes the persisted totals of the invoices from their charges with one aggregate query and one
+            executemany UPDATE per chunk, the invoice versions are bumped so cached copies are replaced,
+            the caller commits
+    :param session:
+    :param invoice_numbers:
+    :return: number of invoices refreshed
+    """
+    session.flush()
+    table = InvoiceORM.__table__
+    statement = update(table).where(table.c.invoice_number == bindparam('_invoice_number')).values(
+        total_amount=bindparam('_total_amount'), total_taxes=bindparam('_total_taxes'),
+        amount_payable=bindparam('_amount_payable'), version=table.c.version + 1)
+    refreshed = 0
+    for chunk in _chunks(sorted(set(invoice_numbers))):
+        items_totals = dict(session.execute(
+            select(InvoiceChargeORM.invoice_number, func.sum(UserChargesORM.amount * ItemsORM.multiplier)).join(
+                UserChargesORM, UserChargesORM.charge_id == InvoiceChargeORM.charge_id).join(
+                ItemsORM, ItemsORM.item_number == UserChargesORM.item_number).where(
+                InvoiceChargeORM.invoice_number.in_(chunk)).group_by(InvoiceChargeORM.invoice_number)).all())
+        rows = []
+        for invoice_number, rental_amount, tax_rate, discount in session.execute(
+                select(InvoiceORM.invoice_number, InvoiceORM.rental_amount, InvoiceORM.tax_rate,
+                       InvoiceORM.discount).where(InvoiceORM.invoice_number.in_(chunk))):
+            totals = calculate_invoice_totals(items_total=items_totals.get(invoice_number) or 0,
+                                              rental_amount=rental_amount, tax_rate=tax_rate or 0,
+                                              discount=discount or 0)
+            rows.append({'_invoice_number': invoice_number, **{f"_{name}": value for name, value in totals.items()}})
+        if rows:
+            session.execute(statement, rows)
+            refreshed += len(rows)
+
+    # NOTE loaded invoices still hold the old totals and version
+    refreshed_numbers = set(invoice_numbers)
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, InvoiceORM) and instance.invoice_number in refreshed_numbers:
+            session.expire(instance)
+    return refreshed
+
+
+def backfill_invoice_totals(session: SQLSession) -> int:
+    """
+        **backfill_invoice_totals**
+            computes the totals of the invoices written before the totals were persisted
+    :param session:
+    :return: number of invoices backfilled
+    """
+    invoice_numbers = session.scalars(select(InvoiceORM.invoice_number).where(
+        InvoiceORM.total_amount.is_(None))).all()
+    refreshed = refresh_invoice_totals(session=session, invoice_numbers=invoice_numbers) if invoice_numbers else 0
+    session.commit()
+    return refreshed
+
+
+def load_customers(session: SQLSession, tenant_ids: set[str]) -> dict[str, dict[str, str]]:
+    """
+        **load_customers**
+            loads the customers for a set of tenants with one IN query per chunk of tenant ids
+    :param session:
+    :param tenant_ids:
+    :return: tenant_id -> customer dict
+    """
+    customers: dict[str, dict[str, str]] = {}
+    for chunk in _chunks(sorted(tenant_ids)):
+        for tenant_orm in session.query(TenantORM).filter(TenantORM.tenant_id.in_(chunk)).all():
+            customers[tenant_orm.tenant_id] = Customer(**tenant_orm.to_dict()).dict()
+    return customers
+
+
+def hydrate_invoices(session: SQLSession, invoices: list[InvoiceORM]) -> list[dict]:
+    """
+        **hydrate_invoices**
+            converts invoices to dicts, the invoiced items and customers for all the invoices
+            are resolved together instead of running queries per invoice and per charge
+    :param session:
+    :param invoices:
+    :return: one dict per invoice in the same order as invoices
+    """
+    invoices = [invoice for invoice in invoices if isinstance(invoice, InvoiceORM)]
+    invoice_numbers: set[int] = {invoice.invoice_number for invoice in invoices}
+    tenant_ids: set[str] = {invoice.tenant_id for invoice in invoices if invoice.tenant_id}
+
+    invoiced_items = load_invoiced_items(session=session, invoice_numbers=invoice_numbers) if invoice_numbers else {}
+    customers = load_customers(session=session, tenant_ids=tenant_ids) if tenant_ids else {}
+
+    hydrated = []
+    for invoice in invoices:
+        invoice_dict = invoice.columns_dict()
+        _items = invoiced_items.get(invoice.invoice_number, {})
+        invoice_dict.update(charge_ids=list(_items.keys()) or invoice.charge_id_list,
+                            invoice_items=list(_items.values()),
+                            customer=customers.get(invoice.tenant_id))
+        hydrated.append(invoice_dict)
+    return hydrated
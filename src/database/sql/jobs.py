@@ -0,0 +1,39 @@
+from datetime import date, datetime
+
+from sqlalchemy import Column, String, Date, DateTime, select
+from sqlalchemy.orm import Session as SQLSession
+
+from src.database.constants import NAME_LEN
+from src.database.sql import Base
+
+
+class JobWatermarkORM(Base):
+    """
+        **JobWatermarkORM**
+            the date up to which a scheduled job has processed its data, a run only looks at what changed since
+    """
+    __tablename__ = 'job_watermarks'
+    job_name: str = Column(String(NAME_LEN), primary_key=True)
+    watermark: date = Column(Date)
+    time_updated: datetime = Column(DateTime)
+
+
+def read_watermark(session: SQLSession, job_name: str) -> date | None:
+    return session.execute(select(JobWatermarkORM.watermark).where(JobWatermarkORM.job_name == job_name)).scalar()
+
+
+def advance_watermark(session: SQLSession, job_name: str, watermark: date):
+    """
+        **advance_watermark**
+            never moves the watermark backwards, the caller commits
+    :param session:
+    :param job_name:
+    :param watermark:
+    :return:
+    """
+    job_watermark = session.get(JobWatermarkORM, job_name)
+    if job_watermark is None:
+        session.add(JobWatermarkORM(job_name=job_name, watermark=watermark, time_updated=datetime.now()))
+    elif job_watermark.watermark is None or job_watermark.watermark < watermark:
+        job_watermark.watermark = watermark
+        job_watermark.time_updated = datetime.now()
@@ -1,6 +1,6 @@
-from datetime import date
+from datetime import date, datetime
 
-from sqlalchemy import Column, Date, Boolean, String, Integer, Text, inspect
+from sqlalchemy import Column, Date, DateTime, Boolean, String, Integer, Text, inspect
 
 from src.database.constants import ID_LEN, NAME_LEN
 from src.database.sql import Base, engine
@@ -11,13 +11,16 @@ class LeaseAgreementORM(Base):
     agreement_id: str = Column(String(ID_LEN), primary_key=True, unique=True)
     property_id: str = Column(String(ID_LEN))
     unit_id: str = Column(String(ID_LEN))
-    tenant_id: str = Column(String(ID_LEN))
+    tenant_id: str = Column(String(ID_LEN), index=True)
     start_date: date = Column(Date)
-    end_date: date = Column(Date)
+    end_date: date = Column(Date, index=True)
     rent_amount: int = Column(Integer)
     deposit_amount: int = Column(Integer)
-    is_active: bool = Column(Boolean)
+    is_active: bool = Column(Boolean, index=True)
     payment_period: str = Column(String(NAME_LEN))
+    version: int = Column(Integer, nullable=False, server_default="0")
+
+    __mapper_args__ = {"version_id_col": version}
 
     @classmethod
     def create_if_not_table(cls):
@@ -34,7 +37,9 @@ class LeaseAgreementORM(Base):
             'end_date': self.end_date,
             'rent_amount': self.rent_amount,
             'deposit_amount': self.deposit_amount,
-            'is_active': self.is_active
+            'is_active': self.is_active,
+            'payment_period': self.payment_period,
+            'version': self.version
         }
 
 
@@ -59,4 +64,23 @@ class LeaseAgreementTemplate(Base):
             'template_name': self.template_name,
             'template_text': self.template_text,
             'is_default': self.is_default
-        }
\ No newline at end of file
+        }
+
+
+class LeaseNoticeORM(Base):
+    """
+        **LeaseNoticeORM**
+            one row per expiry notice sent for a lease agreement, renewing the agreement moves its
+            end_date so the renewed agreement is notified again when it nears its new end date
+    """
+    __tablename__ = 'lease_notices'
+
+    agreement_id: str = Column(String(ID_LEN), primary_key=True)
+    notice: str = Column(String(NAME_LEN), primary_key=True)
+    end_date: date = Column(Date, primary_key=True)
+    time_sent: datetime = Column(DateTime)
+
+    @classmethod
+    def create_if_not_table(cls):
+        if not inspect(engine).has_table(cls.__tablename__):
+            Base.metadata.create_all(bind=engine)
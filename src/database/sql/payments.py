@@ -1,21 +1,18 @@
 from datetime import date
 
 from sqlalchemy import Column, String, Date, Boolean, Integer, inspect
-from sqlalchemy.ext.declarative import declarative_base
 
 from src.database.constants import ID_LEN
-from src.database.sql import engine
-
-Base = declarative_base()
+from src.database.sql import Base, engine
 
 
 class PaymentORM(Base):
     __tablename__ = 'payments'
 
     transaction_id: str = Column(String(ID_LEN), primary_key=True)
-    invoice_number: int = Column(String(ID_LEN))
-    tenant_id: str = Column(String(ID_LEN))
-    property_id: str = Column(String(ID_LEN))
+    invoice_number: int = Column(String(ID_LEN), index=True)
+    tenant_id: str = Column(String(ID_LEN), index=True)
+    property_id: str = Column(String(ID_LEN), index=True)
     unit_id: str = Column(String(ID_LEN))
     amount_paid: int = Column(Integer)
     date_paid: date = Column(Date)
@@ -23,6 +20,9 @@ class PaymentORM(Base):
     is_successful: bool = Column(Boolean, default=False)
     month: int = Column(Integer)
     comments: str = Column(String(255))
+    version: int = Column(Integer, nullable=False, server_default="0")
+
+    __mapper_args__ = {"version_id_col": version}
 
     @classmethod
     def create_if_not_table(cls):
@@ -41,5 +41,6 @@ class PaymentORM(Base):
             'is_successful': self.is_successful,
             'month': self.month,
             'unit_id': self.unit_id,
-            'comments': self.comments
+            'comments': self.comments,
+            'version': self.version
         }
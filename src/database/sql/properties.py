@@ -23,6 +23,9 @@ class PropertyORM(Base):
     description: str = Column(Text)
     built_year: int = Column(Integer)
     parking_spots: int = Column(Integer)
+    version: int = Column(Integer, nullable=False, server_default="0")
+
+    __mapper_args__ = {"version_id_col": version}
 
     def to_dict(self) -> dict[str, str]:
         return {
@@ -39,7 +42,8 @@ class PropertyORM(Base):
             'lease_terms': self.lease_terms,
             'description': self.description,
             'built_year': self.built_year,
-            'parking_spots': self.parking_spots
+            'parking_spots': self.parking_spots,
+            'version': self.version
         }
 
     @classmethod
@@ -53,8 +57,8 @@ class UnitORM(Base):
 
     unit_id: str = Column(String(ID_LEN), primary_key=True)
     unit_number: str = Column(String(ID_LEN))
-    property_id: str = Column(String(ID_LEN), ForeignKey('properties.property_id'))
-    tenant_id: str = Column(String(ID_LEN), ForeignKey('tenants.tenant_id'))
+    property_id: str = Column(String(ID_LEN), ForeignKey('properties.property_id'), index=True)
+    tenant_id: str = Column(String(ID_LEN), ForeignKey('tenants.tenant_id'), index=True)
     is_occupied: bool = Column(Boolean, default=False)
     is_booked: bool = Column(Boolean, default=False)
     rental_amount: int = Column(Integer)
@@ -62,6 +66,9 @@ class UnitORM(Base):
     lease_end_date: date = Column(Date)
     unit_area: int = Column(Integer)
     has_reception: bool = Column(Boolean)
+    version: int = Column(Integer, nullable=False, server_default="0")
+
+    __mapper_args__ = {"version_id_col": version}
 
     def to_dict(self) -> dict[str, str]:
         """
@@ -73,7 +80,8 @@ class UnitORM(Base):
                 'is_occupied': self.is_occupied, 'is_booked': self.is_booked, 'rental_amount': self.rental_amount,
                 'unit_area': self.unit_area, 'has_reception': self.has_reception,
                 'lease_start_date': self.lease_start_date if self.lease_start_date else None,
-                'lease_end_date': self.lease_end_date if self.lease_end_date else None}
+                'lease_end_date': self.lease_end_date if self.lease_end_date else None,
+                'version': self.version}
 
     @classmethod
     def create_if_not_table(cls):
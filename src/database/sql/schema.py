@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from sqlalchemy import Column, String, DateTime
+
+from src.database.sql import Base
+
+
+class SchemaVersionORM(Base):
+    """
+        **SchemaVersionORM**
+            fingerprints of the schemas which have been bootstrapped on this database
+    """
+    __tablename__ = 'schema_version'
+    version: str = Column(String(64), primary_key=True)
+    applied_at: datetime = Column(DateTime)
+
+
+class SchemaLockORM(Base):
+    """
+        **SchemaLockORM**
+            held by the worker bootstrapping the schema on databases without named locks
+    """
+    __tablename__ = 'schema_lock'
+    name: str = Column(String(64), primary_key=True)
+    locked_at: datetime = Column(DateTime)
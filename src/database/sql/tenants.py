@@ -9,14 +9,18 @@ class TenantORM(Base):
 
     tenant_id: str = Column(String(ID_LEN), primary_key=True)
     address_id: str = Column(String(ID_LEN), nullable=True)
-    company_id: str = Column(String(ID_LEN), nullable=True)
+    company_id: str = Column(String(ID_LEN), nullable=True, index=True)
     name: str = Column(String(NAME_LEN))
     id_number: str = Column(String(13))
     email: str = Column(String(256))
-    cell: str = Column(String(13))
+    cell: str = Column(String(13), index=True)
     is_renting: bool = Column(Boolean, default=False)
     lease_start_date: date = Column(Date, nullable=True)
     lease_end_date: date = Column(Date, nullable=True)
+    # NOTE row version - incremented by SQLAlchemy on every UPDATE, cached copies keep the highest version
+    version: int = Column(Integer, nullable=False, server_default="0")
+
+    __mapper_args__ = {"version_id_col": version}
 
     @classmethod
     def create_if_not_table(cls):
@@ -39,7 +43,8 @@ class TenantORM(Base):
             'cell': self.cell,
             'is_renting': self.is_renting,
             'lease_start_date': self.lease_start_date,
-            'lease_end_date': self.lease_end_date
+            'lease_end_date': self.lease_end_date,
+            'version': self.version
         }
 
 
@@ -21,6 +21,8 @@ class UserORM(Base):
     contact_number: str = Column(String(13))
     account_verified: bool = Column(Boolean, default=False)
     is_system_admin: bool = Column(Boolean, default=False)
+    # NOTE bumped to revoke every session token issued to the user
+    token_version: int = Column(Integer, nullable=False, default=0, server_default="0")
 
     @classmethod
     def create_if_not_table(cls):
@@ -37,7 +39,8 @@ class UserORM(Base):
                  full_name: str,
                  contact_number: str,
                  account_verified: bool = False,
-                 is_system_admin: bool = False
+                 is_system_admin: bool = False,
+                 token_version: int = 0
                  ):
         self.user_id = user_id
         self.tenant_id = tenant_id
@@ -49,6 +52,7 @@ class UserORM(Base):
         self.contact_number = contact_number
         self.account_verified = account_verified
         self.is_system_admin = is_system_admin
+        self.token_version = token_version
 
     def __bool__(self) -> bool:
         return bool(self.user_id) and bool(self.username) and bool(self.email)
@@ -64,7 +68,8 @@ class UserORM(Base):
             'full_name': self.full_name,
             'contact_number': self.contact_number,
             'account_verified': self.account_verified,
-            'is_system_admin': self.is_system_admin
+            'is_system_admin': self.is_system_admin,
+            'token_version': self.token_version
         }
 
 
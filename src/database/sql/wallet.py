@@ -9,7 +9,7 @@ from src.database.sql import engine, Base
 class WalletTransactionORM(Base):
     __tablename__ = 'wallet_transactions'
     transaction_id: str = Column(String(ID_LEN), primary_key=True)
-    user_id: str = Column(String(ID_LEN), nullable=False)
+    user_id: str = Column(String(ID_LEN), nullable=False, index=True)
     date: datetime = Column(DateTime)
     transaction_type: str = Column(String(16), nullable=False)
     pay_to_wallet: str = Column(String(ID_LEN), nullable=False)
@@ -0,0 +1,146 @@
+"""
+    **index_advisor**
+        records slow statements to a json lines log and reports the filter / join columns of those
+        statements which are not covered by the leading column of an index or primary key
+
+        python -m src.database.tools.index_advisor --log slow_queries.jsonl
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, event
+from sqlalchemy.engine import Engine
+
+# NOTE matches qualified predicates as rendered by SQLAlchemy e.g. `payments.tenant_id = ?` or `units.property_id IN (`
+PREDICATE_PATTERN = re.compile(
+    r"(?P<table>\w+)\.(?P<column>\w+)\s*(?:=|!=|<>|<=|>=|<|>|\bIN\b|\bLIKE\b|\bIS\b|\bBETWEEN\b)", re.IGNORECASE)
+PREDICATE_CLAUSE_PATTERN = re.compile(r"\b(?:WHERE|ON)\b(?P<clause>.*?)(?=\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|"
+                                      r"\bJOIN\b|\bWHERE\b|$)", re.IGNORECASE | re.DOTALL)
+
+
+class SlowQueryRecorder:
+    """
+        **SlowQueryRecorder**
+            threshold_ms: statements taking at least this long are appended to log_path
+    """
+
+    def __init__(self, log_path: str, threshold_ms: int = 200):
+        self._log_path = log_path
+        self._threshold_ms = threshold_ms
+        self._lock = threading.Lock()
+
+    def install(self, engine: Engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # NOTE kept on the execution context, which is discarded with the statement when it fails
+        context._query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_start', None)
+        if started is None:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self._threshold_ms:
+            return
+        record = dict(statement=statement, duration_ms=round(duration_ms, 3),
+                      recorded_at=datetime.now().isoformat(timespec='seconds'))
+        with self._lock:
+            with open(self._log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps(record) + "\n")
+
+
+def predicate_columns(statement: str) -> set[tuple[str, str]]:
+    """
+        **predicate_columns**
+            the (table, column) pairs used in the WHERE and JOIN ON clauses of a statement
+    :param statement:
+    :return:
+    """
+    columns: set[tuple[str, str]] = set()
+    for clause in PREDICATE_CLAUSE_PATTERN.finditer(statement):
+        for match in PREDICATE_PATTERN.finditer(clause.group('clause')):
+            columns.add((match.group('table').lower(), match.group('column').lower()))
+    return columns
+
+
+def _tables(metadata: list[MetaData]) -> dict[str, Table]:
+    return {table.name.lower(): table for _metadata in metadata for table in _metadata.tables.values()}
+
+
+def indexed_columns(metadata: list[MetaData]) -> set[tuple[str, str]]:
+    """
+        **indexed_columns**
+            the leading columns of every index and primary key declared on the metadata
+    :param metadata:
+    :return:
+    """
+    covered: set[tuple[str, str]] = set()
+    for table in _tables(metadata=metadata).values():
+        primary_key = list(table.primary_key.columns)
+        if primary_key:
+            covered.add((table.name.lower(), primary_key[0].name.lower()))
+        for index in table.indexes:
+            leading_column = next(iter(index.columns), None)
+            if leading_column is not None:
+                covered.add((table.name.lower(), leading_column.name.lower()))
+    return covered
+
+
+def advise(log_path: str, metadata: list[MetaData]) -> list[dict[str, str | int | float]]:
+    """
+        **advise**
+            aggregates the slow query log by uncovered predicate column, worst total time first
+    :param log_path:
+    :param metadata:
+    :return:
+    """
+    tables = _tables(metadata=metadata)
+    covered = indexed_columns(metadata=metadata)
+    report: dict[tuple[str, str], dict[str, str | int | float]] = {}
+    with open(log_path, encoding="utf-8") as log_file:
+        for line in log_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for table, column in predicate_columns(record['statement']) - covered:
+                if table not in tables:
+                    continue
+                entry = report.setdefault((table, column), dict(table=table, column=column, count=0,
+                                                                total_ms=0.0, max_ms=0.0,
+                                                                example=record['statement']))
+                entry['count'] += 1
+                entry['total_ms'] = round(entry['total_ms'] + record['duration_ms'], 3)
+                entry['max_ms'] = max(entry['max_ms'], record['duration_ms'])
+    return sorted(report.values(), key=lambda entry: entry['total_ms'], reverse=True)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="report slow queries lacking index coverage")
+    parser.add_argument("--log", default=None, help="slow query log - defaults to SLOW_QUERY_LOG")
+    args = parser.parse_args(argv)
+
+    from src.database.sql import Base, settings
+    from src.main.bootstrapping import load_models
+    load_models()
+
+    suggestions = advise(log_path=args.log or settings.SLOW_QUERY_LOG, metadata=[Base.metadata])
+    if not suggestions:
+        print("every slow query predicate is covered by an index")
+        return 0
+
+    for entry in suggestions:
+        print(f"{entry['table']}.{entry['column']}: {entry['count']} slow queries, "
+              f"total {entry['total_ms']}ms, max {entry['max_ms']}ms")
+        print(f"    e.g. {' '.join(entry['example'].split())[:200]}")
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,8 +1,13 @@
+import atexit
+import os
+from typing import Callable
+
 from flask import Flask
 
 from pydantic import BaseModel
 import resend
 from src.config import config_instance
+from src.emailer.dispatcher import MailDispatcher, ResendSink, FileSink
 
 settings = config_instance().EMAIL_SETTINGS
 
@@ -16,17 +21,54 @@ class EmailModel(BaseModel):
 
 class SendMail:
     """
-        Make this more formal
+        **SendMail**
+            emails are queued and sent by the dispatcher workers, sending never blocks a request
     """
 
     def __init__(self):
         self._resend = resend
         self._resend.api_key = settings.RESEND.API_KEY
         self.from_: str | None = settings.RESEND.from_
+        self.dispatcher = MailDispatcher(sink=ResendSink(client=self._resend))
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda: self.dispatcher.reset_after_fork())
+        # NOTE emails still queued at shutdown are sent before the process exits
+        atexit.register(lambda: self.dispatcher.stop())
 
     def init_app(self, app: Flask):
-        pass
+        """
+            **init_app**
+                app.config['mail_sink'] path of a file every email is written to instead of sending it through resend
+                app.config['mail_workers'] threads sending emails
+                app.config['mail_rate'] resend requests per second across the workers
+        :param app:
+        :return:
+        """
+        self.dispatcher.stop()
+        path = app.config.get('mail_sink')
+        sink = FileSink(path=path) if path else ResendSink(client=self._resend, rate=app.config.get('mail_rate') or 2.0)
+        self.dispatcher = MailDispatcher(sink=sink, workers=app.config.get('mail_workers') or 2)
 
-    async def send_mail_resend(self, email: EmailModel):
+    def enqueue(self, email: EmailModel, on_sent: Callable[[], None] | None = None) -> bool:
+        """
+            **enqueue**
+        :param email:
+        :param on_sent: called once the provider accepted the email
+        :return: False if the mail queue is full and the email was not queued
+        """
         params = {'from': self.from_ or email.from_, 'to': email.to_, 'subject': email.subject_, 'html': email.html_}
-        self._resend.Emails.send(params=params)
+        return self.dispatcher.enqueue(params=params, on_sent=on_sent)
+
+    def flush(self, count: int, timeout: float = 60.0) -> bool:
+        """
+            **flush**
+                waits for the queued emails to be sent or given up on, for processes which exit once their
+                emails are queued - the wait grows with the time the rate limit needs for count emails
+        :param count: emails queued by the caller
+        :param timeout: seconds allowed on top of the rate limited send time
+        :return: True if the queue drained in time
+        """
+        return self.dispatcher.flush(timeout=self.dispatcher.drain_time(count=count) + timeout)
+
+    async def send_mail_resend(self, email: EmailModel) -> bool:
+        return self.enqueue(email=email)
@@ -0,0 +1,269 @@
+"""
+    **dispatcher**
+        emails are put on a bounded queue and sent by a small pool of worker threads, so a request handler
+        never waits on the mail provider, the provider is a pluggable sink:
+
+            ResendSink - sends through the resend api, one request per email
+            FileSink - appends every email as a json line to a file, stands in for resend in tests and development
+"""
+import heapq
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, NamedTuple, Protocol
+
+from src.logger import init_logger
+
+
+class MailSink(Protocol):
+    name: str
+    # NOTE emails per provider request and provider requests per second
+    batch_size: int
+    rate: float
+
+    def send_batch(self, messages: list[dict[str, str]]): ...
+
+
+class ResendSink:
+    """
+        **ResendSink**
+            the pinned resend client has no batch endpoint, a batch is sent one email at a time
+    """
+    name = "resend"
+    batch_size = 1
+
+    def __init__(self, client, rate: float = 2.0):
+        self._client = client
+        self.rate = rate
+
+    def send_batch(self, messages: list[dict[str, str]]):
+        for params in messages:
+            self._client.Emails.send(params=params)
+
+
+class FileSink:
+    name = "file"
+    batch_size = 50
+    rate = 0.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages: list[dict[str, str]]):
+        lines = "".join(json.dumps(dict(params, sent_at=time.time())) + "\n" for params in messages)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as mail_file:
+            mail_file.write(lines)
+
+    def read(self) -> list[dict[str, str]]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as mail_file:
+            return [json.loads(line) for line in mail_file if line.strip()]
+
+
+class Envelope(NamedTuple):
+    params: dict[str, str]
+    attempt: int = 0
+    # NOTE called by the worker once the sink has accepted the email
+    on_sent: Callable[[], None] | None = None
+
+
+class MailDispatcher:
+    """
+        **MailDispatcher**
+            workers take up to sink.batch_size emails from the queue per provider request, a failed batch is
+            retried with exponential backoff and jitter up to max_attempts before its emails are dropped
+
+            max_queue: emails waiting to be sent, enqueue refuses emails beyond this
+            workers: threads sending concurrently, provider requests are spaced out to sink.rate across all of them
+    """
+
+    def __init__(self, sink: MailSink, max_queue: int = 1000, workers: int = 2, max_attempts: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 300.0, sleep: Callable[[float], None] = time.sleep):
+        self.sink = sink
+        self._queue: queue.Queue[Envelope | None] = queue.Queue(maxsize=max_queue)
+        self._workers = workers
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._sleep = sleep
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        # NOTE failed emails wait here until their backoff has passed, (send at, sequence, envelope)
+        self._retries: list[tuple[float, int, Envelope]] = []
+        self._sequence = itertools.count()
+        self._next_send: float = 0.0
+        self._queued: int = 0
+        self._sent: int = 0
+        self._retried: int = 0
+        self._failed: int = 0
+        self._rejected: int = 0
+        self.logger = init_logger(self.__class__.__name__)
+
+    def enqueue(self, params: dict[str, str], on_sent: Callable[[], None] | None = None) -> bool:
+        """
+            **enqueue**
+                returns at once, the email is sent by a worker
+        :param params: resend style email parameters - from, to, subject and html
+        :param on_sent: called from the worker thread once the sink accepted the email, never if it is given up on
+        :return: False if the queue is full
+        """
+        self.start()
+        try:
+            self._queue.put_nowait(Envelope(params=params, on_sent=on_sent))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            self.logger.error(f"Mail queue full - dropping email to {params.get('to')}")
+            return False
+        with self._lock:
+            self._queued += 1
+        return True
+
+    def start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for index in range(len(self._threads), self._workers):
+                thread = threading.Thread(target=self._work, name=f"mail-dispatcher-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0):
+        """
+            **stop**
+                sends what is already queued, then stops the workers
+        :param timeout: seconds to wait for each worker
+        :return:
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+    def reset_after_fork(self):
+        # NOTE a forked worker inherits neither the threads nor the emails queued by its parent
+        self._lock = threading.Lock()
+        self._threads = []
+        self._retries = []
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+
+    def _due_retries(self) -> tuple[list[Envelope], float | None]:
+        with self._lock:
+            now = time.monotonic()
+            due = []
+            while self._retries and self._retries[0][0] <= now and len(due) < self.sink.batch_size:
+                due.append(heapq.heappop(self._retries)[2])
+            return due, (self._retries[0][0] - now if self._retries else None)
+
+    def _next_batch(self) -> list[Envelope] | None:
+        while True:
+            batch, wait = self._due_retries()
+            if batch:
+                break
+            try:
+                envelope = self._queue.get(timeout=wait)
+            except queue.Empty:
+                continue
+            if envelope is None:
+                return None
+            batch = [envelope]
+            break
+
+        while len(batch) < self.sink.batch_size:
+            try:
+                envelope = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if envelope is None:
+                # NOTE put the stop marker back for this worker's next loop
+                self._queue.put(None)
+                break
+            batch.append(envelope)
+        return batch
+
+    def _wait_for_slot(self):
+        if not self.sink.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            send_at = max(now, self._next_send)
+            self._next_send = send_at + 1 / self.sink.rate
+        if send_at > now:
+            self._sleep(send_at - now)
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._wait_for_slot()
+            try:
+                self.sink.send_batch([envelope.params for envelope in batch])
+            except Exception as e:
+                self._retry(batch=batch, error=e)
+                continue
+            for envelope in batch:
+                if envelope.on_sent is None:
+                    continue
+                try:
+                    envelope.on_sent()
+                except Exception as e:
+                    self.logger.error(f"on_sent callback for email to {envelope.params.get('to')} failed : {str(e)}")
+            with self._lock:
+                self._sent += len(batch)
+
+    def _retry(self, batch: list[Envelope], error: Exception):
+        for envelope in batch:
+            attempt = envelope.attempt + 1
+            if attempt >= self._max_attempts:
+                with self._lock:
+                    self._failed += 1
+                self.logger.error(f"Giving up on email to {envelope.params.get('to')} : {str(error)}")
+                continue
+            backoff = min(self._max_backoff, self._backoff * 2 ** envelope.attempt) * random.uniform(0.5, 1.0)
+            with self._lock:
+                heapq.heappush(self._retries, (time.monotonic() + backoff, next(self._sequence),
+                                               envelope._replace(attempt=attempt)))
+                self._retried += 1
+
+    def drain_time(self, count: int) -> float:
+        """
+            **drain_time**
+                seconds the rate limit of the sink needs to send count emails
+        :param count:
+        :return:
+        """
+        return count / self.sink.batch_size / self.sink.rate if self.sink.rate else 0.0
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+            **flush**
+                waits until the queue is empty, used by the cron jobs and the tests
+        :param timeout:
+        :return: True if every queued email was handed to the sink or given up on
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._sent + self._failed >= self._queued:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self) -> dict[str, int | str]:
+        return {
+            'sink': self.sink.name,
+            'queued': self._queued,
+            'waiting': self._queue.qsize(),
+            'retrying': len(self._retries),
+            'sent': self._sent,
+            'retried': self._retried,
+            'failed': self._failed,
+            'rejected': self._rejected
+        }
@@ -1,22 +1,30 @@
 import hmac
-import ipaddress
+import json
+import os
 import re
+import tempfile
+import threading
+import time
 
 import requests
 from CloudFlare import CloudFlare
 from CloudFlare.exceptions import CloudFlareAPIError
 from flask import Flask, request, abort, Response
-from requests import ReadTimeout
-from requests.exceptions import ConnectionError
+from requests.exceptions import RequestException
 
 from src.config import config_instance
 from src.config import is_development
+from src.firewall.cidr import CIDRMatcher
+from src.firewall.rate_limit import RateLimiter, LocalBucketStore, SQLiteBucketStore
+from src.firewall.scanner import PatternScanner, iter_chunks
 from src.logger import init_logger
 
 DEFAULT_IPV4 = ['173.245.48.0/20', '103.21.244.0/22', '103.22.200.0/22', '103.31.4.0/22',
                 '141.101.64.0/18', '108.162.192.0/18', '190.93.240.0/20', '188.114.96.0/20',
                 '197.234.240.0/22', '198.41.128.0/17', '162.158.0.0/15', '104.16.0.0/13',
                 '104.24.0.0/14', '172.64.0.0/13', '131.0.72.0/22']
+DEFAULT_IPV6 = ['2400:cb00::/32', '2606:4700::/32', '2803:f800::/32', '2405:b500::/32', '2405:8100::/32',
+                '2a06:98c0::/29', '2c0f:f248::/32']
 
 # Define dictionary of malicious patterns
 malicious_patterns = {
@@ -55,6 +63,13 @@ malicious_patterns = {
 }
 
 
+attack_keywords = {
+    "attack_keywords": r"\b(select|update|delete|drop|create|alter|insert|into|from|where|union|having|or|and|exec|script|javascript|xss|sql|cmd|buffer|format|include|shell|rfi|lfi|phish)\b"
+}
+body_scanner = PatternScanner(patterns=attack_keywords, flags=re.IGNORECASE)
+path_scanner = PatternScanner(patterns=malicious_patterns)
+
+
 def contains_malicious_patterns(_input: str) -> bool:
     """
     **contains_malicious_patterns**
@@ -62,8 +77,7 @@ def contains_malicious_patterns(_input: str) -> bool:
     :param _input:
     :return:
     """
-    attack_pattern = r"\b(select|update|delete|drop|create|alter|insert|into|from|where|union|having|or|and|exec|script|javascript|xss|sql|cmd|buffer|format|include|shell|rfi|lfi|phish)\b"
-    return re.search(attack_pattern, _input, re.IGNORECASE) is not None
+    return body_scanner.search(_input) is not None
 
 
 EMAIL: str = config_instance().CLOUDFLARE_SETTINGS.EMAIL
@@ -85,9 +99,18 @@ class Firewall:
         except CloudFlareAPIError:
             pass
         self.ip_ranges = []
+        # NOTE replaced as a whole on refresh so a request always sees one complete table
+        self.edge_ranges = CIDRMatcher()
+        self._refresh_interval: float = 6 * 60 * 60
+        self._fetch_timeout: float = 5.0
+        self._snapshot_path: str = os.path.join(tempfile.gettempdir(), 'cloudflare_ip_ranges.json')
+        self._refresher: threading.Thread | None = None
+        self._stopped = threading.Event()
         self.bad_addresses = set()
-        self.compiled_bad_patterns = [re.compile(pattern) for pattern in malicious_patterns.values()]
+        self.rate_limiter = RateLimiter()
         self._logger = init_logger(self.__class__.__name__)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
 
     def init_app(self, app: Flask):
         # Setting Up Incoming Request Security Checks
@@ -95,17 +118,91 @@ class Firewall:
             # if this is not a development server secure the server with our firewall
             app.before_request(self.is_host_valid)
             app.before_request(self.is_edge_ip_allowed)
+            app.before_request(self.limit_request_rate)
             app.before_request(self.check_if_request_malicious)
             app.before_request(self.verify_client_secret_token)
 
             # Setting up Security headers for outgoing requests
             app.after_request(self.add_security_headers)
             #
-        # obtain the latest cloudflare edge servers
+        path = app.config.get('rate_limit_store')
+        self.rate_limiter.configure(store=SQLiteBucketStore(path=path) if path else LocalBucketStore())
+        self._refresh_interval = app.config.get('firewall_refresh_interval') or self._refresh_interval
+        self._fetch_timeout = app.config.get('firewall_fetch_timeout') or self._fetch_timeout
+        self._snapshot_path = app.config.get('firewall_snapshot') or self._snapshot_path
+        # NOTE the last known edge ranges are used until the refresher has fetched the latest from cloudflare
+        if not self.load_snapshot():
+            self.set_ip_ranges(ip_ranges=DEFAULT_IPV4 + DEFAULT_IPV6)
+        self.start_refresher()
+
+    def set_ip_ranges(self, ip_ranges: list[str]) -> bool:
+        try:
+            edge_ranges = CIDRMatcher(cidrs=ip_ranges)
+        except ValueError as e:
+            self._logger.error(f"Firewall received invalid CIDRS : {str(e)}")
+            return False
+        self.ip_ranges, self.edge_ranges = ip_ranges, edge_ranges
+        return True
+
+    def load_snapshot(self) -> bool:
+        """
+        **load_snapshot**
+            loads the edge ranges last fetched from cloudflare
+        :return: True if a usable snapshot was found
+        """
+        try:
+            with open(self._snapshot_path, encoding='utf-8') as snapshot:
+                ip_ranges = json.load(snapshot).get('ip_ranges', [])
+        except (OSError, ValueError, AttributeError):
+            return False
+        return bool(ip_ranges) and self.set_ip_ranges(ip_ranges=ip_ranges)
+
+    def save_snapshot(self):
+        directory = os.path.dirname(os.path.abspath(self._snapshot_path))
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False,
+                                             encoding='utf-8') as snapshot:
+                json.dump(dict(fetched_at=time.time(), ip_ranges=self.ip_ranges), snapshot)
+            # NOTE renamed into place so other workers never read a partly written snapshot
+            os.replace(snapshot.name, self._snapshot_path)
+        except OSError as e:
+            self._logger.error(f"Firewall unable to save CIDRS snapshot : {str(e)}")
+
+    def refresh_ip_ranges(self) -> bool:
+        """
+        **refresh_ip_ranges**
+            fetches the cloudflare edge ranges and swaps in a newly compiled matcher,
+            the ranges in use are kept when cloudflare cannot be reached
+        :return: True if the ranges were replaced
+        """
         ipv4, ipv6 = self.get_ip_ranges()
-        # updating the ip ranges
-        self.ip_ranges.extend(ipv4)
-        self.ip_ranges.extend(ipv6)
+        ip_ranges = ipv4 + ipv6
+        if not ip_ranges or not self.set_ip_ranges(ip_ranges=ip_ranges):
+            return False
+        self.save_snapshot()
+        return True
+
+    def start_refresher(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._stopped.clear()
+        self._refresher = threading.Thread(target=self._refresh_forever, name="firewall-ip-ranges", daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self):
+        self._stopped.set()
+        self._refresher = None
+
+    def _after_fork(self):
+        if self._refresher is not None:
+            self._refresher = None
+            self._stopped = threading.Event()
+            self.start_refresher()
+
+    def _refresh_forever(self):
+        self.refresh_ip_ranges()
+        while not self._stopped.wait(timeout=self._refresh_interval):
+            self.refresh_ip_ranges()
 
     def is_host_valid(self):
         """
@@ -128,9 +225,20 @@ class Firewall:
             checks if edge ip falls within known cloudflare ip ranges
         """
         edge_ip = self.get_edge_server_ip(headers=request.headers)
-        if not any(ipaddress.ip_address(edge_ip) in ipaddress.ip_network(ip_range) for ip_range in self.ip_ranges):
+        if edge_ip not in self.edge_ranges:
             abort(401, 'IP Address not allowed')
 
+    def limit_request_rate(self):
+        """
+        **limit_request_rate**
+            rejects clients which exhausted the request budget of the route they are calling
+        """
+        client_ip = self.get_client_ip()
+        if client_ip in self.bad_addresses:
+            abort(403, 'IP Address blocked')
+        if not self.rate_limiter.allow(client_ip=client_ip, path=request.path):
+            abort(429, 'Too many requests - please slow down')
+
     def check_if_request_malicious(self):
         """
         **check_if_request_malicious**
@@ -147,16 +255,25 @@ class Firewall:
             abort(401, 'Payload is suspicious -- Content-Length')
 
         if body:
-            _body = body.decode('utf-8')
-            if contains_malicious_patterns(_input=_body):
-                self._logger.info("Payload regex failure")
+            pattern = body_scanner.search_chunks(iter_chunks(body))
+            if pattern is not None:
+                self._logger.info(f"Payload regex failure : {pattern}")
                 abort(401, 'Payload is suspicious -- Body Content Bad')
 
-        path = str(request.path)
-        if any((pattern.match(path) for pattern in self.compiled_bad_patterns)):
-            self._logger.info("Attack patterns regex failure on path")
+        # NOTE path and query string are matched together in one pass
+        query = request.query_string.decode('utf-8', errors='replace')
+        pattern = path_scanner.match(f"{request.path}?{query}" if query else str(request.path))
+        if pattern is not None:
+            self._logger.info(f"Attack patterns regex failure on path : {pattern}")
             abort(401, 'Request path is malformed - Path Parameter is Malicious')
 
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        **stats**
+            number of requests rejected by each attack pattern and by the rate limiter
+        """
+        return dict(body=body_scanner.stats(), path=path_scanner.stats(), rate_limit=self.rate_limiter.stats())
+
     @staticmethod
     def verify_client_secret_token():
         """
@@ -182,7 +299,7 @@ class Firewall:
             will return the actual client ip address of the client making the request
         """
         ip = request.headers.get('cf-connecting-ip')
-        return ip.split(',')[0]
+        return ip.split(',')[0].strip() if ip else request.remote_addr
 
     @staticmethod
     def get_edge_server_ip(headers) -> str:
@@ -203,12 +320,16 @@ class Firewall:
         try:
             with requests.Session() as send_request:
                 try:
-                    response = send_request.get(url=_uri, headers=_headers)
+                    response = send_request.get(url=_uri, headers=_headers, timeout=self._fetch_timeout)
                     response_data: dict[str, dict[str, str] | list[str]] = response.json()
-                    ipv4_cidr = response_data.get('result', {}).get('ipv4_cidrs', DEFAULT_IPV4)
-                    ipv6_cidr = response_data.get('result', {}).get('ipv6_cidrs', [])
+                    result = response_data.get('result') or {}
+                    ipv4_cidr, ipv6_cidr = result.get('ipv4_cidrs') or [], result.get('ipv6_cidrs') or []
+                    if not ipv4_cidr and not ipv6_cidr:
+                        # NOTE the ranges in use and their snapshot are kept rather than replaced by the defaults
+                        self._logger.error("Firewall received no CIDRS from Cloudflare - keeping the current CIDRS")
+                        return [], []
                     return ipv4_cidr, ipv6_cidr
-                except (ConnectionError, ReadTimeout):
+                except (RequestException, ValueError):
                     self._logger.error("Firewall failed to connect to Cloudflare - unable to verify CIDRS")
                     return [], []
 
@@ -0,0 +1,61 @@
+"""
+    **cidr**
+        CIDR ranges compiled into sorted, merged integer intervals per IP version so membership
+        is a binary search instead of parsing and testing every range on every request
+"""
+import ipaddress
+from bisect import bisect_right
+from typing import Iterable
+
+
+class CIDRMatcher:
+    """
+        **CIDRMatcher**
+            immutable once built - build a new matcher and swap the reference to update the ranges
+    """
+
+    def __init__(self, cidrs: Iterable[str] = ()):
+        self.cidrs: tuple[str, ...] = tuple(cidrs)
+        intervals: dict[int, list[tuple[int, int]]] = {4: [], 6: []}
+        for cidr in self.cidrs:
+            network = ipaddress.ip_network(cidr.strip(), strict=False)
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+        # NOTE version -> (interval starts, interval ends) of the merged intervals
+        self._tables: dict[int, tuple[list[int], list[int]]] = {
+            version: self._merge(_intervals) for version, _intervals in intervals.items()}
+
+    @staticmethod
+    def _merge(intervals: list[tuple[int, int]]) -> tuple[list[int], list[int]]:
+        starts: list[int] = []
+        ends: list[int] = []
+        for start, end in sorted(intervals):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+
+    def __contains__(self, ip: str | None) -> bool:
+        """
+            O(log n) membership - addresses which cannot be parsed are never contained
+        """
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+
+        starts, ends = self._tables[address.version]
+        value = int(address)
+        position = bisect_right(starts, value) - 1
+        return position >= 0 and value <= ends[position]
+
+    def __len__(self) -> int:
+        return len(self.cidrs)
+
+    def __bool__(self) -> bool:
+        return bool(self.cidrs)
+
@@ -0,0 +1,210 @@
+"""
+    **rate_limit**
+        token bucket rate limiting per client ip, each route group has its own budget and its own bucket
+        so a client exhausting the report budget can still browse the rest of the dashboard, the buckets
+        are held in a pluggable store:
+
+            LocalBucketStore - buckets held in process, every worker enforces the budget on its own
+            SQLiteBucketStore - workers on one host share their buckets through a SQLite file
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from src.logger import init_logger
+
+
+class RateLimit(NamedTuple):
+    """
+        rate: tokens added per second
+        burst: size of the bucket, the number of requests allowed at once
+    """
+    rate: float
+    burst: int
+
+    @property
+    def expires_after(self) -> float:
+        # NOTE a bucket idle for this long has refilled completely and is equivalent to a missing bucket
+        return self.burst / self.rate
+
+
+DEFAULT_LIMIT = RateLimit(rate=10.0, burst=60)
+# NOTE longest matching prefix wins, prefixes match whole path segments - these routes render reports and
+# invoices from the database
+ROUTE_LIMITS: dict[str, RateLimit] = {
+    '/dashboard/report': RateLimit(rate=0.5, burst=10),
+    '/reports/invoice': RateLimit(rate=0.5, burst=10),
+    '/dashboard/invoice': RateLimit(rate=1.0, burst=20),
+    '/dashboard/statement': RateLimit(rate=0.5, burst=10),
+    '/dashboard/login': RateLimit(rate=0.2, burst=10),
+    '/dashboard/register': RateLimit(rate=0.1, burst=5),
+    '/dashboard/password-reset': RateLimit(rate=0.1, burst=5),
+}
+
+
+def _refill(tokens: float, updated_at: float, now: float, limit: RateLimit) -> float:
+    return min(float(limit.burst), tokens + (now - updated_at) * limit.rate)
+
+
+class LocalBucketStore:
+    """
+        **LocalBucketStore**
+            buckets ordered by last use, so expired buckets are dropped from the front in O(1) per bucket
+
+            max_buckets: upper bound on memory, the least recently used bucket goes first
+    """
+
+    def __init__(self, max_buckets: int = 100_000):
+        # NOTE key -> (tokens, updated_at, expires_at)
+        self._buckets: OrderedDict[str, tuple[float, float, float]] = OrderedDict()
+        self._max_buckets = max_buckets
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: RateLimit, now: float) -> bool:
+        with self._lock:
+            tokens, updated_at, _ = self._buckets.pop(key, (float(limit.burst), now, now))
+            tokens = _refill(tokens=tokens, updated_at=updated_at, now=now, limit=limit)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now, now + limit.expires_after)
+            self._expire(now=now)
+            return allowed
+
+    def _expire(self, now: float):
+        # NOTE only the least recently used buckets are looked at, a bucket is never dropped before it has refilled
+        while self._buckets:
+            _, (_, _, expires_at) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self._max_buckets and expires_at > now:
+                break
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteBucketStore:
+    """
+        **SQLiteBucketStore**
+            one row per bucket in a SQLite file shared by the workers of one host,
+            a bucket is read and written inside a single write transaction
+
+            path: SQLite file - must be on a local filesystem shared by all workers
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 1.0, prune_interval: float = 60.0):
+        self.path = path
+        self._busy_timeout = busy_timeout
+        self._prune_interval = prune_interval
+        self._last_pruned = time.monotonic()
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                               "key TEXT PRIMARY KEY, "
+                               "tokens REAL NOT NULL, "
+                               "updated_at REAL NOT NULL, "
+                               "expires_at REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection | None = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key: str, limit: RateLimit, now: float) -> bool:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?",
+                                     (key,)).fetchone()
+            tokens, updated_at = row if row else (float(limit.burst), now)
+            tokens = _refill(tokens=tokens, updated_at=updated_at, now=now, limit=limit)
+            allowed = tokens >= 1
+            connection.execute("INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at, expires_at) "
+                               "VALUES (?, ?, ?, ?)",
+                               (key, tokens - 1 if allowed else tokens, now, now + limit.expires_after))
+            if time.monotonic() - self._last_pruned > self._prune_interval:
+                connection.execute("DELETE FROM rate_limit_buckets WHERE expires_at < ?", (now,))
+                self._last_pruned = time.monotonic()
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """
+        **RateLimiter**
+            default: budget of paths which match none of the route prefixes
+            routes: path prefix -> budget
+    """
+
+    def __init__(self, default: RateLimit = DEFAULT_LIMIT, routes: dict[str, RateLimit] | None = None,
+                 store: LocalBucketStore | SQLiteBucketStore | None = None):
+        self._default = default
+        self._routes: list[tuple[str, RateLimit]] = []
+        self._store = store or LocalBucketStore()
+        # NOTE requests are checked concurrently by the threads of a worker
+        self._lock = threading.Lock()
+        self._allowed: int = 0
+        self._limited: dict[str, int] = {}
+        self._errors: int = 0
+        self.logger = init_logger(self.__class__.__name__)
+        self.set_routes(routes=ROUTE_LIMITS if routes is None else routes)
+
+    def set_routes(self, routes: dict[str, RateLimit]):
+        self._routes = sorted(routes.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def configure(self, store: LocalBucketStore | SQLiteBucketStore):
+        self._store = store
+
+    def route_limit(self, path: str) -> tuple[str, RateLimit]:
+        for prefix, limit in self._routes:
+            # NOTE prefixes end on a path segment, /dashboard/report does not cover /dashboard/reports
+            if path == prefix or path.startswith(prefix.rstrip('/') + '/'):
+                return prefix, limit
+        return "", self._default
+
+    def allow(self, client_ip: str, path: str) -> bool:
+        """
+            **allow**
+                takes a token from the bucket of this client for the route group of path
+        :param client_ip:
+        :param path:
+        :return: False when the budget is exhausted
+        """
+        prefix, limit = self.route_limit(path=path)
+        try:
+            allowed = self._store.take(key=f"{client_ip}|{prefix}", limit=limit, now=time.time())
+        except sqlite3.Error as e:
+            # NOTE a busy or broken shared store must not take the site down, requests are let through
+            with self._lock:
+                self._errors += 1
+            self.logger.error(f"Rate limit store unavailable : {str(e)}")
+            return True
+
+        with self._lock:
+            if allowed:
+                self._allowed += 1
+            else:
+                self._limited[prefix or "/"] = self._limited.get(prefix or "/", 0) + 1
+        return allowed
+
+    def stats(self) -> dict[str, int | dict[str, int]]:
+        with self._lock:
+            allowed, limited, errors = self._allowed, dict(self._limited), self._errors
+        return {
+            'buckets': len(self._store),
+            'allowed': allowed,
+            'limited': limited,
+            'errors': errors
+        }
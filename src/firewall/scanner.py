@@ -0,0 +1,86 @@
+"""
+    **scanner**
+        the attack patterns compiled into a single alternation with one named group per pattern, so a request
+        is scanned once whatever the number of patterns and the group that matched names the pattern to count
+"""
+import codecs
+import re
+import threading
+from collections import Counter
+from typing import Iterable
+
+# NOTE (?i) is only allowed at the start of a pattern, inside the alternation it has to be scoped to its group
+_LEADING_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+
+
+def _scope_flags(pattern: str) -> str:
+    return _LEADING_FLAGS.sub(lambda match: f"(?{match.group(1)}:", pattern) + ")" \
+        if _LEADING_FLAGS.match(pattern) else pattern
+
+
+class PatternScanner:
+    """
+        **PatternScanner**
+            patterns: name -> regular expression, group names are generated so any pattern name may be used
+            overlap: characters carried between chunks, must exceed the longest match spanning a chunk boundary
+    """
+
+    def __init__(self, patterns: dict[str, str], flags: int = 0, overlap: int = 64):
+        self.names: dict[str, str] = {f"p{index}": name for index, name in enumerate(patterns)}
+        alternation = "|".join(f"(?P<{group}>{_scope_flags(patterns[name])})" for group, name in self.names.items())
+        self._regex = re.compile(alternation, flags)
+        self._overlap = overlap
+        self._hits: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _hit(self, match: re.Match | None) -> str | None:
+        if match is None:
+            return None
+        name = self.names[match.lastgroup]
+        with self._lock:
+            self._hits[name] += 1
+        return name
+
+    def match(self, text: str) -> str | None:
+        """
+            **match**
+                same result as trying every pattern with re.match, in one pass
+        :param text:
+        :return: name of the pattern which matched
+        """
+        return self._hit(self._regex.match(text))
+
+    def search(self, text: str) -> str | None:
+        return self._hit(self._regex.search(text))
+
+    def search_chunks(self, chunks: Iterable[bytes], encoding: str = 'utf-8') -> str | None:
+        """
+            **search_chunks**
+                searches a body chunk by chunk and stops at the first match, the tail of the previous chunk is
+                carried over so matches spanning chunks are found, a match touching the end of a chunk is only
+                accepted once the next character is known
+        :param chunks:
+        :param encoding:
+        :return: name of the pattern which matched
+        """
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        # NOTE the first character of the window only gives context to \b, it has been searched already
+        tail = ""
+        for chunk in chunks:
+            window = tail + decoder.decode(chunk)
+            match = self._regex.search(window, 1 if tail else 0)
+            if match is not None and match.end() < len(window):
+                return self._hit(match)
+            tail = window[-self._overlap:]
+        window = tail + decoder.decode(b"", final=True)
+        return self._hit(self._regex.search(window, 1 if tail else 0))
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._hits)
+
+
+def iter_chunks(data: bytes, chunk_size: int = 64 * 1024) -> Iterable[bytes]:
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size].tobytes()
@@ -0,0 +1,45 @@
+"""
+    **cidr_benchmark**
+        compares the per request cost of the compiled CIDRMatcher with the ip_network scan it replaced
+
+        python -m src.firewall.tools.cidr_benchmark
+"""
+import ipaddress
+import timeit
+
+from src.firewall.cidr import CIDRMatcher
+
+
+def benchmark(cidrs: list[str], addresses: list[str], number: int = 10000) -> dict[str, float]:
+    """
+        **benchmark**
+            microseconds per membership check for the compiled matcher and the ip_network scan it replaced
+    :param cidrs:
+    :param addresses:
+    :param number: checks timed per address
+    :return:
+    """
+    matcher = CIDRMatcher(cidrs=cidrs)
+
+    def scan(ip: str) -> bool:
+        return any(ipaddress.ip_address(ip) in ipaddress.ip_network(ip_range) for ip_range in cidrs)
+
+    results = {}
+    for name, check in (('compiled', matcher.__contains__), ('scan', scan)):
+        elapsed = sum(timeit.timeit(lambda: check(address), number=number) for address in addresses)
+        results[name] = round(elapsed / (number * len(addresses)) * 1_000_000, 3)
+    return results
+
+
+def main() -> int:
+    from src.firewall import DEFAULT_IPV4, DEFAULT_IPV6
+    cidrs = DEFAULT_IPV4 + DEFAULT_IPV6
+    # NOTE the first, a middle and the last range as well as addresses outside every range
+    addresses = ['173.245.48.1', '104.16.0.1', '131.0.72.200', '8.8.8.8', '2a06:98c0::1', '2001:db8::1']
+    for name, microseconds in benchmark(cidrs=cidrs, addresses=addresses).items():
+        print(f"{name}: {microseconds}us per request")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
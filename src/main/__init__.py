@@ -8,6 +8,7 @@ from src.utils import (template_folder, static_folder, format_with_grouping, lea
 
 send_mail = SendMail()
 
+from src.cache.invalidation import invalidation_bus
 from src.controller.auth import UserController
 from src.controller.companies import CompaniesController
 from src.controller.encryptor import encryptor
@@ -23,10 +24,10 @@ from src.flutterwave.payments import Flutterwave
 firewall = Firewall()
 
 tenant_controller = TenantController()
-company_controller = CompaniesController()
+lease_agreement_controller = LeaseController()
+company_controller = CompaniesController(lease_controller=lease_agreement_controller)
 user_controller = UserController()
 notifications_controller = NotificationsController()
-lease_agreement_controller = LeaseController()
 wallet_controller = WalletController()
 subscriptions_controller = SubscriptionController()
 
@@ -93,11 +94,21 @@ def create_app(config):
     app.static_folder = static_folder()
     app.config['SECRET_KEY'] = config.SECRET_KEY
     app.config['BASE_URL'] = "https://rental-manager.site"
+    app.config['cache_change_log'] = config.CACHE_CHANGE_LOG
+    app.config['cache_poll_interval'] = config.CACHE_POLL_INTERVAL
+    app.config['firewall_refresh_interval'] = config.FIREWALL_REFRESH_INTERVAL
+    app.config['firewall_fetch_timeout'] = config.FIREWALL_FETCH_TIMEOUT
+    app.config['firewall_snapshot'] = config.FIREWALL_SNAPSHOT
+    app.config['rate_limit_store'] = config.RATE_LIMIT_STORE
+    app.config['mail_sink'] = config.MAIL_SINK
+    app.config['mail_workers'] = config.MAIL_WORKERS
+    app.config['mail_rate'] = config.MAIL_RATE
 
     with app.app_context():
         from src.main.bootstrapping import bootstrapper
         bootstrapper()
 
+        invalidation_bus.init_app(app=app)
         encryptor.init_app(app=app)
         user_controller.init_app(app=app)
         tenant_controller.init_app(app=app)
@@ -1,4 +1,25 @@
-def bootstrapper():
+import contextlib
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, inspect, select, insert, delete, text
+from sqlalchemy.engine import Engine, Inspector
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateColumn
+
+from src.database.sql import Base, Session, engine
+
+# NOTE seconds a worker waits for another worker to finish bootstrapping, a lock row older than this is taken over
+SCHEMA_LOCK_TIMEOUT = 300
+
+
+def load_models() -> list:
+    """
+        **load_models**
+            imports every ORM class so their tables are registered on the metadata
+    :return: the ORM classes in creation order
+    """
     from src.database.sql.address import AddressORM
     from src.database.sql.tenants import TenantORM
     from src.database.sql.user import UserORM
@@ -6,18 +27,21 @@ def bootstrapper():
     from src.database.sql.properties import PropertyORM, UnitORM
     from src.database.sql.bank_account import BankAccountORM
     from src.database.sql.notifications import NotificationORM
-    from src.database.sql.lease import LeaseAgreementORM, LeaseAgreementTemplate
+    from src.database.sql.lease import LeaseAgreementORM, LeaseAgreementTemplate, LeaseNoticeORM
     from src.database.sql.companies import TenantCompanyORM
     from src.database.sql.invoices import InvoiceORM
     from src.database.sql.invoices import ItemsORM
     from src.database.sql.invoices import UserChargesORM
+    from src.database.sql.invoices import InvoiceChargeORM, LeaseInvoiceORM
     from src.database.sql.tenants import TenantAddressORM
     from src.database.sql.payments import PaymentORM
     from src.database.sql.wallet import WalletTransactionORM
     from src.database.sql.user import ProfileORM
     from src.database.sql.subscriptions import PlansORM, SubscriptionsORM, PaymentReceiptORM
+    from src.database.sql.schema import SchemaVersionORM, SchemaLockORM
+    from src.database.sql.jobs import JobWatermarkORM
 
-    classes_to_create = [
+    return [
         AddressORM,
         TenantORM,
         UserORM,
@@ -29,10 +53,13 @@ def bootstrapper():
         NotificationORM,
         LeaseAgreementORM,
         LeaseAgreementTemplate,
+        LeaseNoticeORM,
         TenantCompanyORM,
         InvoiceORM,
         ItemsORM,
         UserChargesORM,
+        InvoiceChargeORM,
+        LeaseInvoiceORM,
         TenantAddressORM,
         PaymentORM,
         WalletTransactionORM,
@@ -40,7 +67,186 @@ def bootstrapper():
         PlansORM,
         SubscriptionsORM,
         PaymentReceiptORM,
+        SchemaVersionORM,
+        SchemaLockORM,
+        JobWatermarkORM,
     ]
 
-    for cls in classes_to_create:
-        cls.create_if_not_table()
+
+def schema_fingerprint(metadata: MetaData) -> str:
+    """
+        **schema_fingerprint**
+            a hash of the declared tables, columns and indexes - it changes whenever the models change
+    :param metadata:
+    :return:
+    """
+    schema = []
+    for table in sorted(metadata.tables.values(), key=lambda _table: _table.name):
+        columns = [(column.name, str(column.type), column.nullable, column.primary_key) for column in table.columns]
+        indexes = sorted((index.name, tuple(column.name for column in index.columns)) for index in table.indexes)
+        schema.append((table.name, columns, indexes))
+    return hashlib.sha256(repr(schema).encode('utf-8')).hexdigest()
+
+
+def is_schema_current(_engine: Engine, version: str) -> bool:
+    """
+        **is_schema_current**
+            a single primary key lookup, a missing schema_version table means the schema was never recorded
+    :param _engine:
+    :param version:
+    :return:
+    """
+    from src.database.sql.schema import SchemaVersionORM
+    try:
+        with _engine.connect() as connection:
+            return connection.execute(select(SchemaVersionORM.version).where(
+                SchemaVersionORM.version == version)).first() is not None
+    except (OperationalError, ProgrammingError):
+        return False
+
+
+def add_missing_columns(_engine: Engine, metadata: MetaData, inspector: Inspector, existing_tables: set[str]):
+    """
+        **add_missing_columns**
+            idempotent migration - columns declared after a table was created are added to the existing table,
+            only nullable columns and columns with a server default can be added to a table holding rows
+    :param _engine:
+    :param metadata:
+    :param inspector:
+    :param existing_tables: tables which existed before this bootstrap
+    :return:
+    """
+    preparer = _engine.dialect.identifier_preparer
+    with _engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or not (column.nullable or column.server_default is not None):
+                    continue
+                column_ddl = CreateColumn(column).compile(dialect=_engine.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}")
+    inspector.clear_cache()
+
+
+def create_missing_indexes(_engine: Engine, metadata: MetaData, inspector: Inspector, existing_tables: set[str]):
+    """
+        **create_missing_indexes**
+            idempotent migration - indexes declared after a table was created are added to the existing table
+    :param _engine:
+    :param metadata:
+    :param inspector:
+    :param existing_tables: tables which existed before this bootstrap
+    :return:
+    """
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables or not table.indexes:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes and {column.name for column in index.columns} <= existing_columns:
+                index.create(bind=_engine)
+
+
+def record_schema_version(_engine: Engine, version: str):
+    from src.database.sql.schema import SchemaVersionORM
+    with Session(bind=_engine) as session:
+        try:
+            session.add(SchemaVersionORM(version=version, applied_at=datetime.now()))
+            session.commit()
+        except IntegrityError:
+            # NOTE another worker bootstrapped the same schema first
+            session.rollback()
+
+
+@contextlib.contextmanager
+def schema_lock(_engine: Engine, name: str = "bootstrap", timeout: float = SCHEMA_LOCK_TIMEOUT):
+    """
+        **schema_lock**
+            serializes bootstrapping across workers - a named lock on MySQL, a lock row in schema_lock
+            on other databases
+    :param _engine:
+    :param name:
+    :param timeout: seconds to wait for the lock
+    :return:
+    """
+    if _engine.dialect.name == "mysql":
+        with _engine.connect() as connection:
+            if not connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                      dict(name=f"schema_{name}", timeout=int(timeout))).scalar():
+                raise TimeoutError(f"unable to lock the schema for {name} within {timeout}s")
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT RELEASE_LOCK(:name)"), dict(name=f"schema_{name}"))
+        return
+
+    from src.database.sql.schema import SchemaLockORM
+    try:
+        SchemaLockORM.__table__.create(bind=_engine, checkfirst=True)
+    except (OperationalError, ProgrammingError):
+        # NOTE another worker created the table between the check and the create
+        if not inspect(_engine).has_table(SchemaLockORM.__tablename__):
+            raise
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with _engine.begin() as connection:
+                # NOTE a lock left behind by a worker which died while bootstrapping is taken over
+                connection.execute(delete(SchemaLockORM).where(
+                    SchemaLockORM.name == name,
+                    SchemaLockORM.locked_at < datetime.now() - timedelta(seconds=timeout)))
+                connection.execute(insert(SchemaLockORM).values(name=name, locked_at=datetime.now()))
+            break
+        except (IntegrityError, OperationalError) as e:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"unable to lock the schema for {name} within {timeout}s") from e
+            time.sleep(0.1)
+    try:
+        yield
+    finally:
+        with _engine.begin() as connection:
+            connection.execute(delete(SchemaLockORM).where(SchemaLockORM.name == name))
+
+
+def bootstrapper(_engine: Engine = engine) -> bool:
+    """
+        **bootstrapper**
+            warm starts only look up the recorded schema version, cold starts take the schema lock, reflect
+            the database once, create the missing tables, columns and indexes, run the data migrations and
+            record the version
+    :param _engine:
+    :return: True when the schema had to be bootstrapped
+    """
+    from src.database.sql.invoices import backfill_invoice_charges, backfill_invoice_totals
+
+    load_models()
+    version = schema_fingerprint(metadata=Base.metadata)
+    if is_schema_current(_engine=_engine, version=version):
+        return False
+
+    with schema_lock(_engine=_engine):
+        # NOTE workers starting together all miss the version, only the first to take the lock migrates
+        if is_schema_current(_engine=_engine, version=version):
+            return False
+
+        inspector = inspect(_engine)
+        existing_tables = set(inspector.get_table_names())
+        missing_tables = [table for table in Base.metadata.sorted_tables if table.name not in existing_tables]
+        Base.metadata.create_all(bind=_engine, tables=missing_tables, checkfirst=True)
+
+        add_missing_columns(_engine=_engine, metadata=Base.metadata, inspector=inspector,
+                            existing_tables=existing_tables)
+        create_missing_indexes(_engine=_engine, metadata=Base.metadata, inspector=inspector,
+                               existing_tables=existing_tables)
+
+        # NOTE migrates the legacy comma separated invoice charge_ids into invoice_charge
+        with Session(bind=_engine) as session:
+            backfill_invoice_charges(session=session)
+            # NOTE invoices written before their totals were persisted
+            backfill_invoice_totals(session=session)
+
+        record_schema_version(_engine=_engine, version=version)
+    return True
@@ -2,10 +2,14 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from pydantic import ValidationError
 
 from src.authentication import admin_login
+from src.cache.invalidation import invalidation_bus
+from src.controller import session_pool
+from src.database.sql import engine_pool_stats
 from src.database.models.subscriptions import PlanName, CreatePlan, Plan
 from src.database.models.users import User
 from src.logger import init_logger
-from src.main import user_controller, tenant_controller, company_controller, subscriptions_controller
+from src.main import (user_controller, tenant_controller, company_controller, subscriptions_controller,
+                      lease_agreement_controller, wallet_controller, firewall)
 
 admin_logger = init_logger('admin_logger')
 admin_routes = Blueprint('admin', __name__)
@@ -20,9 +24,11 @@ async def get_admin(user: User):
     :param user:
     :return:
     """
-    payment_receipts_dicts = [receipt.dict() for receipt in subscriptions_controller.payment_receipts]
+    payment_receipts = await subscriptions_controller.get_payment_receipts() or []
+    payment_receipts_dicts = [receipt.dict() for receipt in payment_receipts]
     plans_dict = [plan.dict() for plan in subscriptions_controller.plans]
-    subscription_dicts = [subscription.disp_dict() for subscription in subscriptions_controller.subscriptions.values()]
+    subscriptions = await subscriptions_controller.get_all_subscriptions() or []
+    subscription_dicts = [subscription.disp_dict() for subscription in subscriptions]
     plan_types = [plan_type.value for plan_type in PlanName]
 
     context = dict(user=user.dict(),
@@ -82,8 +88,8 @@ async def get_users(user: User):
     :param user:
     :return:
     """
-    users = user_controller.users
-    _users = [user.dict() for user in users.values()]
+    users = await user_controller.get_all_users() or []
+    _users = [user.dict() for user in users]
     admin_logger.info(f"Admin Logger : {_users}")
     context = dict(user=user.dict(), users=_users)
 
@@ -112,7 +118,7 @@ async def get_tenants(user: User):
     :param user:
     :return:
     """
-    tenants = [tenant.dict() for tenant in tenant_controller.tenants]
+    tenants = [tenant.dict() for tenant in await tenant_controller.get_all_tenants() or []]
     context = dict(user=user.dict(), tenants=tenants)
     return render_template('admin/tenants.html', **context)
 
@@ -125,7 +131,7 @@ async def admin_get_companies(user: User):
     :param user:
     :return:
     """
-    companies = [company.dict() for company in company_controller.companies]
+    companies = [company.dict() for company in await company_controller.get_all_companies() or []]
     admin_logger.info(f"Admin logger : {companies}")
     context = dict(user=user.dict(), companies=companies)
     return render_template('admin/companies.html', **context)
@@ -139,7 +145,48 @@ async def admin_get_buildings(user: User):
     :param user:
     :return:
     """
-    buildings = [building.dict() for building in company_controller.buildings]
+    buildings = [building.dict() for building in await company_controller.get_all_buildings() or []]
     admin_logger.info(f"Admin logger : {buildings}")
     context = dict(user=user.dict(), buildings=buildings)
     return render_template('admin/buildings.html', **context)
+
+
+@admin_routes.get('/admin/database/pool-stats')
+@admin_login
+async def get_pool_stats(user: User):
+    """
+        **get_pool_stats**
+            engine connection pool and controller session pool statistics
+    :param user:
+    :return:
+    """
+    return dict(engine=engine_pool_stats(), sessions=session_pool.stats())
+
+
+@admin_routes.get('/admin/cache-stats')
+@admin_login
+async def get_cache_stats(user: User):
+    """
+        **get_cache_stats**
+            size, hit, miss and eviction counters of the controller caches and the invalidation bus counters
+    :param user:
+    :return:
+    """
+    controllers = dict(users=user_controller, tenants=tenant_controller, companies=company_controller,
+                       leases=lease_agreement_controller, wallets=wallet_controller,
+                       subscriptions=subscriptions_controller)
+    stats = {name: controller.cache_stats() for name, controller in controllers.items()}
+    stats['invalidation_bus'] = invalidation_bus.stats()
+    return stats
+
+
+@admin_routes.get('/admin/firewall-stats')
+@admin_login
+async def get_firewall_stats(user: User):
+    """
+        **get_firewall_stats**
+            requests rejected by each firewall attack pattern and by the rate limiter
+    :param user:
+    :return:
+    """
+    return firewall.stats()
@@ -48,7 +48,8 @@ async def do_login():
         # Setting Loging Cookie
         delay = REMEMBER_ME_DELAY if auth_user.remember == "on" else 30
         expiration = datetime.utcnow() + timedelta(minutes=delay)
-        response.set_cookie('auth', value=login_user.user_id, expires=expiration, httponly=True)
+        session_token = user_controller.create_session_token(user=login_user, lifetime=timedelta(minutes=delay))
+        response.set_cookie('auth', value=session_token, expires=expiration, httponly=True)
 
         if not login_user.account_verified:
             _ = await user_controller.send_verification_email(user=login_user)
@@ -109,7 +110,8 @@ async def do_register():
         flash(message='Account Successfully created please login', category='success')
         response: Response = await create_response(url_for('auth.get_login'))
         expiration = datetime.utcnow() + timedelta(minutes=30)
-        response.set_cookie('auth', value=user_data.user_id, expires=expiration, httponly=True)
+        session_token = user_controller.create_session_token(user=_user_data, lifetime=timedelta(minutes=30))
+        response.set_cookie('auth', value=session_token, expires=expiration, httponly=True)
         return response
 
     flash(message='failed to create new user try again later', category='danger')
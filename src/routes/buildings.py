@@ -6,9 +6,10 @@ from flask import Blueprint, render_template, flash, redirect, url_for, request
 from pydantic import ValidationError
 
 from src.authentication import login_required
+from src.business_logic.payments.reconciliation import split_invoices_by_status
 from src.database.models.companies import Company
 from src.database.models.invoices import (CreateInvoicedItem, BillableItem, CreateUnitCharge,
-                                          PrintInvoiceForm, UnitEMailInvoiceForm, PaymentStatus)
+                                          PrintInvoiceForm, UnitEMailInvoiceForm)
 from src.database.models.lease import LeaseAgreement, CreateLeaseAgreement
 from src.database.models.notifications import NotificationsModel
 from src.database.models.properties import Property, Unit, AddUnit, UpdateProperty, CreateProperty, UpdateUnit, \
@@ -179,11 +180,9 @@ async def get_unit(user: User, building_id: str, unit_id: str):
         tenant_payments = await lease_agreement_controller.load_tenant_payments(tenant_id=unit_data.tenant_id)
         invoices = await lease_agreement_controller.get_invoices(tenant_id=tenant_data.tenant_id)
 
-        historical_invoices = [invoice.dict() for invoice in invoices if invoice] if invoices else []
-        paid_invoices = [invoice.dict() for invoice in invoices
-                         if invoice.get_payment_status(payments=tenant_payments) == PaymentStatus.FULLY_PAID]
-        un_paid_invoices = [invoice.dict() for invoice in invoices
-                            if invoice.get_payment_status(payments=tenant_payments) != PaymentStatus.FULLY_PAID]
+        # NOTE the payments are grouped by invoice once instead of being scanned for every invoice
+        historical_invoices, paid_invoices, un_paid_invoices = split_invoices_by_status(invoices=invoices,
+                                                                                        payments=tenant_payments)
 
         if tenant_data.company_id:
             company_data: Company = await company_controller.get_company_internal(company_id=tenant_data.company_id)
@@ -566,9 +565,10 @@ async def do_send_invoice_email(user: User):
 
     message_ = await format_email_message(message, url_list)
     new_mail = dict(to_=to_, subject_=subject_, html_=message_)
-    await send_mail.send_mail_resend(email=EmailModel(**new_mail))
-
-    flash(message="Email Sent with selected invoices", category="success")
+    if send_mail.enqueue(email=EmailModel(**new_mail)):
+        flash(message="Email Sent with selected invoices", category="success")
+    else:
+        flash(message="Unable to send email at the moment please try again later", category="danger")
     return redirect(url_for('buildings.get_unit', building_id=invoice_email_form.building_id,
                             unit_id=invoice_email_form.unit_id), code=302)
 
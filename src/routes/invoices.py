@@ -248,4 +248,5 @@ async def _update_invoice(invoice, update_model) -> Invoice:
     invoice.description = update_model.description
     invoice.currency = update_model.currency
     invoice.tax_rate = update_model.tax_rate
+    invoice.refresh_totals()
     return invoice
@@ -2,9 +2,10 @@ from flask import Blueprint, render_template, request, jsonify, flash, redirect,
 from pydantic import ValidationError
 
 from src.authentication import login_required
+from src.business_logic.payments.reconciliation import split_invoices_by_status
 from src.database.models.bank_accounts import BusinessBankAccount
 from src.database.models.companies import Company
-from src.database.models.invoices import Invoice, PaymentStatus
+from src.database.models.invoices import Invoice
 from src.database.models.properties import Property, Unit
 from src.database.models.tenants import (QuotationForm, Tenant, CreateTenant, TenantSendMail, TenantAddress,
                                          CreateTenantAddress)
@@ -114,12 +115,8 @@ async def get_tenant(user: User, tenant_id: str):
 
     tenant_payments = await lease_agreement_controller.load_tenant_payments(tenant_id=tenant_id)
     invoices: list[Invoice] = await lease_agreement_controller.get_invoices(tenant_id=tenant_id)
-    historical_invoices = [invoice.dict() for invoice in invoices if invoice] if invoices else []
-    paid_invoices = [invoice.dict() for invoice in invoices
-                     if invoice.get_payment_status(payments=tenant_payments) == PaymentStatus.FULLY_PAID]
-
-    un_paid_invoices = [invoice.dict() for invoice in invoices
-                        if invoice.get_payment_status(payments=tenant_payments) != PaymentStatus.FULLY_PAID]
+    historical_invoices, paid_invoices, un_paid_invoices = split_invoices_by_status(invoices=invoices,
+                                                                                    payments=tenant_payments)
 
     unit = await lease_agreement_controller.get_leased_unit_by_tenant_id(tenant_id=tenant_id)
     unit_dicts = unit.dict() if isinstance(unit, Unit) else {}
@@ -0,0 +1,116 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# NOTE src.business_logic.lease.check_expired imports src.main, which constructs the controllers
+import src.main  # noqa: F401
+from src.business_logic.lease.check_expired import LeaseAgreementNotifier, process_lease_expiry, LEASE_EXPIRY_JOB
+from src.controller.lease_controller import LeaseController
+from src.database.models.lease import LeaseAgreement
+from src.database.sql import Base
+from src.database.sql.companies import CompanyORM, UserCompanyORM
+from src.database.sql.jobs import read_watermark
+from src.database.sql.lease import LeaseAgreementORM
+from src.database.sql.notifications import NotificationORM
+from src.database.sql.properties import PropertyORM, UnitORM
+from src.database.sql.tenants import TenantORM
+
+
+class Outbox:
+    def __init__(self):
+        self.emails = []
+
+    def enqueue(self, email) -> bool:
+        self.emails.append(email)
+        return True
+
+
+@pytest.fixture
+def session_maker() -> sessionmaker:
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    _session_maker = sessionmaker(bind=engine)
+    with _session_maker() as session:
+        session.add(CompanyORM(company_id="company", company_name="Rentals", contact_number="071"))
+        session.add(UserCompanyORM(id="admin", company_id="company", user_id="admin-user", user_level="admin"))
+        session.add(PropertyORM(property_id="building", company_id="company", name="Towers", description="Flats",
+                                property_type="residential", amenities="", landlord="Landlord",
+                                maintenance_contact="072", lease_terms="monthly", built_year=2000, parking_spots=3))
+        for number in range(5):
+            session.add(TenantORM(tenant_id=f"tenant-{number}", name=f"Tenant {number}",
+                                  email=f"tenant{number}@example.com", cell="073"))
+            session.add(UnitORM(unit_id=f"unit-{number}", unit_number=str(number), property_id="building",
+                                rental_amount=1000, unit_area=50, has_reception=False))
+        session.commit()
+    return _session_maker
+
+
+def agreement(number: int, end_date: date) -> LeaseAgreement:
+    return LeaseAgreement(agreement_id=f"agreement-{number}", property_id="building", tenant_id=f"tenant-{number}",
+                          unit_id=f"unit-{number}", start_date=end_date - timedelta(days=365), end_date=end_date,
+                          rent_amount=1000, deposit_amount=1000, is_active=True, payment_period="monthly")
+
+
+def test_agreements_are_notified_once_per_end_date(session_maker):
+    today = date.today()
+    agreements = [agreement(0, today - timedelta(days=1)), agreement(1, today + timedelta(days=10)),
+                  agreement(2, today + timedelta(days=90))]
+    outbox = Outbox()
+    notifier = LeaseAgreementNotifier(_agreements=agreements, session_maker=session_maker, mailer=outbox)
+
+    assert asyncio.run(notifier.process_expired_agreements()) == dict(notices=2, skipped=0, notifications=2,
+                                                                      emails=2)
+    assert sorted(email.to_ for email in outbox.emails) == ["tenant0@example.com", "tenant1@example.com"]
+    assert "will expire on" in outbox.emails[1].html_
+    assert asyncio.run(notifier.process_expired_agreements())['skipped'] == 2
+
+    renewed = agreement(1, today + timedelta(days=20))
+    notifier = LeaseAgreementNotifier(_agreements=[renewed], session_maker=session_maker, mailer=outbox)
+    assert asyncio.run(notifier.process_expired_agreements())['notices'] == 1
+    with session_maker() as session:
+        assert session.query(NotificationORM).filter(NotificationORM.user_id == "admin-user").count() == 3
+
+
+def test_runs_only_scan_agreements_crossing_a_threshold_since_the_watermark(session_maker):
+    today = date(2024, 6, 1)
+    with session_maker() as session:
+        for number, days in enumerate([-400, -1, 10, 40, 45]):
+            lease = agreement(number, today + timedelta(days=days))
+            session.add(LeaseAgreementORM(**lease.dict(exclude={'version'})))
+        session.commit()
+    controller = LeaseController(session_maker=session_maker)
+    outbox = Outbox()
+
+    first = asyncio.run(process_lease_expiry(session_maker=session_maker, mailer=outbox, controller=controller,
+                                             today=today))
+    assert first['scanned'] == 3
+    with session_maker() as session:
+        assert read_watermark(session=session, job_name=LEASE_EXPIRY_JOB) == today
+
+    # NOTE a week later only the agreement 40 days out has come within the 30 day notice period
+    later = asyncio.run(process_lease_expiry(session_maker=session_maker, mailer=outbox, controller=controller,
+                                             today=today + timedelta(days=12)))
+    assert later['scanned'] == 2 and later['notices'] == 2
+
+
+def test_agreements_created_after_the_watermark_are_notified_on_the_next_run(session_maker):
+    today = date(2024, 6, 1)
+    controller = LeaseController(session_maker=session_maker)
+    outbox = Outbox()
+    assert asyncio.run(process_lease_expiry(session_maker=session_maker, mailer=outbox, controller=controller,
+                                            today=today))['scanned'] == 0
+
+    # NOTE created after the run on today already within the notice period of the next run
+    with session_maker() as session:
+        lease = agreement(0, today + timedelta(days=20))
+        session.add(LeaseAgreementORM(**lease.dict(exclude={'version'})))
+        session.commit()
+
+    later = asyncio.run(process_lease_expiry(session_maker=session_maker, mailer=outbox, controller=controller,
+                                             today=today + timedelta(days=1)))
+    assert later['scanned'] == 1 and later['notices'] == 1
+    assert asyncio.run(process_lease_expiry(session_maker=session_maker, mailer=outbox, controller=controller,
+                                            today=today + timedelta(days=2)))['notices'] == 0
@@ -0,0 +1,194 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# NOTE src.business_logic.lease.create_invoices imports src.main, which constructs the controllers
+import src.main  # noqa: F401
+from src.business_logic.lease.create_invoices import StatementsAndInvoicing
+from src.controller.companies import CompaniesController
+from src.controller.lease_controller import LeaseController
+from src.database.sql import Base
+from src.database.sql.companies import CompanyORM, UserCompanyORM
+from src.database.sql.invoices import InvoiceORM, ItemsORM, UserChargesORM, InvoiceChargeORM, LeaseInvoiceORM
+from src.database.sql.lease import LeaseAgreementORM
+from src.database.sql.properties import PropertyORM
+from src.database.sql.tenants import TenantORM
+from src.database.sql.user import ProfileORM
+from src.emailer import SendMail
+from src.emailer.dispatcher import MailDispatcher, FileSink
+
+
+class Outbox:
+    def __init__(self):
+        self.emails = []
+
+    def enqueue(self, email, on_sent=None) -> bool:
+        self.emails.append(email)
+        if on_sent is not None:
+            on_sent()
+        return True
+
+    def flush(self, count: int, timeout: float = 60.0) -> bool:
+        return True
+
+
+@pytest.fixture
+def session_maker() -> sessionmaker:
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    _session_maker = sessionmaker(bind=engine)
+    today = date(2024, 6, 10)
+    with _session_maker() as session:
+        session.add(CompanyORM(company_id="company", company_name="Rentals", contact_number="071"))
+        session.add(UserCompanyORM(id="admin", company_id="company", user_id="admin-user", user_level="admin"))
+        session.add(ProfileORM(user_id="admin-user", deposit_multiplier=2, currency="R", tax_rate=15))
+        session.add(PropertyORM(property_id="building", company_id="company", name="Towers", description="Flats",
+                                property_type="residential", amenities="", landlord="Landlord",
+                                maintenance_contact="072", lease_terms="monthly", built_year=2000, parking_spots=3))
+        for number in range(7):
+            session.add(TenantORM(tenant_id=f"tenant-{number}", name=f"Tenant {number}",
+                                  email=f"tenant{number}@example.com", cell="073", is_renting=True))
+            session.add(LeaseAgreementORM(agreement_id=f"agreement-{number}", property_id="building",
+                                          tenant_id=f"tenant-{number}", unit_id=f"unit-{number}",
+                                          start_date=today - timedelta(days=30), end_date=today + timedelta(days=300),
+                                          rent_amount=1000 + number, deposit_amount=2000, is_active=number != 6,
+                                          payment_period="monthly"))
+        session.add(ItemsORM(property_id="building", item_number="item", description="Water", multiplier=1,
+                             deleted=False))
+        session.add(UserChargesORM(charge_id="water", property_id="building", tenant_id="tenant-0", unit_id="unit-0",
+                                   item_number="item", month=6, amount=50, date_of_entry=today, is_invoiced=False))
+        session.commit()
+    return _session_maker
+
+
+def test_monthly_run_invoices_each_lease_once_per_month(session_maker):
+    outbox = Outbox()
+    progress = []
+    invoicing = StatementsAndInvoicing(session_maker=session_maker, mailer=outbox, today=date(2024, 6, 10),
+                                       chunk_size=4, progress=lambda done, total: progress.append((done, total)))
+
+    assert asyncio.run(invoicing.run()) == dict(invoiced=6, skipped=0, failed=0, charges=1, emails=6)
+    assert progress == [(4, 6), (6, 6)]
+    with session_maker() as session:
+        invoices = session.query(InvoiceORM).order_by(InvoiceORM.invoice_number).all()
+        assert [invoice.due_date for invoice in invoices] == [date(2024, 7, 7)] * 6
+        assert all(invoice.invoice_sent for invoice in invoices)
+        assert {row.billing_month for row in session.query(LeaseInvoiceORM)} == {date(2024, 7, 1)}
+        assert session.query(InvoiceChargeORM).one().charge_id == "water"
+        assert session.get(UserChargesORM, "water").is_invoiced
+    assert "1207" in outbox.emails[0].html_
+
+    # NOTE a second run in the same billing month finds every lease already invoiced
+    assert asyncio.run(invoicing.run()) == dict(invoiced=0, skipped=6, failed=0, charges=0, emails=0)
+
+    next_month = StatementsAndInvoicing(session_maker=session_maker, mailer=outbox, today=date(2024, 7, 8))
+    assert asyncio.run(next_month.create_monthly_invoices())['invoiced'] == 6
+
+
+def test_invoices_are_taxed_at_the_rate_of_the_company_profile(session_maker):
+    with session_maker() as session:
+        session.get(ProfileORM, "admin-user").tax_rate = 10
+        session.commit()
+    invoicing = StatementsAndInvoicing(session_maker=session_maker, mailer=Outbox(), today=date(2024, 6, 10))
+
+    asyncio.run(invoicing.create_monthly_invoices())
+    with session_maker() as session:
+        invoice = session.query(InvoiceORM).filter(InvoiceORM.tenant_id == "tenant-0").one()
+        assert invoice.tax_rate == 10
+        assert (invoice.total_amount, invoice.total_taxes, invoice.amount_payable) == (1050, 105, 1155)
+
+
+def test_cached_tenant_invoices_are_invalidated_by_the_run(session_maker):
+    controller = LeaseController(session_maker=session_maker)
+    assert controller.tenant_invoices.get("tenant-0") == []
+    invoicing = StatementsAndInvoicing(session_maker=session_maker, mailer=Outbox(), today=date(2024, 6, 10),
+                                       controller=controller)
+
+    asyncio.run(invoicing.create_monthly_invoices())
+    invoices = controller.tenant_invoices.get("tenant-0")
+    assert len(invoices) == 1 and not invoices[0].invoice_sent
+    controller.invoices_by_number.upsert(invoices[0])
+
+    assert asyncio.run(invoicing.send_invoices(billing_month=date(2024, 7, 1))) == 6
+    assert controller.invoices_by_number.get(invoices[0].invoice_number) is None
+    assert controller.tenant_invoices.get("tenant-0")[0].invoice_sent
+
+
+def test_editing_an_invoiced_charge_refreshes_the_cached_invoice_totals(session_maker):
+    controller = LeaseController(session_maker=session_maker)
+    companies = CompaniesController(session_maker=session_maker, lease_controller=controller)
+    invoicing = StatementsAndInvoicing(session_maker=session_maker, mailer=Outbox(), today=date(2024, 6, 10),
+                                       controller=controller)
+    asyncio.run(invoicing.create_monthly_invoices())
+    invoice = controller.tenant_invoices.get("tenant-0")[0]
+    controller.invoices_by_number.upsert(invoice)
+    assert invoice.total_amount == 1050
+
+    asyncio.run(companies.update_unit_charge(charge_id="water", amount=80))
+    assert controller.tenant_invoices.get("tenant-0")[0].total_amount == 1080
+    assert controller.invoices_by_number.get(invoice.invoice_number).total_amount == 1080
+
+    asyncio.run(companies.update_billable_item(property_id="building", item_number="item", multiplier=2))
+    assert controller.invoices_by_number.get(invoice.invoice_number).total_amount == 1160
+
+    asyncio.run(companies.delete_unit_charge(charge_id="water"))
+    assert controller.tenant_invoices.get("tenant-0")[0].total_amount == 1000
+
+
+class RejectingSink(FileSink):
+    batch_size = 1
+
+    def send_batch(self, messages):
+        if any(message['to'] == "tenant3@example.com" for message in messages):
+            raise ConnectionError("address rejected")
+        super().send_batch(messages)
+
+
+def test_only_invoices_whose_email_was_sent_are_flagged_as_sent(session_maker, tmp_path):
+    mailer = SendMail()
+    sink = RejectingSink(path=str(tmp_path / "mail.jsonl"))
+    mailer.dispatcher = MailDispatcher(sink=sink, workers=2, max_attempts=1)
+    invoicing = StatementsAndInvoicing(session_maker=session_maker, mailer=mailer, today=date(2024, 6, 10))
+
+    assert asyncio.run(invoicing.run())['emails'] == 5
+    assert len(sink.read()) == 5
+    with session_maker() as session:
+        unsent = session.query(InvoiceORM).filter(InvoiceORM.invoice_sent == False).one()
+        assert unsent.tenant_id == "tenant-3"
+    mailer.dispatcher.stop()
+
+
+def test_parallel_run_partitions_by_company_and_merges_in_company_order(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'invoicing.db'}"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    _session_maker = sessionmaker(bind=engine)
+    today = date(2024, 6, 10)
+    with _session_maker() as session:
+        for company in ("north", "south"):
+            session.add(CompanyORM(company_id=company, company_name=company.title(), contact_number="071"))
+            session.add(PropertyORM(property_id=f"{company}-building", company_id=company, name="Towers",
+                                    description="Flats", property_type="residential", amenities="",
+                                    landlord="Landlord", maintenance_contact="072", lease_terms="monthly",
+                                    built_year=2000, parking_spots=3))
+        for number in range(9):
+            company = "north" if number < 6 else "south"
+            session.add(TenantORM(tenant_id=f"tenant-{number}", name=f"Tenant {number}",
+                                  email=f"tenant{number}@example.com", cell="073", is_renting=True))
+            session.add(LeaseAgreementORM(agreement_id=f"agreement-{number}", property_id=f"{company}-building",
+                                          tenant_id=f"tenant-{number}", unit_id=f"unit-{number}",
+                                          start_date=today, end_date=today + timedelta(days=300),
+                                          rent_amount=1000, deposit_amount=2000, is_active=True,
+                                          payment_period="monthly"))
+        session.commit()
+
+    invoicing = StatementsAndInvoicing(session_maker=_session_maker, mailer=Outbox(), today=today, chunk_size=4)
+    assert asyncio.run(invoicing.company_partitions(billing_month=date(2024, 7, 1))) == dict(north=6, south=3)
+    assert asyncio.run(invoicing.create_monthly_invoices_in_parallel(workers=2, database_url=database_url)) == dict(
+        invoiced=9, skipped=0, failed=0, charges=0, companies=2, failures=[])
+    with _session_maker() as session:
+        assert session.query(LeaseInvoiceORM).count() == 9
+    assert asyncio.run(invoicing.company_partitions(billing_month=date(2024, 7, 1))) == {}
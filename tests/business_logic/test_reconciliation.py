@@ -0,0 +1,38 @@
+from datetime import date
+
+from src.business_logic.payments.reconciliation import reconcile_invoices, split_invoices_by_status
+from src.database.models.invoices import Invoice, PaymentStatus
+from src.database.models.payments import Payment
+
+
+def invoice(invoice_number: int, rental_amount: int) -> Invoice:
+    return Invoice(invoice_number=invoice_number, service_name="Rental", description="Monthly Rental", currency="R",
+                   customer=dict(tenant_id="tenant", name="Tenant", email="tenant@example.com", cell="071"),
+                   tax_rate=0, date_issued=date(2024, 6, 1), due_date=date(2024, 6, 7), month=6,
+                   rental_amount=rental_amount, charge_ids=None, invoice_items=[], invoice_sent=False,
+                   invoice_printed=False)
+
+
+def payment(invoice_number: int, amount_paid: int) -> Payment:
+    return Payment(transaction_id=f"{invoice_number}-{amount_paid}", invoice_number=invoice_number,
+                   tenant_id="tenant", property_id="building", unit_id="unit", amount_paid=amount_paid,
+                   date_paid=date(2024, 6, 5), payment_method="eft", is_successful=True, month=6, comments="")
+
+
+def test_invoices_are_reconciled_against_their_payments():
+    invoices = [invoice(1, 1000), invoice(2, 1000), invoice(3, 1000)]
+    payments = [payment(1, 600), payment(2, 300), payment(1, 400), payment(9, 50)]
+
+    balances = reconcile_invoices(invoices=invoices, payments=payments)
+    assert [balance.status for balance in balances.values()] == [PaymentStatus.FULLY_PAID,
+                                                                 PaymentStatus.PARTIALLY_PAID, PaymentStatus.UNPAID]
+    assert [balance.outstanding for balance in balances.values()] == [0, 700, 1000]
+    # NOTE matches the per invoice scan it replaces
+    assert [balance.status for balance in balances.values()] == [item.get_payment_status(payments=payments)
+                                                                 for item in invoices]
+
+    historical, paid, unpaid = split_invoices_by_status(invoices=invoices, payments=payments)
+    assert [item['invoice_number'] for item in historical] == [1, 2, 3]
+    assert [item['invoice_number'] for item in paid] == [1]
+    assert [(item['invoice_number'], item['outstanding']) for item in unpaid] == [(2, 700), (3, 1000)]
+    assert split_invoices_by_status(invoices=None, payments=None) == ([], [], [])
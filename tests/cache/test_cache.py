@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+from src.cache import IndexedCollection, LRUCache, PartitionedCache
+
+
+def tenant(company_id: str, tenant_id: str, **kwargs) -> SimpleNamespace:
+    return SimpleNamespace(company_id=company_id, tenant_id=tenant_id, **kwargs)
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache = LRUCache(name="test", max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_indexed_collection_keeps_secondary_indexes_in_step_with_upserts():
+    collection = IndexedCollection(primary_key="tenant_id", indexes=("company_id", "details.cell"))
+    collection.upsert(tenant("company-1", "t1", details=SimpleNamespace(cell="071")))
+    collection.upsert(tenant("company-1", "t2", details=SimpleNamespace(cell="072")))
+    collection.upsert(tenant("company-2", "t1", details=SimpleNamespace(cell="073")))
+
+    assert [entity.tenant_id for entity in collection.find("company_id", "company-1")] == ["t2"]
+    assert collection.get("t1").company_id == "company-2"
+    assert collection.find("details.cell", "071") == []
+    assert collection.remove_where("company_id", "company-2") == 1
+    assert len(collection) == 1 and "t1" not in collection
+
+
+def test_partitioned_cache_loads_partitions_on_first_access():
+    loaded = []
+
+    def loader(company_id):
+        loaded.append(company_id)
+        return [tenant(company_id, f"{company_id}-{number}") for number in range(3)]
+
+    cache = PartitionedCache(name="tenants", loader=loader, partition_by="company_id", primary_key="tenant_id",
+                             max_partitions=2)
+    assert len(cache.get("company-1")) == 3
+    assert len(cache.get("company-1")) == 3
+    cache.get("company-2")
+    cache.get("company-3")
+
+    assert loaded == ["company-1", "company-2", "company-3"]
+    assert not cache.is_loaded("company-1")
+    assert cache.get_entity("company-1-0") is None
+    assert cache.stats()['entities'] == 6
+
+    cache.upsert(tenant("company-3", "company-3-0", name="updated"))
+    assert [getattr(entity, 'name', None) for entity in cache.get("company-3")].count("updated") == 1
+    assert len(cache.get("company-3")) == 3
+
+    # moving an entity into a partition which is not loaded drops it from the loaded one
+    cache.upsert(tenant("company-9", "company-3-1"))
+    assert len(cache.get("company-3")) == 2
+
+
+def test_partition_invalidated_while_loading_is_not_cached():
+    names = ["before", "after"]
+
+    def slow_loader(company_id):
+        rows = [tenant(company_id, "t1", name=names.pop(0))]
+        if names:
+            # NOTE the partition changes after the loader read it but before the rows are cached
+            cache.invalidate(company_id)
+        return rows
+
+    cache = PartitionedCache(name="tenants", loader=slow_loader, partition_by="company_id", primary_key="tenant_id")
+    assert [entity.name for entity in cache.get("company-1")] == ["before"]
+    assert not cache.is_loaded("company-1") and cache.get_entity("t1") is None
+
+    assert [entity.name for entity in cache.get("company-1")] == ["after"]
+    assert cache.is_loaded("company-1") and cache.stats()['loads'] == 1
+
+
+def test_partitioned_cache_warmup_stops_at_the_partition_limit():
+    cache = PartitionedCache(name="tenants", loader=lambda company_id: [tenant(company_id, company_id)],
+                             partition_by="company_id", primary_key="tenant_id", max_partitions=2)
+    cache.warmup(partition_keys=lambda: ["a", "b", "c"], background=False)
+
+    assert cache.stats()['loads'] == 2
+    assert cache.is_loaded("a") and cache.is_loaded("b") and not cache.is_loaded("c")
+
+
+def test_versioned_caches_never_replace_a_newer_entity_with_an_older_read():
+    cache = LRUCache(name="tenants_by_id", key="tenant_id", version="version")
+    cache.upsert(tenant("company-1", "t1", version=2, name="written"))
+    assert cache.put("t1", tenant("company-1", "t1", version=1, name="read")).name == "written"
+    assert cache.upsert(tenant("company-1", "t1", version=3, name="newer")).name == "newer"
+
+    # a write which lands while the partition is being read from the database survives the load
+    partitioned = PartitionedCache(name="tenants", partition_by="company_id", primary_key="tenant_id",
+                                   version="version", loader=lambda company_id: [
+                                       tenant(company_id, "t1", version=1, name="read")])
+    partitioned.get("company-1")
+    partitioned.upsert(tenant("company-1", "t1", version=2, name="written"))
+    partitioned.load("company-1")
+    assert partitioned.get_entity("t1").name == "written"
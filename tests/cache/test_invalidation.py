@@ -0,0 +1,45 @@
+import time
+
+from src.cache import LRUCache
+from src.cache.invalidation import InvalidationBus, SQLiteChangeLog
+
+
+def worker(path: str) -> tuple[InvalidationBus, LRUCache]:
+    bus = InvalidationBus(change_log=SQLiteChangeLog(path=path))
+    cache = LRUCache(name="tenants_by_id")
+    bus.subscribe(cache)
+    return bus, cache
+
+
+def test_changes_published_by_one_worker_invalidate_the_other(tmp_path):
+    path = str(tmp_path / "cache_changes.db")
+    first_bus, first_cache = worker(path=path)
+    second_bus, second_cache = worker(path=path)
+    first_cache.put("t1", "updated")
+    second_cache.put("t1", "stale")
+    second_cache.put("t2", "untouched")
+
+    first_bus.publish(channel="tenants_by_id", key="t1")
+
+    assert first_bus.poll() == 0
+    assert first_cache.get("t1") == "updated"
+    assert second_bus.poll() == 1
+    assert "t1" not in second_cache and second_cache.get("t2") == "untouched"
+
+
+def test_worker_which_missed_pruned_changes_clears_its_caches(tmp_path):
+    path = str(tmp_path / "cache_changes.db")
+    first_bus, _ = worker(path=path)
+    second_bus, second_cache = worker(path=path)
+    first_bus.publish(channel="tenants_by_id", key="t1")
+    second_bus.poll()
+    second_cache.put("t2", "stale")
+
+    first_bus.publish(channel="tenants_by_id", key="t2")
+    first_bus.publish(channel="tenants_by_id", key="t3")
+    SQLiteChangeLog(path=path).prune(older_than=time.time() + 1)
+    first_bus.publish(channel="tenants_by_id", key="t4")
+
+    second_bus.poll()
+    assert len(second_cache) == 0
+    assert second_bus.stats()['resets'] == 1
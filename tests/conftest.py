@@ -0,0 +1,25 @@
+import os
+import socket
+
+# NOTE the settings are read from the environment on import, these defaults allow the tests to run
+# against SQLite on a machine without a .env.development file
+_test_environment = {
+    'SECRET_KEY': 'test-secret-key',
+    'CLIENT_SECRET': 'test-client-secret',
+    'production_sql_db': 'sqlite://',
+    'dev_sql_db': 'sqlite://',
+    'CLOUDFLARE_EMAIL': 'test@rental-manager.site',
+    'CLOUDFLARE_TOKEN': 'test-token',
+    'RESEND_API_KEY': 'test-resend-key',
+    'HOST_ADDRESSES': 'localhost',
+    'PAYFAST_SECRET_KEY': 'test-payfast-key',
+    'FLUTTERWAVE_SECRET_ID': 'test-flutterwave-id',
+    'FLUTTERWAVE_SECRET_KEY': 'test-flutterwave-key',
+    'FLUTTERWAVE_HASH': 'test-flutterwave-hash',
+    'PAYPAL_API_CLIENT_ID': 'test-paypal-id',
+    'PAYPAL_SECRET_KEY': 'test-paypal-key',
+    'DEVELOPMENT_SERVER_NAME': socket.gethostname(),
+}
+
+for _name, _value in _test_environment.items():
+    os.environ.setdefault(_name, _value)
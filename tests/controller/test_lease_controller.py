@@ -0,0 +1,62 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.controller.lease_controller import LeaseController
+from src.database.models.payments import Payment, UpdatePayment
+from src.database.sql import Base
+from src.database.sql.invoices import InvoiceORM, UserChargesORM, InvoiceChargeORM
+from src.database.sql.payments import PaymentORM
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as _session:
+        yield _session
+
+
+def test_mark_charges_as_invoiced_updates_in_bulk_within_the_invoice_transaction(session):
+    for number in range(15):
+        session.add(UserChargesORM(charge_id=f"charge-{number}", property_id="property", tenant_id="tenant",
+                                   unit_id="unit", item_number="water", month=1, amount=100,
+                                   date_of_entry=date(2023, 1, 1), is_invoiced=False))
+    session.commit()
+
+    invoice_orm = InvoiceORM(tenant_id="tenant", service_name="Rental", description="Monthly Rental", currency="R",
+                             discount=0, date_issued=date(2023, 1, 1), due_date=date(2023, 2, 7), month=2,
+                             rental_amount=1000, charge_ids=None)
+    session.add(invoice_orm)
+    session.flush()
+    charge_ids = [f"charge-{number}" for number in range(15)] + ["missing"]
+    marked = asyncio.run(LeaseController.mark_charges_as_invoiced(
+        session=session, invoice_number=invoice_orm.invoice_number, charge_ids=charge_ids))
+
+    assert marked == 15
+    session.rollback()
+    # nothing is persisted until the caller commits the invoice transaction
+    assert session.query(UserChargesORM).filter(UserChargesORM.is_invoiced == True).count() == 0
+    assert session.query(InvoiceChargeORM).count() == 0
+
+
+def test_payment_writes_are_committed_and_written_through_to_the_cache(session):
+    controller = LeaseController(session_maker=sessionmaker(bind=session.get_bind()))
+    payment = Payment(transaction_id="transaction", invoice_number=1, tenant_id="tenant", property_id="property",
+                      unit_id="unit", amount_paid=100, date_paid=date(2023, 1, 1), payment_method="eft",
+                      is_successful=False, month=1, comments="")
+    assert controller.tenant_payments.get("tenant") == []
+
+    added = asyncio.run(controller.add_payment(payment=payment))
+    assert added.version == 1
+    assert controller.tenant_payments.get_entity("transaction") == added
+
+    updated = asyncio.run(controller.update_payment(payment_instance=UpdatePayment(
+        transaction_id="transaction", invoice_number=1, tenant_id="tenant", property_id="property", unit_id="unit",
+        amount_paid=150, date_paid="2023-01-02", payment_method="eft", is_successful=True, comments="paid")))
+    assert updated.version == 2
+    assert session.query(PaymentORM).filter(PaymentORM.is_successful == True).count() == 1
+    assert controller.tenant_payments.get("tenant")[0].amount_paid == 150
@@ -0,0 +1,42 @@
+from src.cron.cli.scheduler import Job, JobContext, Scheduler
+from src.cron.cli.store import SQLiteJobStore
+
+
+def test_failed_runs_resume_from_their_checkpoint_and_durations_are_recorded(tmp_path):
+    store = SQLiteJobStore(path=str(tmp_path / "jobs.db"))
+    seen = []
+
+    async def pages(context: JobContext):
+        for page in range((context.checkpoint or 0) + 1, 4):
+            seen.append(page)
+            if page == 2 and len(seen) == 2:
+                raise ConnectionError("database went away")
+            context.save_progress(page)
+        return dict(pages=len(seen))
+
+    scheduler = Scheduler(jobs=[Job(name="pages", run=pages, interval=60)], store=store)
+    assert scheduler.run_job(job=scheduler.jobs["pages"]) == "failed"
+    assert store.load_checkpoint(name="pages") == 1
+    assert scheduler.run_job(job=scheduler.jobs["pages"]) == "completed"
+    assert seen == [1, 2, 2, 3]
+
+    [status] = store.status()
+    assert status['runs'] == 2 and status['failures'] == 1 and status['checkpoint'] is None
+    assert status['average_duration'] is not None
+    assert scheduler.run_pending() == []
+
+
+def test_a_job_runs_on_one_scheduler_at_a_time(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    runs = []
+
+    async def job(context: JobContext):
+        runs.append(context.name)
+        # NOTE a second scheduler on the host finds the job locked while this run holds it
+        assert other.run_job(job=other.jobs["job"]) is None
+
+    jobs = [Job(name="job", run=job, interval=60)]
+    scheduler = Scheduler(jobs=jobs, store=SQLiteJobStore(path=path))
+    other = Scheduler(jobs=jobs, store=SQLiteJobStore(path=path))
+    assert scheduler.run_job(job=scheduler.jobs["job"]) == "completed"
+    assert runs == ["job"]
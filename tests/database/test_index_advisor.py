@@ -0,0 +1,50 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from src.database.sql import Base
+from src.database.tools.index_advisor import SlowQueryRecorder, advise, predicate_columns
+from src.main.bootstrapping import load_models
+
+
+def test_predicate_columns_reads_where_and_join_clauses():
+    statement = ("SELECT invoices.invoice_number FROM invoices JOIN invoice_charge "
+                 "ON invoice_charge.invoice_number = invoices.invoice_number "
+                 "WHERE invoices.month = ? AND invoices.tenant_id IN (?, ?) ORDER BY invoices.due_date")
+
+    assert predicate_columns(statement) == {("invoice_charge", "invoice_number"), ("invoices", "month"),
+                                            ("invoices", "tenant_id")}
+
+
+def test_failed_statements_leave_no_start_time_behind(tmp_path):
+    log_path = tmp_path / "slow_queries.jsonl"
+    engine = create_engine('sqlite://')
+    SlowQueryRecorder(log_path=str(log_path), threshold_ms=0).install(engine)
+    with engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing_table"))
+        connection.execute(text("SELECT 1"))
+        assert not connection.info
+    assert [json.loads(line)['statement'] for line in log_path.read_text().splitlines()] == ["SELECT 1"]
+
+
+def test_advise_reports_only_uncovered_columns(tmp_path):
+    log_path = tmp_path / "slow_queries.jsonl"
+    engine = create_engine('sqlite://')
+    SlowQueryRecorder(log_path=str(log_path), threshold_ms=0).install(engine)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert json.loads(log_path.read_text().splitlines()[0])['statement'] == "SELECT 1"
+
+    with open(log_path, "a") as log_file:
+        for statement in ("SELECT * FROM invoices WHERE invoices.month = ?",
+                          "SELECT * FROM payments WHERE payments.tenant_id = ?"):
+            log_file.write(json.dumps(dict(statement=statement, duration_ms=250.0)) + "\n")
+
+    load_models()
+    suggestions = advise(log_path=str(log_path), metadata=[Base.metadata])
+
+    assert [(entry['table'], entry['column']) for entry in suggestions] == [("invoices", "month")]
@@ -0,0 +1,105 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from src.database.models.invoices import Invoice
+from src.database.sql import Base
+from src.database.sql.invoices import InvoiceORM, ItemsORM, UserChargesORM, InvoiceChargeORM, hydrate_invoices, \
+    backfill_invoice_charges, backfill_invoice_totals, refresh_invoice_totals
+from src.database.sql.tenants import TenantORM
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as _session:
+        yield _session
+
+
+def add_invoices(session, count: int) -> list[InvoiceORM]:
+    session.add(ItemsORM(property_id="property", item_number="water", description="Water", multiplier=1))
+    for number in range(count):
+        tenant_id = f"tenant-{number}"
+        session.add(TenantORM(tenant_id=tenant_id, name=f"Tenant {number}", email=f"{tenant_id}@mail.com",
+                              cell="0710000000", is_renting=True))
+        charge_ids = []
+        for charge in range(3):
+            charge_id = f"charge-{number}-{charge}"
+            charge_ids.append(charge_id)
+            session.add(UserChargesORM(charge_id=charge_id, property_id="property", tenant_id=tenant_id,
+                                       unit_id="unit", item_number="water", month=1, amount=100 + charge,
+                                       date_of_entry=date(2023, 1, 1), is_invoiced=True))
+        session.add(InvoiceORM(tenant_id=tenant_id, service_name="Rental", description="Monthly Rental",
+                               currency="R", discount=0, date_issued=date(2023, 1, 1), due_date=date(2023, 2, 7),
+                               month=2, rental_amount=1000, charge_ids=",".join(charge_ids)))
+    session.commit()
+    backfill_invoice_charges(session=session)
+    return session.query(InvoiceORM).all()
+
+
+def count_queries(session, callback):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = callback()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
+
+
+def test_hydrate_invoices_resolves_items_and_customers(session):
+    invoices = add_invoices(session, count=2)
+    hydrated = hydrate_invoices(session=session, invoices=invoices)
+
+    assert [invoice['invoice_number'] for invoice in hydrated] == [invoice.invoice_number for invoice in invoices]
+    assert [item['amount'] for item in hydrated[0]['invoice_items']] == [100, 101, 102]
+    assert hydrated[1]['customer']['tenant_id'] == "tenant-1"
+    assert Invoice(**hydrated[0]).total_amount == 1303
+
+
+@pytest.mark.parametrize("count", [1, 40])
+def test_hydrate_invoices_uses_a_constant_number_of_queries(session, count):
+    invoices = add_invoices(session, count=count)
+    hydrated, queries = count_queries(session, lambda: hydrate_invoices(session=session, invoices=invoices))
+
+    assert len(hydrated) == count
+    # one query for the invoiced items and one for the customers regardless of the number of invoices
+    assert queries == 2
+
+
+def test_backfill_invoice_charges_links_legacy_charge_ids_once(session):
+    invoices = add_invoices(session, count=2)
+
+    assert session.query(InvoiceChargeORM).count() == 6
+    assert backfill_invoice_charges(session=session) == 0
+    invoice_charge = session.query(InvoiceChargeORM).filter(InvoiceChargeORM.charge_id == "charge-1-2").one()
+    assert invoice_charge.invoice_number == invoices[1].invoice_number
+
+
+def test_invoice_totals_are_persisted_and_refreshed_when_the_invoice_changes(session):
+    invoices = add_invoices(session, count=2)
+    assert backfill_invoice_totals(session=session) == 2
+
+    invoice = session.get(InvoiceORM, invoices[0].invoice_number)
+    assert (invoice.total_amount, invoice.total_taxes, invoice.amount_payable) == (1303, 195, 1498)
+    version = invoice.version
+
+    invoice.tax_rate = 0
+    refresh_invoice_totals(session=session, invoice_numbers=[invoice.invoice_number])
+    session.commit()
+    assert (invoice.amount_payable, invoice.version) == (1303, version + 2)
+
+    # NOTE the hydrated invoice takes the persisted totals instead of summing its items
+    session.query(ItemsORM).update({ItemsORM.multiplier: 2})
+    hydrated = Invoice(**hydrate_invoices(session=session, invoices=[invoice])[0])
+    assert hydrated.amount_payable == 1303
+    hydrated.refresh_totals()
+    assert hydrated.amount_payable == 1606
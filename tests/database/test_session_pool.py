@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database.session_pool import SessionPool, PoolExhaustedError
+
+engine = create_engine('sqlite://')
+Session = sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def pool():
+    return SessionPool(session_maker=Session, size=2, checkout_timeout=1)
+
+
+def test_sessions_are_returned_to_the_pool(pool):
+    with pool.checkout() as session:
+        first = session
+    with pool.checkout() as session:
+        assert session is first
+
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['checkouts'] == 2
+    assert stats['checked_out'] == 0
+    assert stats['idle'] == 1
+
+
+def test_pool_is_bounded(pool):
+    pool.configure(checkout_timeout=0)
+    with pool.checkout(), pool.checkout():
+        with pytest.raises(PoolExhaustedError):
+            with pool.checkout():
+                pass
+
+    stats = pool.stats()
+    assert stats['exhausted'] == 1
+    assert stats['timeouts'] == 1
+    assert stats['checked_out'] == 0
+
+
+def test_waiting_checkout_gets_released_session(pool):
+    released = threading.Event()
+
+    def hold_session():
+        with pool.checkout():
+            released.wait(timeout=1)
+
+    holders = [threading.Thread(target=hold_session) for _ in range(2)]
+    for holder in holders:
+        holder.start()
+    while pool.stats()['checked_out'] < 2:
+        pass
+
+    threading.Timer(0.05, released.set).start()
+    with pool.checkout() as session:
+        assert session is not None
+
+    for holder in holders:
+        holder.join()
+    stats = pool.stats()
+    assert stats['exhausted'] == 1
+    assert stats['max_wait_time'] > 0
+
+
+def test_idle_sessions_expire(pool):
+    pool.configure(idle_timeout=0)
+    with pool.checkout() as session:
+        first = session
+    with pool.checkout() as session:
+        assert session is not first
+    assert pool.stats()['discarded'] == 1
+
+
+def test_stale_sessions_are_health_checked(pool):
+    pool.configure(ping_after=0)
+    with pool.checkout():
+        pass
+    with pool.checkout():
+        pass
+    assert pool.stats()['failed_health_checks'] == 0
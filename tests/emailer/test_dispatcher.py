@@ -0,0 +1,47 @@
+from src.emailer.dispatcher import MailDispatcher, FileSink
+
+
+class FlakySink(FileSink):
+    name = "flaky"
+
+    def __init__(self, path: str, failures: int):
+        super().__init__(path=path)
+        self.failures = failures
+
+    def send_batch(self, messages: list[dict[str, str]]):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("provider unavailable")
+        super().send_batch(messages)
+
+
+def test_queued_emails_are_batched_into_the_sink(tmp_path):
+    sink = FileSink(path=str(tmp_path / "mail.jsonl"))
+    dispatcher = MailDispatcher(sink=sink, workers=1)
+    assert all(dispatcher.enqueue(params={'to': f"tenant{i}@example.com", 'subject': "Invoice"}) for i in range(20))
+
+    assert dispatcher.flush(timeout=5)
+    assert sorted(mail['to'] for mail in sink.read()) == sorted(f"tenant{i}@example.com" for i in range(20))
+    dispatcher.stop()
+
+
+def test_failed_sends_are_retried_with_backoff_then_given_up(tmp_path):
+    sink = FlakySink(path=str(tmp_path / "mail.jsonl"), failures=2)
+    dispatcher = MailDispatcher(sink=sink, workers=1, backoff=0.01)
+    dispatcher.enqueue(params={'to': "tenant@example.com"})
+    assert dispatcher.flush(timeout=5)
+    assert [mail['to'] for mail in sink.read()] == ["tenant@example.com"]
+    assert dispatcher.stats()['retried'] == 2
+
+    sink.failures = 10
+    dispatcher.enqueue(params={'to': "lost@example.com"})
+    assert dispatcher.flush(timeout=5)
+    assert dispatcher.stats()['failed'] == 1
+    dispatcher.stop()
+
+
+def test_full_queue_rejects_instead_of_blocking(tmp_path):
+    dispatcher = MailDispatcher(sink=FileSink(path=str(tmp_path / "mail.jsonl")), max_queue=1, workers=0)
+    assert dispatcher.enqueue(params={'to': "first@example.com"})
+    assert not dispatcher.enqueue(params={'to': "second@example.com"})
+    assert dispatcher.stats()['rejected'] == 1
@@ -0,0 +1,26 @@
+import ipaddress
+
+from src.firewall.cidr import CIDRMatcher
+
+CIDRS = ['173.245.48.0/20', '103.21.244.0/22', '103.22.200.0/22', '104.16.0.0/13', '104.24.0.0/14',
+         '2400:cb00::/32', '2a06:98c0::/29']
+
+
+def test_matcher_agrees_with_ip_network():
+    matcher = CIDRMatcher(cidrs=CIDRS)
+    addresses = ['173.245.48.0', '173.245.63.255', '173.245.64.0', '103.21.243.255', '103.22.203.255',
+                 '104.23.255.255', '104.28.0.0', '8.8.8.8', '0.0.0.0', '2400:cb00::1', '2a06:98c7:ffff::1',
+                 '2a06:98c8::', '::1']
+    for address in addresses:
+        expected = any(ipaddress.ip_address(address) in ipaddress.ip_network(cidr) for cidr in CIDRS)
+        assert (address in matcher) is expected, address
+
+
+def test_adjacent_ranges_are_merged_and_bad_addresses_rejected():
+    matcher = CIDRMatcher(cidrs=['104.16.0.0/13', '104.24.0.0/14', '10.0.0.0/8', '10.1.0.0/16'])
+    assert matcher._tables[4] == ([int(ipaddress.ip_address('10.0.0.0')), int(ipaddress.ip_address('104.16.0.0'))],
+                                  [int(ipaddress.ip_address('10.255.255.255')),
+                                   int(ipaddress.ip_address('104.27.255.255'))])
+    assert '::ffff:104.16.0.1' in matcher
+    assert None not in matcher and 'not-an-ip' not in matcher
+    assert '8.8.8.8' not in CIDRMatcher()
@@ -0,0 +1,38 @@
+from src.firewall.rate_limit import RateLimit, RateLimiter, LocalBucketStore, SQLiteBucketStore
+
+LIMIT = RateLimit(rate=1.0, burst=2)
+
+
+def test_bucket_refills_at_the_rate_and_expires_once_full():
+    store = LocalBucketStore()
+    assert store.take(key="ip", limit=LIMIT, now=0.0)
+    assert store.take(key="ip", limit=LIMIT, now=0.0)
+    assert not store.take(key="ip", limit=LIMIT, now=0.5)
+    assert store.take(key="ip", limit=LIMIT, now=1.5)
+
+    assert store.take(key="other", limit=LIMIT, now=10.0)
+    assert len(store) == 1
+
+
+def test_routes_have_their_own_budgets_and_counters():
+    limiter = RateLimiter(default=RateLimit(rate=1.0, burst=100), routes={'/dashboard/report': LIMIT})
+    assert [limiter.allow(client_ip="ip", path="/dashboard/report/c1") for _ in range(3)] == [True, True, False]
+    assert limiter.allow(client_ip="ip", path="/dashboard/buildings")
+    assert limiter.allow(client_ip="other", path="/dashboard/report/c1")
+    assert limiter.stats()['limited'] == {'/dashboard/report': 1}
+
+
+def test_route_prefixes_do_not_cover_sibling_routes():
+    limiter = RateLimiter(default=RateLimit(rate=1.0, burst=100), routes={'/dashboard/report': LIMIT})
+    assert limiter.route_limit(path="/dashboard/report") == ('/dashboard/report', LIMIT)
+    assert limiter.route_limit(path="/dashboard/report/monthly-cashflow/c1") == ('/dashboard/report', LIMIT)
+    assert limiter.route_limit(path="/dashboard/reports")[0] == ""
+    assert all(limiter.allow(client_ip="ip", path="/dashboard/reports") for _ in range(3))
+
+
+def test_workers_share_buckets_through_sqlite(tmp_path):
+    path = str(tmp_path / "rate_limit.db")
+    first, second = SQLiteBucketStore(path=path), SQLiteBucketStore(path=path)
+    assert first.take(key="ip", limit=LIMIT, now=0.0)
+    assert second.take(key="ip", limit=LIMIT, now=0.0)
+    assert not first.take(key="ip", limit=LIMIT, now=0.0)
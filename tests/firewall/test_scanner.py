@@ -0,0 +1,27 @@
+import re
+
+from src.firewall import malicious_patterns, attack_keywords
+from src.firewall.scanner import PatternScanner, iter_chunks
+
+
+def test_combined_alternation_matches_like_the_separate_patterns():
+    scanner = PatternScanner(patterns=malicious_patterns)
+    separate = {name: re.compile(pattern) for name, pattern in malicious_patterns.items()}
+    paths = ['/', '/dashboard/buildings', '/../etc/passwd', '..\\windows', '?unix:' + 'A' * 1000,
+             "' OR '1'='1", '-- comment', 'file: x', '<!ENTITY x>', 'SELECT a FROM b UNION SELECT c']
+    hits = 0
+    for path in paths:
+        expected = next((name for name, pattern in separate.items() if pattern.match(path)), None)
+        assert scanner.match(path) == expected, path
+        hits += expected is not None
+    assert hits and sum(scanner.stats().values()) == hits
+
+
+def test_bodies_are_searched_across_chunk_boundaries():
+    scanner = PatternScanner(patterns=attack_keywords, flags=re.IGNORECASE)
+    body = b"x" * 100 + b" sel" + b"ECT 1"
+    assert scanner.search_chunks(iter_chunks(body, chunk_size=102)) == "attack_keywords"
+    assert scanner.search_chunks(iter_chunks(b"colour orange", chunk_size=9)) is None
+    assert scanner.search_chunks(iter_chunks(b"pre" + b"select", chunk_size=3)) is None
+    assert scanner.search_chunks(iter_chunks("café or".encode(), chunk_size=4)) == "attack_keywords"
+    assert scanner.stats() == {"attack_keywords": 2}
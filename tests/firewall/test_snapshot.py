@@ -0,0 +1,41 @@
+import requests
+
+from src.firewall import Firewall
+
+
+def test_edge_ranges_are_restored_from_the_snapshot(tmp_path):
+    snapshot_path = str(tmp_path / "cloudflare_ip_ranges.json")
+    firewall = Firewall()
+    firewall._snapshot_path = snapshot_path
+    assert not firewall.load_snapshot()
+
+    firewall.set_ip_ranges(ip_ranges=['173.245.48.0/20', '2400:cb00::/32'])
+    firewall.save_snapshot()
+
+    restarted = Firewall()
+    restarted._snapshot_path = snapshot_path
+    assert restarted.load_snapshot()
+    assert '173.245.48.1' in restarted.edge_ranges and '2400:cb00::1' in restarted.edge_ranges
+    assert '8.8.8.8' not in restarted.edge_ranges
+
+
+class EmptyResponse:
+    @staticmethod
+    def json():
+        return {'success': False, 'errors': [{'code': 10000}], 'result': None}
+
+
+def test_an_empty_cloudflare_response_keeps_the_last_snapshot(tmp_path, monkeypatch):
+    snapshot_path = str(tmp_path / "cloudflare_ip_ranges.json")
+    firewall = Firewall()
+    firewall._snapshot_path = snapshot_path
+    firewall.set_ip_ranges(ip_ranges=['173.245.48.0/20'])
+    firewall.save_snapshot()
+
+    monkeypatch.setattr(requests.Session, "get", lambda *args, **kwargs: EmptyResponse())
+    assert firewall.get_ip_ranges() == ([], [])
+    assert not firewall.refresh_ip_ranges()
+
+    restarted = Firewall()
+    restarted._snapshot_path = snapshot_path
+    assert restarted.load_snapshot() and restarted.ip_ranges == ['173.245.48.0/20']
@@ -0,0 +1,47 @@
+import threading
+
+from sqlalchemy import create_engine, event, inspect, text
+
+from src.main.bootstrapping import bootstrapper
+
+
+def test_bootstrapper_creates_missing_schema_once_then_skips_inspection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bootstrap.db'}")
+    with engine.begin() as connection:
+        # a payments table created before its indexes were declared
+        connection.execute(text("CREATE TABLE payments (transaction_id VARCHAR(255) PRIMARY KEY, "
+                                "tenant_id VARCHAR(255))"))
+
+    assert bootstrapper(_engine=engine) is True
+    inspector = inspect(engine)
+    assert {"invoice_charge", "payments", "schema_version"} <= set(inspector.get_table_names())
+    assert "ix_payments_tenant_id" in {index['name'] for index in inspector.get_indexes("payments")}
+    assert {"invoice_number", "version"} <= {column['name'] for column in inspector.get_columns("payments")}
+
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    assert bootstrapper(_engine=engine) is False
+    assert len(statements) == 1
+
+
+def test_workers_starting_together_bootstrap_the_schema_once(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'bootstrap.db'}"
+    results, errors = [], []
+
+    def start_worker():
+        try:
+            results.append(bootstrapper(_engine=create_engine(database_url)))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=start_worker) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert sorted(results) == [False, False, False, True]
+    with create_engine(database_url).connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM schema_lock")).scalar() == 0